@@ -0,0 +1,48 @@
+
+
+"""
+Times the image selection strategies over a large set of candidates: building
+the CatalogueTable once, and then scoring every candidate and taking the best
+ones with a partial sort.
+
+    python -m benchmarks.image_selection [number of candidates]
+"""
+
+import sys
+import time
+
+from benchmarks.products import make_products
+from src.CatalogueTable import CatalogueTable
+from src.modules.image_selection import strategies
+
+
+selections = {
+    "latest": ("latest", {}),
+    "lowest_cloud_cover": ("lowest_cloud_cover", {}),
+    "closest_to_date": ("closest_to_date", {"date": "2023-06-01T00:00:00.000Z"}),
+    "most_centered": ("most_centered", {"coordinate": (10.0, 47.5)}),
+    "has_attribute": ("has_attribute", {"attribute": "relativeOrbitNumber", "value": 51}),
+    "contains_polygon": ("contains_polygon", {"polygon": [(10.0, 47.5), (10.1, 47.5), (10.1, 47.6), (10.0, 47.5)]}),
+    "weighted": ({"lowest_cloud_cover": 2, "latest": 1, "most_centered": 1}, {"coordinate": (10.0, 47.5)})
+}
+
+
+
+def main(count: int = 100_000, k: int = 10):
+
+    products = make_products(count)
+
+    start_time = time.perf_counter()
+    table = CatalogueTable.from_products(products)
+    print(f"Table of {count} candidates built in {time.perf_counter() - start_time:.2f} s")
+
+    for name, (strategy, parameters) in selections.items():
+        start_time = time.perf_counter()
+        best = strategies.rank(table, strategy, k=k, **parameters)
+        duration = time.perf_counter() - start_time
+        print(f"{name:>20}: top {len(best)} in {duration * 1000:7.1f} ms")
+
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,88 @@
+
+
+import random
+import uuid
+from datetime import datetime, timedelta
+
+
+def make_products(count: int, seed: int = 0) -> list[dict]:
+    """
+    Builds synthetic Sentinel-2 products with the same structure as the
+    catalogue responses (with their Attributes expanded), to benchmark without
+    calling the API
+
+    Parameters
+    ----------
+    count : int
+        Number of products to build
+    seed : int, optional
+        Seed of the random generator, by default 0
+
+    Returns
+    -------
+    list[dict]
+        Products as returned by the API
+    """
+
+    generator = random.Random(seed)
+    start_date = datetime(2023, 1, 1)
+    products = []
+
+    for index in range(count):
+        sensing = start_date + timedelta(minutes=generator.randint(0, 365 * 24 * 60))
+        sensing_str = sensing.strftime("%Y%m%dT%H%M%S")
+        iso_date = sensing.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+        tile = f"{generator.randint(1, 60):02d}T{''.join(generator.choices('ABCDEFGHJKLMNPQRSTUVWXYZ', k=3))}"
+        orbit = generator.randint(1, 50000)
+
+        lon = generator.uniform(-10, 30)
+        lat = generator.uniform(35, 60)
+        size = generator.uniform(0.5, 1.0)
+        footprint = [[lon, lat], [lon + size, lat], [lon + size, lat + size], [lon, lat + size], [lon, lat]]
+
+        attributes = {
+            "origin": "ESA",
+            "tileId": tile,
+            "cloudCover": round(generator.uniform(0, 100), 2),
+            "datastripId": f"S2A_OPER_MSI_L2A_DS_2APS_{sensing_str}_S{sensing_str}_N05.09",
+            "orbitNumber": orbit,
+            "sourceProduct": f"S2A_OPER_MSI_L2A_TL_2APS_{sensing_str}_A{orbit:06d}_T{tile}_N05.09",
+            "processingDate": iso_date,
+            "productGroupId": "GS2A",
+            "operationalMode": "INS-NOBS",
+            "processingLevel": "S2MSI2A",
+            "processorVersion": "05.09",
+            "granuleIdentifier": f"S2A_OPER_MSI_L2A_TL_2APS_{sensing_str}_A{orbit:06d}_T{tile}_N05.09",
+            "platformShortName": "SENTINEL-2",
+            "instrumentShortName": "MSI",
+            "relativeOrbitNumber": generator.randint(1, 143),
+            "sourceProductOriginDate": iso_date,
+            "platformSerialIdentifier": "A",
+            "productType": "S2MSI2A",
+            "beginningDateTime": iso_date,
+            "endingDateTime": iso_date
+        }
+
+        products.append({
+            "@odata.mediaContentType": "application/octet-stream",
+            "Id": str(uuid.UUID(int=generator.getrandbits(128))),
+            "Name": f"S2A_MSIL2A_{sensing_str}_N0509_R{attributes['relativeOrbitNumber']:03d}_T{tile}_{sensing_str}.SAFE",
+            "ContentType": "application/octet-stream",
+            "ContentLength": generator.randint(100_000_000, 1_200_000_000),
+            "OriginDate": iso_date,
+            "PublicationDate": iso_date,
+            "ModificationDate": iso_date,
+            "Online": True,
+            "EvictionDate": "",
+            "S3Path": f"/eodata/Sentinel-2/MSI/L2A/{index}",
+            "Checksum": [],
+            "ContentDate": {"Start": iso_date, "End": iso_date},
+            "Footprint": "geography'SRID=4326;POLYGON ((...))'",
+            "GeoFootprint": {"type": "Polygon", "coordinates": [footprint]},
+            "Attributes": [
+                {"@odata.type": "#OData.CSC.StringAttribute", "Name": name, "Value": value, "ValueType": "String"}
+                for name, value in attributes.items()
+            ]
+        })
+
+    return products
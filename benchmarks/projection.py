@@ -0,0 +1,89 @@
+
+
+"""
+Compares the size, parse time and memory of full catalogue pages (every
+property and the expanded attributes) with projected ones (only the fields
+selected with compile_projection), over synthetic products.
+
+    python -m benchmarks.projection [number of products]
+"""
+
+import sys
+import json
+import time
+import tracemalloc
+
+from benchmarks.products import make_products
+from src.APIManager import APIManager
+from src.CopernicusRequest import compile_projection
+from src.SatelliteImage import SatelliteImage
+
+
+projections = {
+    "full": None,
+    "download": ["id", "name", "contentLength"],
+    "footprint": ["id", "name", "geofootprint", "ContentDate"],
+    "cloud cover": ["id", "name", "cloudCover"]
+}
+
+
+
+def project(products: list[dict], fields: list[str]) -> list[dict]:
+    """
+    Keeps only the parts of the products the API returns for a projection
+    """
+
+    projection = compile_projection(fields)
+    if "$select=" not in projection:
+        return products
+
+    selected = projection.split("$select=")[1].split("&")[0].split(",")
+    if "$expand=Attributes" in projection:
+        selected.append("Attributes")
+
+    return [{key: product[key] for key in selected if key in product} for product in products]
+
+
+
+def measure(page: str) -> tuple[float, int]:
+    """
+    Parses a page and builds its images
+
+    Returns
+    -------
+    tuple[float, int]
+        Seconds spent and bytes allocated
+    """
+
+    api_manager = APIManager.shared()
+
+    tracemalloc.start()
+    start_time = time.perf_counter()
+
+    images = [SatelliteImage(api_manager=api_manager, **product) for product in json.loads(page)["value"]]
+
+    duration = time.perf_counter() - start_time
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    del images
+    return duration, memory
+
+
+
+def main(count: int = 20_000):
+
+    products = make_products(count)
+    print(f"Parsing {count} products")
+
+    for name, fields in projections.items():
+        page = json.dumps({"value": project(products, fields)})
+        duration, memory = measure(page)
+        print(f"{name:>12}: {len(page) / count:6.0f} B/product in the response, "
+              f"{duration / count * 1e6:5.1f} us/product, {memory / count:6.0f} B/product in memory "
+              f"({compile_projection(fields)})")
+
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20_000)
@@ -0,0 +1,109 @@
+
+
+"""
+Compares the parse time and memory of the slotted SatelliteImage with the
+previous __dict__ based implementation (eager footprint polygon and a match
+statement over the attribute names).
+
+    python -m benchmarks.satellite_image [number of products]
+"""
+
+import sys
+import time
+import tracemalloc
+
+from benchmarks.products import make_products
+from src.APIManager import APIManager
+from src.GeoPolygon import GeoPolygon
+from src.SatelliteImage import SatelliteImage
+
+
+class LegacySatelliteImage:
+    """
+    Parsing logic of SatelliteImage before it was slotted and table-driven
+    """
+
+    def __init__(self, api_manager:APIManager = None, image_path:str = 'tmp/test.jp2', **kwargs):
+
+        self.id                 = kwargs.get("Id", None)
+        self.name               = kwargs.get("Name", None)
+        self.contentType        = kwargs.get("ContentType", None)
+        self.contentLength      = kwargs.get("ContentLength", None)
+        self.originDate         = kwargs.get("OriginDate", None)
+        self.publicationDate    = kwargs.get("PublicationDate", None)
+        self.modificationDate   = kwargs.get("ModificationDate", None)
+        self.online             = kwargs.get("Online", None)
+        geofootprint            = kwargs.get("GeoFootprint", None)
+        self.geofootprint       = geofootprint["coordinates"][0] if geofootprint else None
+        self.polygon            = GeoPolygon(self.geofootprint) if self.geofootprint else None
+
+        for attribute in kwargs.get("Attributes", None) or []:
+            match attribute["Name"]:
+                case "origin": self.origin = attribute["Value"]
+                case "tileId": self.tileId = attribute["Value"]
+                case "cloudCover": self.cloudCover = attribute["Value"]
+                case "datastripId": self.datastripId = attribute["Value"]
+                case "orbitNumber": self.orbitNumber = attribute["Value"]
+                case "sourceProduct": self.sourceProduct = attribute["Value"]
+                case "processingDate": self.processingDate = attribute["Value"]
+                case "productGroupId": self.productGroupId = attribute["Value"]
+                case "operationalMode": self.operationalMode = attribute["Value"]
+                case "processingLevel": self.processingLevel = attribute["Value"]
+                case "processorVersion": self.processorVersion = attribute["Value"]
+                case "granuleIdentifier": self.granuleIdentifier = attribute["Value"]
+                case "platformShortName": self.platformShortName = attribute["Value"]
+                case "instrumentShortName": self.instrumentShortName = attribute["Value"]
+                case "relativeOrbitNumber": self.relativeOrbitNumber = attribute["Value"]
+                case "sourceProductOriginDate": self.sourceProductOriginDate = attribute["Value"]
+                case "platformSerialIdentifier": self.platformSerialIdentifier = attribute["Value"]
+                case "productType": self.productType = attribute["Value"]
+                case "beginningDateTime": self.beginningDateTime = attribute["Value"]
+                case "endingDateTime": self.endingDateTime = attribute["Value"]
+
+        self.api_manager = api_manager
+        self.image_path = image_path
+        self.image_request = None
+
+
+
+def measure(image_class, products: list[dict]) -> tuple[float, int]:
+    """
+    Parses every product with image_class
+
+    Returns
+    -------
+    tuple[float, int]
+        Seconds spent and bytes allocated by the parsed images
+    """
+
+    api_manager = APIManager.shared()
+
+    tracemalloc.start()
+    start_time = time.perf_counter()
+
+    images = [image_class(api_manager=api_manager, **product) for product in products]
+
+    duration = time.perf_counter() - start_time
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    del images
+    return duration, memory
+
+
+
+def main(count: int = 100_000):
+
+    products = make_products(count)
+    print(f"Parsing {count} products")
+
+    for image_class in (LegacySatelliteImage, SatelliteImage):
+        duration, memory = measure(image_class, products)
+        print(f"{image_class.__name__:>22}: {duration:6.2f} s "
+              f"({duration / count * 1e6:5.1f} us/product), {memory / 2**20:7.1f} MiB "
+              f"({memory / count:6.0f} B/product)")
+
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
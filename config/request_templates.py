@@ -17,8 +17,19 @@ class templates:
         "OR": " or "
     }
 
+    token_url = "https://identity.dataspace.copernicus.eu/auth/realms/CDSE/protocol/openid-connect/token"
+    token_client_id = "cdse-public"
+
     base_url = "https://catalogue.dataspace.copernicus.eu/odata/v1/Products?"
     image_base_url = "https://zipper.dataspace.copernicus.eu/odata/v1/Products({product_id})/Nodes"
+
+    # Sentinel-2 SAFE structure, used to predict the TCI node of a product
+    # without walking its nodes
+    s2_granule_name = "{level}_T{tile}_A{orbit}_{datastrip_sensing}"
+    s2_tci_name_l1c = "T{tile}_{sensing}_TCI.jp2"
+    s2_tci_name_l2a = "T{tile}_{sensing}_TCI_60m.jp2"
+    s2_tci_node_l1c = "({product_name})/Nodes(GRANULE)/Nodes({granule_name})/Nodes(IMG_DATA)/Nodes({tci_name})"
+    s2_tci_node_l2a = "({product_name})/Nodes(GRANULE)/Nodes({granule_name})/Nodes(IMG_DATA)/Nodes(R60m)/Nodes({tci_name})"
     filter = "$filter="
 
     query_by_name = "Name {operand} {value}"
@@ -0,0 +1,117 @@
+
+
+
+class settings:
+
+    # HTTP connection pools, one per Copernicus host. Hosts not listed here use
+    # the "default" entry.
+    #   pool_connections: number of distinct pools cached by the adapter
+    #   pool_maxsize: maximum number of connections kept alive per pool
+    #   keep_alive: whether connections are kept open between requests
+    #   connect_timeout / read_timeout: timeouts in seconds
+    #   max_retries: retries on connection errors (not on HTTP errors)
+    http_pools = {
+        "default": {
+            "pool_connections": 4,
+            "pool_maxsize": 10,
+            "keep_alive": True,
+            "connect_timeout": 10,
+            "read_timeout": 60,
+            "max_retries": 3
+        },
+        "catalogue.dataspace.copernicus.eu": {
+            "pool_connections": 4,
+            "pool_maxsize": 20,
+            "keep_alive": True,
+            "connect_timeout": 10,
+            "read_timeout": 60,
+            "max_retries": 3
+        },
+        "zipper.dataspace.copernicus.eu": {
+            "pool_connections": 4,
+            "pool_maxsize": 10,
+            "keep_alive": True,
+            "connect_timeout": 10,
+            "read_timeout": 300,
+            "max_retries": 3
+        }
+    }
+
+    # Segmented downloads: minimum size of each segment (smaller images are
+    # split in fewer segments) and retries of a failed segment
+    segment_min_size = 8 * 1024 * 1024
+    segment_retries = 2
+
+    # Catalogue pagination: $top and $skip limits of the API, number of pages
+    # requested at the same time and order used to keep $skip windows stable
+    catalogue_max_page_size = 1000
+    catalogue_max_skip = 10000
+    catalogue_workers = 8
+    catalogue_page_order = "ContentDate/Start asc"
+
+    # Parse the catalogue pages incrementally from the response stream when
+    # ijson is installed, instead of loading each page whole
+    catalogue_streaming = True
+
+    # Time sharding of long sensing periods: initial number of windows,
+    # maximum products per window (windows with more are split) and minimum
+    # duration of a window in seconds
+    catalogue_shards = 8
+    catalogue_shard_max_products = 10000
+    catalogue_shard_min_seconds = 60
+
+    # Start of the sensing period of open-ended sharded requests: the first
+    # products of each collection, or the default one for other collections
+    catalogue_collection_starts = {
+        "SENTINEL-1": "2014-04-03T00:00:00.000Z",
+        "SENTINEL-2": "2015-06-23T00:00:00.000Z",
+        "SENTINEL-3": "2016-02-16T00:00:00.000Z",
+        "SENTINEL-5P": "2017-10-13T00:00:00.000Z",
+        "default": "1970-01-01T00:00:00.000Z"
+    }
+
+    # Local catalogue cache: SQLite database, seconds an entry is valid for and
+    # maximum size of the stored results
+    catalogue_cache_path = "tmp/catalogue_cache.sqlite"
+    catalogue_cache_ttl = 6 * 3600
+    catalogue_cache_max_bytes = 512 * 1024 * 1024
+
+    # Store of the incremental catalogue syncs (products and watermark of each
+    # saved query)
+    catalogue_sync_path = "tmp/catalogue_sync.sqlite"
+
+    # Cache of resolved product node paths (they never change): SQLite
+    # database and number of entries kept in memory
+    node_cache_enabled = True
+    node_cache_path = "tmp/node_cache.sqlite"
+    node_cache_max_entries = 10000
+
+    # Number of node requests in flight when resolving many images at once
+    resolve_workers = 10
+
+    # Token management: seconds before the access token expires at which it
+    # is refreshed, and timeouts of the identity server requests
+    token_refresh_time_buffer = 60
+    token_connect_timeout = 10
+    token_read_timeout = 30
+
+    # Token file shared by the processes of the same user, so only one of
+    # them requests tokens (directory None means $XDG_RUNTIME_DIR or /tmp)
+    token_cache_enabled = False
+    token_cache_dir = None
+
+    # Mosaic planning: weight of the cloud cover, age and size (ContentLength)
+    # of a product in its cost, relative to a base cost of 1 per product, and
+    # fraction of the AOI that must be covered
+    mosaic_cloud_weight = 1.0
+    mosaic_date_weight = 0.5
+    mosaic_size_weight = 0.5
+    mosaic_min_coverage = 0.99
+
+    # Tiling of large AOIs: maximum coordinates of each tile (bounds the length
+    # of the requests), maximum area of a tile in squared degrees, maximum
+    # quad-tree depth and maximum number of grid cells
+    tiling_max_vertices = 64
+    tiling_max_cell_area = 4.0
+    tiling_max_depth = 6
+    tiling_max_cells = 256
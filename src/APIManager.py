@@ -1,11 +1,19 @@
 
 
 
+import os
+import math
 import time
 import logging
+import threading
 import requests
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 
+from config.request_templates import templates
+from config.settings import settings
 from src.TokenManager import TokenManager
 
 class APIManager:
@@ -14,22 +22,150 @@ class APIManager:
     token generation and expiration
 
     This class manages all communication with the Copernicus API, handeling the
-    token authentication and refreshing in the background. 
-    
-    This class is a singleton, so it should be instantiated only once.
+    token authentication and refreshing in the background. If the API rejects
+    the token (401) it is refreshed and the request is retried once.
+
+    Every host (catalogue, zipper...) gets its own requests.Session with a
+    pool of keep-alive connections configured in config.settings.http_pools,
+    so consecutive requests reuse the same TCP+TLS connection instead of
+    opening a new one each time.
+
+    This class is a singleton: use APIManager.shared() to get the instance of
+    the process instead of building new ones. Building it makes no request,
+    the token is only requested when the first request needs it.
     """
 
+    __instances = {}
+    __instances_lock = threading.Lock()
 
 
-    def __init__(self):
+
+    def __init__(self, pool_settings:dict=None):
 
         self.logger = logging.getLogger(__name__)
 
-        self.token_manager = TokenManager()
-        self.token_manager.start()
+        self.pool_settings = pool_settings if pool_settings else settings.http_pools
+        self.__sessions = {}
+        self.__sessions_lock = threading.Lock()
+
+        self.__token_manager = None
+        self.__token_manager_lock = threading.Lock()
+
+
+
+    @classmethod
+    def shared(cls, name:str="default") -> "APIManager":
+        """
+        Gets the APIManager shared by the whole process, creating it on first
+        use. Several independent instances can be kept under different names.
+
+        Parameters
+        ----------
+        name : str, optional
+            Name of the instance, by default "default"
+
+        Returns
+        -------
+        APIManager
+            Shared instance
+        """
+
+        with cls.__instances_lock:
+            if name not in cls.__instances:
+                cls.__instances[name] = cls()
+            return cls.__instances[name]
+
+
+
+    @property
+    def token_manager(self) -> TokenManager:
+        """
+        TokenManager of the API, created and started the first time a token is
+        needed
+        """
+
+        with self.__token_manager_lock:
+            if self.__token_manager is None:
+                # The token requests also go through a pooled session
+                token_manager = TokenManager(session=self.get_session(templates.token_url))
+                token_manager.start()
+                self.__token_manager = token_manager
+
+            return self.__token_manager
+
+
+
+    def get_session(self, url:str) -> requests.Session:
+        """
+        Gets the pooled session of the host of the given URL, creating it the
+        first time the host is requested
+
+        Parameters
+        ----------
+        url : str
+            URL (or bare host name) to get the session for
+
+        Returns
+        -------
+        requests.Session
+            Session bound to the connection pool of the host
+        """
+
+        host = urlsplit(url).hostname or url
+
+        with self.__sessions_lock:
+            if host not in self.__sessions:
+                self.__sessions[host] = self.__create_session(host)
 
+            return self.__sessions[host]
 
-    def make_request(self, url:str, params:dict={}, headers:dict=None) -> requests.models.Response:
+
+
+    def __create_session(self, host:str) -> requests.Session:
+        """
+        Creates a session with a connection pool configured for the given host
+        """
+
+        pool_settings = self.get_pool_settings(host)
+
+        adapter = HTTPAdapter(pool_connections=pool_settings["pool_connections"],
+                              pool_maxsize=pool_settings["pool_maxsize"],
+                              max_retries=pool_settings["max_retries"])
+
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+
+        if not pool_settings["keep_alive"]:
+            session.headers["Connection"] = "close"
+
+        self.logger.debug(f"Created connection pool for {host} ({pool_settings['pool_maxsize']} connections)")
+        return session
+
+
+
+    def get_pool_settings(self, host:str) -> dict:
+        """
+        Gets the pool settings of a host, filling the missing values with the
+        default ones
+        """
+
+        return {**self.pool_settings["default"], **self.pool_settings.get(host, {})}
+
+
+
+    def get_timeout(self, url:str) -> tuple[float, float]:
+        """
+        Gets the (connect, read) timeout to use for the host of the given URL
+        """
+
+        pool_settings = self.get_pool_settings(urlsplit(url).hostname)
+        return (pool_settings["connect_timeout"], pool_settings["read_timeout"])
+
+
+
+    def make_request(self, url:str, params:dict={}, headers:dict=None,
+                     log_errors:bool=True, stream:bool=False) -> requests.models.Response:
         """
         Sends an specified request to the Copernicus API returning the response
         (as a requests.models.Response object)
@@ -45,27 +181,163 @@ class APIManager:
         headers : dict, optional
             Headers to send in the request, by default None, if None, it uses
             the token headers
-        
+
+        log_errors : bool, optional
+            Whether to log the responses that are not 200, by default True.
+            Disable it for requests that are expected to fail sometimes
+
+        stream : bool, optional
+            Whether to return before downloading the body, to read it
+            incrementally from response.raw (the caller must close the
+            response), by default False
+
         Returns
         -------
         requests.models.Response
             Response of the request
         """
 
-        headers = self.headers if not headers else headers
+        response = self.__get(url, params=params, headers=headers, stream=stream)
 
-        response = requests.get(url, headers=self.headers, params=params)
-        
         # If the response is not 200, log the error and return None
         if response.status_code != 200:
+            if log_errors:
+                self.logger.error(f"Error: {response.status_code}")
+                self.logger.error(response.text)
+            response.close()
+            return None
+
+        return response
+
+
+    def __get(self, url:str, params:dict=None, headers:dict=None, extra_headers:dict=None,
+              stream:bool=False) -> requests.models.Response:
+        """
+        Makes a GET request with the pooled session of the host. If no headers
+        are given the token headers are used, and if the token is rejected
+        (401) it is refreshed and the request retried once.
+        """
+
+        use_token = not headers
+
+        for attempt in range(2):
+            request_headers = {**(self.headers if use_token else headers), **(extra_headers or {})}
+            token = self.token_manager.token if use_token else None
+
+            response = self.get_session(url).get(url, headers=request_headers, params=params,
+                                                 stream=stream, timeout=self.get_timeout(url))
+
+            if response.status_code != 401 or not use_token or attempt:
+                return response
+
+            self.logger.info("Token rejected, refreshing it and retrying the request")
+            response.close()
+            self.token_manager.refresh_if_stale(token)
+
+        return response
+
+
+
+    def open_stream(self, image_url:str, params:dict=None, start:int=0, end:int=None) -> requests.models.Response:
+        """
+        Opens a streamed request to the Copernicus API, optionally starting at
+        a given byte of the resource by means of a Range header.
+
+        The server may ignore the Range header, in that case the response has
+        a 200 status code (instead of 206) and starts at byte 0.
+
+        Parameters
+        ----------
+        image_url : str
+            URL of the image to download
+
+        params : dict, optional
+            Parameters to send in the request, by default None
+
+        start : int, optional
+            First byte to request, by default 0 (the whole resource)
+
+        end : int, optional
+            Last byte to request (inclusive), by default None (up to the end of
+            the resource)
+
+        Returns
+        -------
+        requests.models.Response
+            Open streamed response, with a 200 or 206 status code
+
+        Raises
+        ------
+        requests.HTTPError
+            If the API does not answer with a 200 or 206 status code
+        """
+
+        headers = None
+        if start or end is not None:
+            headers = {"Range": f"bytes={start}-{end if end is not None else ''}"}
+
+        response = self.__get(image_url, params=params, extra_headers=headers, stream=True)
+
+        # If the response is not 200 (or 206), log the error and raise it, so
+        # the caller does not end up with an empty image
+        if response.status_code not in (200, 206):
             self.logger.error(f"Error: {response.status_code}")
             self.logger.error(response.text)
-            return None
+            response.close()
+            response.raise_for_status()
+            raise requests.HTTPError(f"Unexpected status code {response.status_code}", response=response)
 
         return response
-    
 
-    def get_image_stream(self, image_url:str, params:dict=None, block_size:int=1024):
+
+
+    def iter_stream(self, response:requests.models.Response, block_size:int=1024,
+                    show_progress:bool=True, skip:int=0):
+        """
+        Iterates over the content of a streamed response, in blocks of
+        block_size bytes, printing the progress of the download
+
+        Parameters
+        ----------
+        response : requests.models.Response
+            Streamed response returned by open_stream
+
+        block_size : int, optional
+            Size of the blocks to yield, by default 1024
+
+        show_progress : bool, optional
+            Whether to print the progress bar, by default True
+
+        skip : int, optional
+            Number of bytes to drop from the beginning of the stream, by default
+            0. Used when the server ignored a Range header
+
+        Returns
+        -------
+        Generator
+            Generator with the response data stream
+        """
+
+        response_size = int(response.headers.get('content-length', 0))
+
+        with response, tqdm(total=response_size, unit="B", unit_scale=True,
+                            disable=not show_progress) as progress_bar:
+            for data in response.iter_content(block_size):
+                progress_bar.update(len(data))
+
+                if skip:
+                    dropped = min(skip, len(data))
+                    skip -= dropped
+                    data = data[dropped:]
+                    if not data:
+                        continue
+
+                yield data
+
+
+
+    def get_image_stream(self, image_url:str, params:dict=None, block_size:int=1024,
+                         show_progress:bool=True, start:int=0):
         """
         Gets an image from the Copernicus API and returns the response as a
         stream and the total size of the response.
@@ -87,31 +359,230 @@ class APIManager:
 
         block_size : int, optional
             Size of the blocks to download the image, by default 1024
-        
+
+        show_progress : bool, optional
+            Whether to print the progress bar, by default True. Disable it when
+            several downloads run at the same time
+
+        start : int, optional
+            First byte of the image to yield, by default 0. Used to resume
+            interrupted downloads
+
         Returns
         -------
         Generator
             Generator with the image data stream
+
+        Raises
+        ------
+        requests.HTTPError
+            If the API does not answer with a 200 or 206 status code
         """
 
+        response = self.open_stream(image_url, params=params, start=start)
 
-        response = requests.get(image_url, stream=True, headers=self.headers, params=params)
+        # If the server ignored the Range header the stream starts at byte 0
+        skip = start if start and response.status_code == 200 else 0
 
-        # If the response is not 200, log the error and return None
-        if response.status_code != 200:
-            print(f"Error: {response.status_code}")
-            print(response.text)
-            return None, 0
+        yield from self.iter_stream(response, block_size=block_size,
+                                    show_progress=show_progress, skip=skip)
 
-        response_size = int(response.headers.get('content-length', 0))
 
-        with tqdm(total=response_size, unit="B", unit_scale=True) as progress_bar:
-            for data in response.iter_content(block_size):
-                progress_bar.update(len(data))
-                yield data
+
+    def get_range_support(self, image_url:str, params:dict=None) -> int:
+        """
+        Checks whether the server supports Range requests for the given URL,
+        asking for its first byte only
+
+        Parameters
+        ----------
+        image_url : str
+            URL of the image to check
+
+        params : dict, optional
+            Parameters to send in the request, by default None
+
+        Returns
+        -------
+        int
+            Total size of the resource if Range requests are supported, None
+            otherwise
+        """
+
+        response = self.open_stream(image_url, params=params, start=0, end=0)
+        response.close()
+
+        # Content-Range: bytes 0-0/<total size>
+        content_range = response.headers.get('content-range', '')
+        if response.status_code != 206 or '/' not in content_range:
+            return None
+
+        total_size = content_range.rsplit('/', 1)[1]
+        return int(total_size) if total_size.isdigit() else None
+
+
+
+    def download_segmented(self, image_url:str, file_path:str, segments:int=4, params:dict=None,
+                           block_size:int=1024*1024, show_progress:bool=True) -> int:
+        """
+        Downloads an image splitting it in several byte ranges that are fetched
+        concurrently, each one written directly at its offset of a
+        preallocated file.
+
+        Segments smaller than settings.segment_min_size are not worth an extra
+        connection, so small images are split in fewer segments. Each segment
+        is retried settings.segment_retries times, resuming at its last written
+        byte. If a segment still fails the file is removed, as its size does
+        not tell how much of it was written and it can not be resumed.
+
+        Parameters
+        ----------
+        image_url : str
+            URL of the image to download
+
+        file_path : str
+            Path of the file to write, it is overwritten (and removed if the
+            download fails)
+
+        segments : int, optional
+            Maximum number of concurrent segments, by default 4
+
+        params : dict, optional
+            Parameters to send in the requests, by default None
+
+        block_size : int, optional
+            Size of the blocks read from each segment, by default 1MB
+
+        show_progress : bool, optional
+            Whether to print the progress bar, by default True
+
+        Returns
+        -------
+        int
+            Number of bytes written, or None if the server does not support
+            Range requests (nothing is written, the caller should fall back to
+            a single stream)
+        """
+
+        total_size = self.get_range_support(image_url, params=params)
+        if not total_size:
+            self.logger.info(f"Range requests not supported for {image_url}")
+            return None
+
+        segments = max(1, min(segments, math.ceil(total_size / settings.segment_min_size)))
+        segment_size = math.ceil(total_size / segments)
+        ranges = [(start, min(start + segment_size, total_size) - 1)
+                  for start in range(0, total_size, segment_size)]
+
+        self.logger.debug(f"Downloading {total_size} bytes in {len(ranges)} segments")
+
+        progress_lock = threading.Lock()
+        write_lock = threading.Lock()
+
+        with open(file_path, "wb") as image_file, \
+             tqdm(total=total_size, unit="B", unit_scale=True, disable=not show_progress) as progress_bar:
+
+            # Preallocate the file so every segment can be written at its offset
+            image_file.truncate(total_size)
+            file_descriptor = image_file.fileno()
+
+            def write_at(data, offset):
+                if hasattr(os, "pwrite"):
+                    os.pwrite(file_descriptor, data, offset)
+                else:
+                    with write_lock:
+                        image_file.seek(offset)
+                        image_file.write(data)
+
+            def download_range(start, end):
+                offset = start
+                for attempt in range(settings.segment_retries + 1):
+                    try:
+                        response = self.open_stream(image_url, params=params, start=offset, end=end)
+                        if response.status_code != 206:
+                            response.close()
+                            raise requests.HTTPError(f"Range {offset}-{end} answered with {response.status_code}")
+
+                        for data in self.iter_stream(response, block_size=block_size, show_progress=False):
+                            write_at(data, offset)
+                            offset += len(data)
+                            with progress_lock:
+                                progress_bar.update(len(data))
+
+                        if offset == end + 1:
+                            return end + 1 - start
+
+                        raise IOError(f"Range {start}-{end} ended at byte {offset}")
+
+                    except (requests.RequestException, IOError) as e:
+                        if attempt == settings.segment_retries:
+                            raise
+                        self.logger.warning(f"Retrying segment {start}-{end} from byte {offset}: {e}")
+
+            try:
+                with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+                    written_bytes = sum(executor.map(lambda byte_range: download_range(*byte_range), ranges))
+            except BaseException:
+                # The preallocated file has gaps of zeros, never leave it behind
+                image_file.close()
+                os.remove(file_path)
+                raise
+
+        return written_bytes
+
+
+
+    @property
+    def connection_stats(self) -> dict:
+        """
+        Connection reuse statistics of every host requested so far
+
+        For each host it returns the number of HTTP requests made, as counted
+        by its connection pools (so token requests and retries are included),
+        the number of connections opened and how many requests were served by
+        an already open (kept alive) connection.
+
+        Returns
+        -------
+        dict
+            {host: {"requests": int, "connections": int, "reused": int}}
+        """
+
+        stats = {}
+
+        with self.__sessions_lock:
+            for host, session in self.__sessions.items():
+                connections = 0
+                http_requests = 0
+
+                pools = session.get_adapter(f"https://{host}").poolmanager.pools
+                for key in pools.keys():
+                    pool = pools[key]
+                    connections += pool.num_connections
+                    http_requests += pool.num_requests
+
+                stats[host] = {
+                    "requests": http_requests,
+                    "connections": connections,
+                    "reused": max(http_requests - connections, 0)
+                }
+
+        return stats
+
+
+
+    def close(self):
+        """
+        Closes every pooled session and its open connections
+        """
+
+        with self.__sessions_lock:
+            for session in self.__sessions.values():
+                session.close()
+            self.__sessions.clear()
 
 
 
     @property
     def headers(self):
-        return self.token_manager.headers
\ No newline at end of file
+        return self.token_manager.headers
@@ -0,0 +1,311 @@
+
+
+
+import logging
+import asyncio
+import aiohttp
+from urllib.parse import urlsplit
+
+from config.settings import settings
+from src.TokenManager import TokenManager
+from src.APIManager import APIManager
+
+class AsyncAPIManager:
+    """
+    asyncio version of the APIManager, with the same make_request and
+    get_image_stream methods built on aiohttp, so a single event loop can keep
+    hundreds of requests to the Copernicus API in flight.
+
+    Like the APIManager, every host gets its own aiohttp.ClientSession with a
+    pool of keep-alive connections configured in config.settings.http_pools.
+    Sessions are created on first use, inside the running event loop, and must
+    be released with close() (or by using the manager as an async context
+    manager).
+
+    The token is still handled by a TokenManager refreshing it in a background
+    thread (by default the one of the shared APIManager, so the process keeps
+    a single token). Starting it requests the first token with a blocking
+    POST, so it is done in a worker thread (see get_token_manager), when
+    entering the context manager or on the first request. If the API rejects
+    the token (401) it is refreshed and the request (or image stream) is
+    retried once.
+
+    Example
+    -------
+        async with AsyncAPIManager() as api_manager:
+            response = await api_manager.make_request(url)
+            data = await response.json()
+    """
+
+
+
+    def __init__(self, pool_settings:dict=None, token_manager:TokenManager=None):
+
+        self.logger = logging.getLogger(__name__)
+
+        self.pool_settings = pool_settings if pool_settings else settings.http_pools
+        self.__sessions = {}
+
+        self.__token_manager = token_manager
+
+
+
+    async def __aenter__(self):
+        # Get the token before the requests fan out
+        await self.get_token_manager()
+        return self
+
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+
+    def get_pool_settings(self, host:str) -> dict:
+        """
+        Gets the pool settings of a host, filling the missing values with the
+        default ones
+        """
+
+        return {**self.pool_settings["default"], **self.pool_settings.get(host, {})}
+
+
+
+    def get_session(self, url:str) -> aiohttp.ClientSession:
+        """
+        Gets the pooled session of the host of the given URL, creating it the
+        first time the host is requested
+
+        Parameters
+        ----------
+        url : str
+            URL (or bare host name) to get the session for
+
+        Returns
+        -------
+        aiohttp.ClientSession
+            Session bound to the connection pool of the host
+        """
+
+        host = urlsplit(url).hostname or url
+
+        if host not in self.__sessions:
+            pool_settings = self.get_pool_settings(host)
+
+            connector = aiohttp.TCPConnector(limit_per_host=pool_settings["pool_maxsize"],
+                                             force_close=not pool_settings["keep_alive"])
+            timeout = aiohttp.ClientTimeout(sock_connect=pool_settings["connect_timeout"],
+                                            sock_read=pool_settings["read_timeout"])
+
+            self.__sessions[host] = aiohttp.ClientSession(connector=connector, timeout=timeout)
+            self.logger.debug(f"Created async connection pool for {host} ({pool_settings['pool_maxsize']} connections)")
+
+        return self.__sessions[host]
+
+
+
+    async def make_request(self, url:str, params:dict=None, headers:dict=None,
+                           log_errors:bool=True) -> aiohttp.ClientResponse:
+        """
+        Sends an specified request to the Copernicus API returning the response
+        (as an aiohttp.ClientResponse object whose body has already been read,
+        so response.json() and response.text() can be awaited freely)
+
+        Parameters
+        ----------
+        url : str
+            URL of the request
+
+        params : dict, optional
+            Parameters to send in the request, by default None
+
+        headers : dict, optional
+            Headers to send in the request, by default None, if None, it uses
+            the token headers
+
+        log_errors : bool, optional
+            Whether to log the responses that are not 200, by default True
+
+        Returns
+        -------
+        aiohttp.ClientResponse
+            Response of the request, None if its status code is not 200
+        """
+
+        use_token = not headers
+
+        token_manager = await self.get_token_manager() if use_token else None
+
+        for attempt in range(2):
+            request_headers = token_manager.headers if use_token else headers
+            token = token_manager.token if use_token else None
+
+            async with self.get_session(url).get(url, headers=request_headers, params=params) as response:
+                await response.read()
+
+            if response.status != 401 or not use_token or attempt:
+                break
+
+            self.logger.info("Token rejected, refreshing it and retrying the request")
+            await asyncio.to_thread(token_manager.refresh_if_stale, token)
+
+        # If the response is not 200, log the error and return None
+        if response.status != 200:
+            if log_errors:
+                self.logger.error(f"Error: {response.status}")
+                self.logger.error(await response.text())
+            return None
+
+        return response
+
+
+
+    async def get_image_stream(self, image_url:str, params:dict=None, block_size:int=1024, start:int=0):
+        """
+        Gets an image from the Copernicus API, yielding its data in blocks of
+        block_size bytes as an async generator. If the token is rejected (401)
+        it is refreshed and the stream is requested again once
+
+        Parameters
+        ----------
+        image_url : str
+            URL of the image to download
+
+        params : dict, optional
+            Parameters to send in the request, by default None
+
+        block_size : int, optional
+            Size of the blocks to download the image, by default 1024
+
+        start : int, optional
+            First byte of the image to yield, by default 0
+
+        Returns
+        -------
+        AsyncGenerator
+            Async generator with the image data stream
+
+        Raises
+        ------
+        aiohttp.ClientResponseError
+            If the API does not answer with a 200 or 206 status code
+        """
+
+        token_manager = await self.get_token_manager()
+
+        for attempt in range(2):
+            token = token_manager.token
+            headers = token_manager.headers
+            if start:
+                headers = {**headers, "Range": f"bytes={start}-"}
+
+            async with self.get_session(image_url).get(image_url, headers=headers, params=params) as response:
+
+                if response.status == 401 and not attempt:
+                    self.logger.info("Token rejected, refreshing it and retrying the image stream")
+
+                else:
+                    if response.status not in (200, 206):
+                        self.logger.error(f"Error: {response.status}")
+                        self.logger.error(await response.text())
+                        # raise_for_status does not raise for 204 or 3xx, which have no image either
+                        raise aiohttp.ClientResponseError(response.request_info, response.history,
+                                                          status=response.status, message=response.reason,
+                                                          headers=response.headers)
+
+                    # If the server ignored the Range header the stream starts at byte 0
+                    skip = start if start and response.status == 200 else 0
+
+                    async for data in response.content.iter_chunked(block_size):
+                        if skip:
+                            dropped = min(skip, len(data))
+                            skip -= dropped
+                            data = data[dropped:]
+                            if not data:
+                                continue
+
+                        yield data
+
+                    return
+
+            await asyncio.to_thread(token_manager.refresh_if_stale, token)
+
+
+
+    async def gather(self, coroutines:list, max_concurrency:int=None) -> list:
+        """
+        Runs several coroutines concurrently, at most max_concurrency at the
+        same time, returning their results in order
+
+        Parameters
+        ----------
+        coroutines : list
+            Coroutines to run
+
+        max_concurrency : int, optional
+            Maximum number of coroutines running at the same time, by default
+            None (no limit)
+
+        Returns
+        -------
+        list
+            Results of the coroutines, in the same order
+        """
+
+        if not max_concurrency:
+            return await asyncio.gather(*coroutines)
+
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def bounded(coroutine):
+            async with semaphore:
+                return await coroutine
+
+        return await asyncio.gather(*(bounded(coroutine) for coroutine in coroutines))
+
+
+
+    async def close(self):
+        """
+        Closes every pooled session and its open connections
+        """
+
+        for session in self.__sessions.values():
+            await session.close()
+        self.__sessions.clear()
+
+
+
+    async def get_token_manager(self) -> TokenManager:
+        """
+        Gets the TokenManager, starting it in a worker thread the first time
+        so its blocking token request does not stall the event loop (by
+        default the one of the shared APIManager)
+
+        Returns
+        -------
+        TokenManager
+            Started TokenManager
+        """
+
+        if self.__token_manager is None:
+            self.__token_manager = await asyncio.to_thread(lambda: APIManager.shared().token_manager)
+        return self.__token_manager
+
+
+
+    @property
+    def token_manager(self) -> TokenManager:
+        """
+        TokenManager of the manager. It blocks if it was not started yet, use
+        get_token_manager inside the event loop
+        """
+
+        if self.__token_manager is None:
+            self.__token_manager = APIManager.shared().token_manager
+        return self.__token_manager
+
+
+    @property
+    def headers(self):
+        return self.token_manager.headers
@@ -0,0 +1,149 @@
+
+
+
+import time
+import logging
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+
+from config.settings import settings
+from src.APIManager import APIManager
+from src.ImageRequest import ImageRequest
+from src.NodePrediction import predict_tci_node
+from src.SatelliteImage import SatelliteImage
+
+
+@dataclass
+class LevelTiming:
+    """
+    Timing of one level of a batch node resolution
+
+    Attributes
+    ----------
+    level : int
+        Level of the node walk (0 is the first request of every product)
+    requests : int
+        Number of node requests made at this level
+    failed : int
+        Number of those requests that failed
+    duration : float
+        Seconds spent on the level
+    """
+
+    level: int
+    requests: int
+    failed: int
+    duration: float
+
+
+
+def resolve_images(images: list[SatelliteImage],
+                   max_workers: int = None,
+                   api_manager: APIManager = None) -> list[LevelTiming]:
+    """
+    Resolves the final image URL of several products at the same time.
+
+    The node walks of all the products advance level by level: every request
+    of a level (predicted TCI node, product, GRANULE, IMG_DATA...) is made
+    concurrently with at most max_workers requests in flight, and the next
+    level starts once all of them have answered. Products in the node cache
+    make no request at all.
+
+    The resulting ImageRequest is attached to each image (image.image_request),
+    use ImageRequest.is_resolved to check which ones succeeded. An error
+    while resolving one image (a failed connection, an unexpected node
+    listing) only stops the walk of that image, and is kept in
+    ImageRequest.error.
+
+    Parameters
+    ----------
+    images : list[SatelliteImage]
+        Images to resolve
+    max_workers : int, optional
+        Maximum number of concurrent requests, by default
+        settings.resolve_workers
+    api_manager : APIManager, optional
+        APIManager used to make the requests, by default None (the one of each
+        image)
+
+    Returns
+    -------
+    list[LevelTiming]
+        Timing of each level of the walk
+    """
+
+    logger = logging.getLogger(__name__)
+    max_workers = max_workers if max_workers else settings.resolve_workers
+
+    # Walkers of every image, primed with their first URL
+    requests_by_index = {}
+    walkers = {}
+    pending = {}
+    errors = {}
+
+    for index, image in enumerate(images):
+        image_request = ImageRequest(image.id, api_manager if api_manager else image.api_manager,
+                                     resolve=False, predicted_node=predict_tci_node(image))
+        requests_by_index[index] = image_request
+        walkers[index] = image_request.walk_nodes()
+
+        try:
+            pending[index] = next(walkers[index])
+        except StopIteration:
+            pass
+
+    logger.info(f"Resolving {len(images)} images, {len(images) - len(pending)} found in the node cache")
+
+    def fetch(index):
+        url = pending[index]
+        manager = api_manager if api_manager else images[index].api_manager
+
+        try:
+            response = manager.make_request(url, params={},
+                                            log_errors=url != requests_by_index[index].predicted_node)
+            return response.json() if response else None
+        except Exception as e:
+            # Sent to the walk as a failed request
+            logger.warning(f"Error requesting {url}: {e}")
+            errors[index] = f"{type(e).__name__}: {e}"
+            return None
+
+    timings = []
+    level = 0
+    start_time = time.time()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending:
+            level_start_time = time.time()
+            indexes = list(pending)
+            responses = list(executor.map(fetch, indexes))
+
+            next_pending = {}
+            for index, response in zip(indexes, responses):
+                try:
+                    next_pending[index] = walkers[index].send(response)
+                except StopIteration:
+                    pass
+                except Exception as e:
+                    logger.warning(f"Error resolving product {requests_by_index[index].image_id}: {e}")
+                    errors[index] = f"{type(e).__name__}: {e}"
+
+            timings.append(LevelTiming(level=level,
+                                       requests=len(indexes),
+                                       failed=sum(1 for response in responses if response is None),
+                                       duration=time.time() - level_start_time))
+            logger.debug(f"Level {level}: {len(indexes)} requests in {timings[-1].duration:.2f} seconds")
+
+            pending = next_pending
+            level += 1
+
+    for index, image in enumerate(images):
+        image.image_request = requests_by_index[index]
+        if not image.image_request.is_resolved:
+            image.image_request.error = errors.get(index, None)
+
+    resolved = sum(1 for image in images if image.image_request.is_resolved)
+    logger.info(f"{resolved} of {len(images)} images resolved in {time.time() - start_time:.2f} seconds "
+                f"({level} levels)")
+
+    return timings
@@ -0,0 +1,155 @@
+
+
+
+import hashlib
+from urllib.parse import unquote
+
+from config.settings import settings
+from src.SQLiteCache import SQLiteCache
+
+
+class CatalogueCache(SQLiteCache):
+    """
+    Persistent cache of catalogue results, storing the raw products (as
+    returned by the API) of every request.
+
+    Entries are keyed on the normalized request string (see
+    CopernicusRequest.request), so repeating a request is answered locally
+    until the entry is older than ttl seconds.
+
+    Methods
+    -------
+    get_products(request: str, variant: str = "") -> list[dict]
+        Gets the cached products of a request, None if missing or stale
+    put_products(request: str, products: list[dict], variant: str = "") -> None
+        Stores the products of a request
+    all_products() -> list[dict]
+        Gets the products of every cached request, without duplicates
+    """
+
+
+
+    def __init__(self, path: str = None, ttl: float = None, max_bytes: int = None):
+
+        super().__init__(path if path else settings.catalogue_cache_path,
+                         table="catalogue",
+                         ttl=ttl if ttl is not None else settings.catalogue_cache_ttl,
+                         max_bytes=max_bytes if max_bytes is not None else settings.catalogue_cache_max_bytes)
+
+
+
+    @staticmethod
+    def normalize_request(request: str) -> str:
+        """
+        Normalizes a request so equivalent spellings of it share the same
+        cache entry (percent-encoding and repeated whitespace are removed)
+
+        Parameters
+        ----------
+        request : str
+            Request to the Copernicus API
+
+        Returns
+        -------
+        str
+            Normalized request
+        """
+
+        return " ".join(unquote(request).split())
+
+
+
+    def make_key(self, request: str, variant: str = "") -> str:
+        """
+        Builds the cache key of a request
+
+        Parameters
+        ----------
+        request : str
+            Request to the Copernicus API
+        variant : str, optional
+            Extra information that changes the result of the request (e.g.
+            whether all the pages were requested), by default ""
+
+        Returns
+        -------
+        str
+            Key of the request
+        """
+
+        normalized = self.normalize_request(request)
+        return hashlib.sha256(f"{normalized}|{variant}".encode("utf-8")).hexdigest()
+
+
+
+    def get_products(self, request: str, variant: str = "") -> list[dict]:
+        """
+        Gets the cached products of a request
+
+        Parameters
+        ----------
+        request : str
+            Request to the Copernicus API
+        variant : str, optional
+            Variant of the request, by default ""
+
+        Returns
+        -------
+        list[dict]
+            Cached products, None if missing or stale
+        """
+
+        products = self.get(self.make_key(request, variant))
+
+        if products is None:
+            self.logger.debug(f"Catalogue cache miss: {request}")
+        else:
+            self.logger.debug(f"Catalogue cache hit ({len(products)} products): {request}")
+
+        return products
+
+
+
+    def put_products(self, request: str, products: list[dict], variant: str = "") -> None:
+        """
+        Stores the products of a request
+
+        Parameters
+        ----------
+        request : str
+            Request to the Copernicus API
+        products : list[dict]
+            Products returned by the request
+        variant : str, optional
+            Variant of the request, by default ""
+
+        Returns
+        -------
+        None
+        """
+
+        self.put(self.make_key(request, variant), products)
+
+
+
+    def all_products(self) -> list[dict]:
+        """
+        Gets the products of every request in the cache that is not stale,
+        without duplicates (by Id), e.g. to answer spatial questions locally
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        list[dict]
+            Cached products
+        """
+
+        products = {}
+        for cached in self.values():
+            for product in cached:
+                products.setdefault(product["Id"], product)
+
+        return list(products.values())
@@ -0,0 +1,284 @@
+
+
+
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import os
+
+from config.settings import settings
+from src.APIManager import APIManager
+from src.CatalogueCache import CatalogueCache
+from src.CatalogueTable import CatalogueTable
+from src.CopernicusRequest import CopernicusRequest
+from src.FilterCompiler import parse_date, format_date
+
+
+class CatalogueSync:
+    """
+    Incremental synchronization of saved catalogue queries to a local SQLite
+    store, so periodic jobs only request the products published since their
+    last run.
+
+    Every query keeps a watermark: the latest PublicationDate of its stored
+    products (compared as dates, as the API does not always return the same
+    number of fractional digits). The next sync adds a PublicationDate filter
+    from the watermark to the query and appends only the new products to the
+    store. The filter is inclusive (ge) and the store
+    is keyed by Id, so products published in the same millisecond as the
+    watermark are not lost nor duplicated.
+
+    Attributes
+    ----------
+    path : str
+        Path of the SQLite database
+
+    Methods
+    -------
+    sync(filters: list[dict], name: str = None, parallel: bool = False) -> list[dict]
+        Gets the products of a query published since its last sync and stores them
+    products(filters: list[dict] = None, name: str = None) -> list[dict]
+        Gets every stored product of a query
+    table(filters: list[dict] = None, name: str = None) -> CatalogueTable
+        Gets every stored product of a query as a CatalogueTable
+    watermark(filters: list[dict] = None, name: str = None) -> dict
+        Gets the watermark of a query
+    reset(filters: list[dict] = None, name: str = None) -> None
+        Removes the stored products and the watermark of a query
+    """
+
+
+
+    def __init__(self, path: str = None, api_manager: APIManager = None):
+
+        self.logger = logging.getLogger(__name__)
+
+        self.path = path if path else settings.catalogue_sync_path
+        self.api_manager = api_manager
+
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+
+        with self.__lock, self.__connection:
+            self.__connection.execute("""
+                CREATE TABLE IF NOT EXISTS watermarks (
+                    query TEXT PRIMARY KEY,
+                    request TEXT NOT NULL,
+                    publication_date TEXT,
+                    synced REAL NOT NULL
+                )""")
+            self.__connection.execute("""
+                CREATE TABLE IF NOT EXISTS products (
+                    query TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    publication_date TEXT,
+                    PRIMARY KEY (query, id)
+                )""")
+
+
+
+    def query_key(self, filters: list[dict] = None, name: str = None) -> str:
+        """
+        Gets the key of a saved query: its name, or a hash of its normalized
+        request if it has no name
+
+        Parameters
+        ----------
+        filters : list[dict], optional
+            Filters of the query (see CopernicusRequest.add_dict_filters)
+        name : str, optional
+            Name of the query
+
+        Returns
+        -------
+        str
+            Key of the query
+        """
+
+        if name:
+            return name
+
+        request = CopernicusRequest(filters, lazy=True, api_manager=self.api_manager).request
+        return hashlib.sha256(CatalogueCache.normalize_request(request).encode("utf-8")).hexdigest()
+
+
+
+    def sync(self, filters: list[dict], name: str = None, parallel: bool = False) -> list[dict]:
+        """
+        Gets the products of a query published since its last sync (all of
+        them on the first one), stores them and moves its watermark forward.
+        If any page fails nothing is stored and the watermark is not moved,
+        so the next sync requests the same products again.
+
+        Parameters
+        ----------
+        filters : list[dict]
+            Filters of the query (see CopernicusRequest.add_dict_filters)
+        name : str, optional
+            Name of the query, by default None (identified by its filters)
+        parallel : bool, optional
+            Whether to fetch the pages concurrently (see
+            CopernicusRequest.get_products_parallel), by default False
+
+        Returns
+        -------
+        list[dict]
+            Products that were not stored yet, as returned by the API, None if
+            the sync was incomplete
+        """
+
+        key = self.query_key(filters, name)
+        watermark = self.watermark(name=key)
+
+        request = CopernicusRequest(filters, lazy=True, api_manager=self.api_manager)
+        base_request = request.request
+
+        if watermark and watermark["publication_date"]:
+            request.and_filter("publication_date", watermark["publication_date"], ">=")
+            self.logger.info(f"Syncing {key} since {watermark['publication_date']}")
+        else:
+            self.logger.info(f"First sync of {key}, getting every product")
+
+        start_time = time.time()
+        products = request.get_products_parallel() if parallel else request.get_products(get_all_ids=True)
+
+        if products is None or not request.complete:
+            self.logger.error(f"Sync of {key} incomplete, the watermark is not moved")
+            return None
+
+        previous = watermark if watermark else {}
+        publication_dates = [parse_date(date) for date in [previous.get("publication_date")] +
+                             [product.get("PublicationDate", None) for product in products] if date]
+        publication_date = format_date(max(publication_dates)) if publication_dates else None
+
+        new_products = []
+
+        with self.__lock, self.__connection:
+            # Products already stored (e.g. published at the watermark) are
+            # ignored. Their dates are stored in a single format so they sort
+            for product in products:
+                cursor = self.__connection.execute(
+                    "INSERT OR IGNORE INTO products VALUES (?, ?, ?, ?)",
+                    (key, product["Id"], json.dumps(product, separators=(",", ":")),
+                     format_date(parse_date(product["PublicationDate"])) if product.get("PublicationDate") else None))
+                if cursor.rowcount:
+                    new_products.append(product)
+
+            self.__connection.execute(
+                "INSERT OR REPLACE INTO watermarks (query, request, publication_date, synced) VALUES (?, ?, ?, ?)",
+                (key, base_request, publication_date, time.time()))
+
+        self.logger.info(f"{len(new_products)} new products of {key} in {time.time() - start_time} seconds")
+
+        return new_products
+
+
+
+    def watermark(self, filters: list[dict] = None, name: str = None) -> dict:
+        """
+        Gets the watermark of a query
+
+        Parameters
+        ----------
+        filters : list[dict], optional
+            Filters of the query
+        name : str, optional
+            Name of the query
+
+        Returns
+        -------
+        dict
+            request, publication_date and synced (epoch seconds of the last
+            sync), None if the query was never synced
+        """
+
+        key = self.query_key(filters, name)
+
+        with self.__lock, self.__connection:
+            row = self.__connection.execute(
+                "SELECT request, publication_date, synced FROM watermarks WHERE query = ?",
+                (key,)).fetchone()
+
+        if not row:
+            return None
+
+        return dict(zip(("request", "publication_date", "synced"), row))
+
+
+
+    def products(self, filters: list[dict] = None, name: str = None) -> list[dict]:
+        """
+        Gets every stored product of a query, ordered by publication date
+
+        Parameters
+        ----------
+        filters : list[dict], optional
+            Filters of the query
+        name : str, optional
+            Name of the query
+
+        Returns
+        -------
+        list[dict]
+            Stored products, as returned by the API
+        """
+
+        key = self.query_key(filters, name)
+
+        with self.__lock, self.__connection:
+            rows = self.__connection.execute(
+                "SELECT value FROM products WHERE query = ? ORDER BY publication_date", (key,)).fetchall()
+
+        return [json.loads(row[0]) for row in rows]
+
+
+
+    def table(self, filters: list[dict] = None, name: str = None) -> CatalogueTable:
+        """
+        Gets every stored product of a query as a CatalogueTable
+
+        Parameters
+        ----------
+        filters : list[dict], optional
+            Filters of the query
+        name : str, optional
+            Name of the query
+
+        Returns
+        -------
+        CatalogueTable
+            Stored products
+        """
+
+        return CatalogueTable.from_products(self.products(filters, name), api_manager=self.api_manager)
+
+
+
+    def reset(self, filters: list[dict] = None, name: str = None) -> None:
+        """
+        Removes the stored products and the watermark of a query, so the next
+        sync gets every product again
+        """
+
+        key = self.query_key(filters, name)
+
+        with self.__lock, self.__connection:
+            self.__connection.execute("DELETE FROM products WHERE query = ?", (key,))
+            self.__connection.execute("DELETE FROM watermarks WHERE query = ?", (key,))
+
+
+
+    def close(self) -> None:
+        """
+        Closes the connection to the database
+        """
+
+        with self.__lock:
+            self.__connection.close()
@@ -0,0 +1,613 @@
+
+
+
+import numpy as np
+import shapely
+from shapely.geometry import shape
+
+from src.APIManager import APIManager
+from src.SatelliteImage import SatelliteImage
+
+
+class CatalogueTable:
+    """
+    Columnar representation of the products of a catalogue request, holding
+    each field in a NumPy array so whole result sets can be filtered, sorted
+    and ranked with vectorized operations. SatelliteImage objects are only
+    built for the rows that are actually needed (see images).
+
+    Columns
+    -------
+    id, name : object
+        Id and name of the products
+    cloud_cover : float64
+        cloudCover attribute (NaN if missing)
+    sensing_date, publication_date : datetime64[ms]
+        ContentDate/Start and PublicationDate (NaT if missing)
+    content_length : int64
+        ContentLength of the product (-1 if missing)
+    orbit_number, relative_orbit_number : int64
+        orbitNumber and relativeOrbitNumber attributes (-1 if missing)
+    min_x, min_y, max_x, max_y : float64
+        Bounds of the footprint (NaN if missing)
+    area : float64
+        Area of the footprint, in squared degrees like GeoPolygon.area (NaN if
+        missing)
+    attributes : object
+        Attributes of the product by name (a dict per row)
+    product : object
+        Product as returned by the API (or the SatelliteImage it was built
+        from)
+
+    Methods
+    -------
+    from_products(products: list[dict]) -> CatalogueTable
+        Builds the table from the products returned by the API
+    from_images(images: list[SatelliteImage]) -> CatalogueTable
+        Builds the table from SatelliteImage objects
+    take(rows) -> CatalogueTable
+        Gets the given rows
+    filter(mask) -> CatalogueTable
+        Gets the rows where mask is True
+    sort(column, descending=False) -> CatalogueTable
+        Sorts the table by a column
+    top_k(column, k, largest=False) -> CatalogueTable
+        Gets the k rows with the smallest (or largest) values of a column
+    images(rows=None) -> list[SatelliteImage]
+        Builds the SatelliteImage of the given rows
+    geometries(rows=None) -> np.ndarray
+        Builds the shapely footprints of the given rows
+    attribute_mask(attribute, value=None) -> np.ndarray
+        Gets the rows that have an attribute (with a given value, if any)
+    """
+
+    column_types = {
+        "id": object,
+        "name": object,
+        "cloud_cover": np.float64,
+        "sensing_date": "datetime64[ms]",
+        "publication_date": "datetime64[ms]",
+        "content_length": np.int64,
+        "orbit_number": np.int64,
+        "relative_orbit_number": np.int64,
+        "min_x": np.float64,
+        "min_y": np.float64,
+        "max_x": np.float64,
+        "max_y": np.float64,
+        "area": np.float64,
+        "attributes": object,
+        "product": object
+    }
+
+    # Attributes (and properties) of the API stored in a column, with the
+    # value the column has when they are missing
+    attribute_columns = {
+        "Id": ("id", None),
+        "Name": ("name", None),
+        "ContentLength": ("content_length", -1),
+        "cloudCover": ("cloud_cover", np.nan),
+        "orbitNumber": ("orbit_number", -1),
+        "relativeOrbitNumber": ("relative_orbit_number", -1)
+    }
+
+
+
+    def __init__(self, columns: dict, api_manager: APIManager = None):
+        """
+        Parameters
+        ----------
+        columns : dict
+            Arrays of every column in column_types, all of the same length
+        api_manager : APIManager, optional
+            APIManager given to the images built from the table, by default
+            None (the shared APIManager)
+        """
+
+        self.columns = columns
+        self.api_manager = api_manager
+
+
+
+    @classmethod
+    def from_products(cls, products: list[dict], api_manager: APIManager = None) -> "CatalogueTable":
+        """
+        Builds the table from the products returned by the API, in a single
+        pass over them
+
+        Parameters
+        ----------
+        products : list[dict]
+            Products as returned by the API (with their Attributes expanded)
+        api_manager : APIManager, optional
+            APIManager given to the images built from the table
+
+        Returns
+        -------
+        CatalogueTable
+            Table with one row per product
+        """
+
+        rows = {name: [] for name in cls.column_types}
+
+        for product in products:
+            attributes = {attribute["Name"]: attribute["Value"] for attribute in product.get("Attributes", None) or []}
+            content_date = product.get("ContentDate", None) or {}
+
+            cls.__append_row(rows,
+                             id=product.get("Id", None),
+                             name=product.get("Name", None),
+                             cloud_cover=attributes.get("cloudCover", None),
+                             sensing_date=content_date.get("Start", None) or attributes.get("beginningDateTime", None),
+                             publication_date=product.get("PublicationDate", None),
+                             content_length=product.get("ContentLength", None),
+                             orbit_number=attributes.get("orbitNumber", None),
+                             relative_orbit_number=attributes.get("relativeOrbitNumber", None),
+                             geofootprint=product.get("GeoFootprint", None),
+                             attributes=attributes,
+                             product=product)
+
+        return cls(cls.__to_arrays(rows), api_manager=api_manager)
+
+
+
+    @classmethod
+    def from_images(cls, images: list[SatelliteImage]) -> "CatalogueTable":
+        """
+        Builds the table from SatelliteImage objects, which are kept in the
+        product column and returned as they are by images
+
+        Parameters
+        ----------
+        images : list[SatelliteImage]
+            Images to store
+
+        Returns
+        -------
+        CatalogueTable
+            Table with one row per image
+        """
+
+        rows = {name: [] for name in cls.column_types}
+
+        for image in images:
+            ring = image_ring(image)
+            geofootprint = {"type": "Polygon", "coordinates": [ring]} if ring else None
+            attributes = {name: getattr(image, name) for name in SatelliteImage.attribute_fields}
+
+            cls.__append_row(rows,
+                             id=image.id,
+                             name=image.name,
+                             cloud_cover=image.cloudCover,
+                             sensing_date=image.beginningDateTime or image.originDate,
+                             publication_date=image.publicationDate,
+                             content_length=image.contentLength,
+                             orbit_number=image.orbitNumber,
+                             relative_orbit_number=image.relativeOrbitNumber,
+                             geofootprint=geofootprint,
+                             attributes={name: value for name, value in attributes.items() if value is not None},
+                             product=image)
+
+        return cls(cls.__to_arrays(rows))
+
+
+
+    @staticmethod
+    def __append_row(rows: dict, geofootprint: dict, **values) -> None:
+        """
+        Appends the values of a product to the row lists, computing the bounds
+        and area of its footprint
+        """
+
+        for name, value in values.items():
+            rows[name].append(value)
+
+        bounds, area = footprint_bounds_and_area(geofootprint)
+        rows["min_x"].append(bounds[0])
+        rows["min_y"].append(bounds[1])
+        rows["max_x"].append(bounds[2])
+        rows["max_y"].append(bounds[3])
+        rows["area"].append(area)
+
+
+
+    @classmethod
+    def __to_arrays(cls, rows: dict) -> dict:
+        """
+        Converts the row lists to arrays of the column types, replacing the
+        missing values
+        """
+
+        columns = {}
+
+        for name, column_type in cls.column_types.items():
+            values = rows[name]
+
+            if column_type is object:
+                array = np.empty(len(values), dtype=object)
+                array[:] = values
+
+            elif column_type == "datetime64[ms]":
+                array = np.array([value.rstrip("Z") if value else "NaT" for value in values], dtype=column_type)
+
+            elif column_type is np.int64:
+                array = np.array([int(value) if value is not None else -1 for value in values], dtype=column_type)
+
+            else:
+                array = np.array([value if value is not None else np.nan for value in values], dtype=column_type)
+
+            columns[name] = array
+
+        return columns
+
+
+
+    def __len__(self) -> int:
+        return len(self.columns["id"])
+
+
+    def __getitem__(self, column: str) -> np.ndarray:
+        return self.columns[column]
+
+
+    def __repr__(self) -> str:
+        return f"CatalogueTable({len(self)} products)"
+
+
+
+    def take(self, rows) -> "CatalogueTable":
+        """
+        Gets the given rows of the table
+
+        Parameters
+        ----------
+        rows : array-like
+            Indexes of the rows to get, in the order to get them
+
+        Returns
+        -------
+        CatalogueTable
+            Table with the given rows
+        """
+
+        rows = np.asarray(rows, dtype=np.intp)
+        return CatalogueTable({name: column[rows] for name, column in self.columns.items()},
+                              api_manager=self.api_manager)
+
+
+
+    def filter(self, mask) -> "CatalogueTable":
+        """
+        Gets the rows of the table where mask is True
+
+        Parameters
+        ----------
+        mask : array-like of bool
+            Mask with one value per row (e.g. table["cloud_cover"] < 10)
+
+        Returns
+        -------
+        CatalogueTable
+            Table with the selected rows
+        """
+
+        return self.take(np.flatnonzero(mask))
+
+
+
+    def sort(self, column, descending: bool = False) -> "CatalogueTable":
+        """
+        Sorts the table by a column (stable, missing values last)
+
+        Parameters
+        ----------
+        column : str or array-like
+            Name of the column, or an array of values with one per row
+        descending : bool, optional
+            Whether to sort from the biggest to the smallest value, by default
+            False
+
+        Returns
+        -------
+        CatalogueTable
+            Sorted table
+        """
+
+        keys = self.sort_keys(column, descending)
+        return self.take(np.argsort(keys, kind="stable"))
+
+
+
+    def top_k(self, column, k: int, largest: bool = False) -> "CatalogueTable":
+        """
+        Gets the k rows with the smallest (or largest) values of a column,
+        sorted. Only those k rows are sorted (partial sort with argpartition),
+        so it is linear on the size of the table.
+
+        Parameters
+        ----------
+        column : str or array-like
+            Name of the column, or an array of values with one per row (e.g.
+            scores)
+        k : int
+            Number of rows to get
+        largest : bool, optional
+            Whether to get the largest values instead of the smallest, by
+            default False
+
+        Returns
+        -------
+        CatalogueTable
+            Table with the k selected rows, sorted
+        """
+
+        return self.take(top_k_indexes(self.sort_keys(column, largest), k))
+
+
+
+    def sort_keys(self, column, descending: bool = False) -> np.ndarray:
+        """
+        Converts a column to float keys that sort ascending in the requested
+        order, with the missing values (NaN, NaT, -1) at the end
+
+        Parameters
+        ----------
+        column : str or array-like
+            Name of the column, or an array of values with one per row
+        descending : bool, optional
+            Whether the biggest values go first, by default False
+
+        Returns
+        -------
+        np.ndarray
+            Float keys of the rows
+        """
+
+        values = self.columns[column] if isinstance(column, str) else np.asarray(column)
+
+        if np.issubdtype(values.dtype, np.datetime64):
+            missing = np.isnat(values)
+            keys = values.astype("datetime64[ms]").astype(np.int64).astype(np.float64)
+        elif np.issubdtype(values.dtype, np.integer):
+            missing = values < 0
+            keys = values.astype(np.float64)
+        else:
+            keys = values.astype(np.float64)
+            missing = np.isnan(keys)
+
+        keys = -keys if descending else keys.copy()
+        keys[missing] = np.inf
+        return keys
+
+
+
+    def images(self, rows=None) -> list[SatelliteImage]:
+        """
+        Builds the SatelliteImage objects of the given rows
+
+        Parameters
+        ----------
+        rows : array-like, optional
+            Indexes of the rows, by default None (every row)
+
+        Returns
+        -------
+        list[SatelliteImage]
+            Images of the rows, in the given order
+        """
+
+        products = self.columns["product"] if rows is None else self.columns["product"][np.asarray(rows, dtype=np.intp)]
+
+        return [product if isinstance(product, SatelliteImage)
+                else SatelliteImage(api_manager=self.api_manager, **product)
+                for product in products]
+
+
+
+    def attribute_mask(self, attribute: str, value=None) -> np.ndarray:
+        """
+        Gets the rows that have an attribute (with a given value, if any).
+        Attributes stored in a column (see attribute_columns) are compared
+        with a vectorized operation, the rest are looked up in the attributes
+        column; only the rows without them fall back to the properties of the
+        product (or the fields of the image)
+
+        Parameters
+        ----------
+        attribute : str
+            Name of the attribute or property (as in the API, e.g. "tileId")
+        value : optional
+            Value the attribute must have, by default None (any value)
+
+        Returns
+        -------
+        np.ndarray
+            Boolean mask of the rows
+        """
+
+        if attribute in self.attribute_columns:
+            column, missing = self.attribute_columns[attribute]
+            values = self.columns[column]
+
+            if missing is None:
+                found = np.not_equal(values, None)
+            elif missing is np.nan:
+                found = ~np.isnan(values)
+            else:
+                found = values != missing
+
+            return found if value is None else found & (values == value)
+
+        values = [attributes.get(attribute, None) for attributes in self.columns["attributes"]]
+
+        # Not an attribute of every product: a property of the product (e.g.
+        # Online) or a field of the image
+        for row in [row for row, found in enumerate(values) if found is None]:
+            product = self.columns["product"][row]
+            values[row] = getattr(product, attribute, None) if isinstance(product, SatelliteImage) \
+                else product.get(attribute, None)
+
+        if value is None:
+            return np.fromiter((found is not None for found in values), dtype=bool, count=len(values))
+        return np.fromiter((found is not None and found == value for found in values), dtype=bool, count=len(values))
+
+
+
+    def geometries(self, rows=None) -> np.ndarray:
+        """
+        Builds the footprints of the given rows as shapely geometries
+
+        Parameters
+        ----------
+        rows : array-like, optional
+            Indexes of the rows, by default None (every row)
+
+        Returns
+        -------
+        np.ndarray
+            Object array with the footprint of each row (None if missing)
+        """
+
+        products = self.columns["product"] if rows is None else self.columns["product"][np.asarray(rows, dtype=np.intp)]
+        geometries = np.empty(len(products), dtype=object)
+
+        # Simple polygons (the usual footprint) are built all at once from their
+        # coordinates, the rest one by one
+        simple_indexes, coordinates, ring_indexes = [], [], []
+
+        for index, product in enumerate(products):
+            if isinstance(product, SatelliteImage):
+                ring = image_ring(product)
+            else:
+                geofootprint = product.get("GeoFootprint", None)
+                if not geofootprint:
+                    continue
+                if geofootprint.get("type", None) != "Polygon" or len(geofootprint["coordinates"]) != 1:
+                    geometries[index] = shape(geofootprint)
+                    continue
+                ring = geofootprint["coordinates"][0]
+
+            if ring:
+                coordinates.extend(ring)
+                ring_indexes.extend([len(simple_indexes)] * len(ring))
+                simple_indexes.append(index)
+
+        if simple_indexes:
+            rings = shapely.linearrings(np.asarray(coordinates, dtype=np.float64)[:, :2], indices=ring_indexes)
+            geometries[simple_indexes] = shapely.polygons(rings)
+
+        return geometries
+
+
+
+def as_table(images) -> CatalogueTable:
+    """
+    Converts candidates to a CatalogueTable
+
+    Parameters
+    ----------
+    images : CatalogueTable, list[dict] or list[SatelliteImage]
+        Candidates, as a table, products of the API or images
+
+    Returns
+    -------
+    CatalogueTable
+        Candidates as a table
+    """
+
+    if isinstance(images, CatalogueTable):
+        return images
+
+    images = list(images)
+    if images and isinstance(images[0], SatelliteImage):
+        return CatalogueTable.from_images(images)
+    return CatalogueTable.from_products(images)
+
+
+
+def image_ring(image: SatelliteImage) -> list:
+    """
+    Gets the outer ring of the footprint of an image (SatelliteImage keeps the
+    first polygon of MultiPolygon footprints, with its holes)
+    """
+
+    ring = image.geofootprint
+    if ring and isinstance(ring[0][0], list):
+        return ring[0]
+    return ring
+
+
+
+def top_k_indexes(keys: np.ndarray, k: int) -> np.ndarray:
+    """
+    Gets the indexes of the k smallest keys, sorted, with a partial sort
+
+    Parameters
+    ----------
+    keys : np.ndarray
+        Keys of the rows
+    k : int
+        Number of indexes to get
+
+    Returns
+    -------
+    np.ndarray
+        Indexes of the k smallest keys, from the smallest to the biggest
+    """
+
+    k = max(0, min(k, len(keys)))
+    if k == 0:
+        return np.empty(0, dtype=np.intp)
+
+    if k < len(keys):
+        candidates = np.argpartition(keys, k - 1)[:k]
+    else:
+        candidates = np.arange(len(keys))
+
+    return candidates[np.argsort(keys[candidates], kind="stable")]
+
+
+
+def footprint_bounds_and_area(geofootprint: dict) -> tuple[tuple[float, float, float, float], float]:
+    """
+    Computes the bounds and the area (shoelace formula, in squared degrees) of
+    a GeoJSON footprint, Polygon or MultiPolygon (holes are ignored)
+
+    Parameters
+    ----------
+    geofootprint : dict
+        GeoFootprint of a product
+
+    Returns
+    -------
+    tuple[tuple[float, float, float, float], float]
+        (min_x, min_y, max_x, max_y) and area, NaN if there is no footprint
+    """
+
+    missing = ((np.nan, np.nan, np.nan, np.nan), np.nan)
+
+    if not geofootprint or not geofootprint.get("coordinates", None):
+        return missing
+
+    if geofootprint.get("type", "Polygon") == "MultiPolygon":
+        rings = [polygon[0] for polygon in geofootprint["coordinates"] if polygon]
+    else:
+        rings = [geofootprint["coordinates"][0]]
+
+    min_x = min_y = np.inf
+    max_x = max_y = -np.inf
+    area = 0.0
+
+    for ring in rings:
+        xs = [point[0] for point in ring]
+        ys = [point[1] for point in ring]
+        if not xs:
+            continue
+
+        min_x, max_x = min(min_x, min(xs)), max(max_x, max(xs))
+        min_y, max_y = min(min_y, min(ys)), max(max_y, max(ys))
+        area += abs(sum(xs[i] * ys[i + 1] - xs[i + 1] * ys[i] for i in range(len(xs) - 1))) / 2
+
+    if min_x == np.inf:
+        return missing
+
+    return (min_x, min_y, max_x, max_y), area
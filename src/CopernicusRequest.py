@@ -1,13 +1,29 @@
 
 
 
+import math
 import logging
 import requests
+import urllib3
+import shapely
 import time
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import ijson
+except ImportError:     # Pages are parsed whole with response.json()
+    ijson = None
 
 from config.request_templates import templates
+from config.settings import settings
 from src.APIManager import APIManager
 from src.SatelliteImage import SatelliteImage
+from src.CatalogueCache import CatalogueCache
+from src.CatalogueTable import CatalogueTable
+from src.GeoPolygon import as_geometry
+from src.FilterCompiler import FilterTree, Predicate, parse_date, format_date
+from src.modules.polygon_manager.tiling import tile_aoi, to_odata_polygon, from_odata_polygon
 
 class CopernicusRequest:
     """
@@ -18,12 +34,24 @@ class CopernicusRequest:
 
     Attributes
     ----------
-    filters : dict
-        Dictionary with the filters to add to the request
+    filters : list[dict]
+        Filters added to the request (the arguments of add_filter)
+    filter_tree : FilterTree
+        Filters of the request as an AST, normalized and compiled to the
+        canonical $filter of the request (see FilterCompiler.FilterTree)
     request : str
-        Request to make to the Copernicus API
+        Request to make to the Copernicus API, in canonical form: the same
+        filters in any order (or with redundant ones) give the same request,
+        which is also the key of its cache entries
     images: list[dict]
         List of dictionaries with the image objects returned by the request (filtered and parsed)
+    cache : CatalogueCache
+        Local cache of catalogue results, None if the results are not cached
+    complete : bool
+        Whether every page of the last products retrieved was received
+    fields : list[str]
+        Fields requested for every product (see compile_projection), None for
+        all of them. Unknown fields raise a ValueError
 
 
     Methods
@@ -32,26 +60,77 @@ class CopernicusRequest:
         Adds a list of filters to the request
     add_filter(type: str, value: str, operand:str, filterOperator:str = "AND", attribute_name: str = None, attribute_type: str = None, polygon_type: str = None) -> None
         Adds a single filter to the request
-    get_image_ids(get_all_ids:bool, given_request:str=None, depth:int=0, max_depth:int=5) -> list[dict]
+    and_filter(type: str, value: str, operand:str, ...) -> None
+        Adds a filter that must hold together with all the current ones
+    get_images(get_all_ids:bool, given_request:str=None, max_depth:int=None) -> list[SatelliteImage]
         Uses the APIManager to get the image IDs from the Copernicus API (all of them if specified) and parses them
+    iter_pages(get_all_ids:bool=True, given_request:str=None, max_depth:int=None) -> Iterator[list[dict]]
+        Lazily yields the raw products of each page of the request
+    iter_products(get_all_ids:bool=True, given_request:str=None, max_depth:int=None) -> Iterator[dict]
+        Lazily yields the raw products of the request one at a time, parsing them off the response stream
+    iter_images(get_all_ids:bool=True, given_request:str=None, max_depth:int=None) -> Iterator[SatelliteImage]
+        Lazily yields the images of the request as their pages arrive
+    get_images_parallel(given_request:str=None, max_workers:int=None, page_size:int=None) -> list[SatelliteImage]
+        Gets all the images of the request fetching $top/$skip pages concurrently
+    get_products_sharded(shards:int=None, start:str=None, end:str=None) -> list[dict]
+        Gets all the products of the request splitting it in ContentDate/Start windows fetched concurrently
+    get_images_sharded(shards:int=None, start:str=None, end:str=None) -> list[SatelliteImage]
+        Same as get_products_sharded, parsing the products
+    get_products_tiled(aoi=None, method:str="quadtree", max_vertices:int=None) -> list[dict]
+        Gets all the products of the request over a large AOI splitting it in tiles queried concurrently
+    get_images_tiled(aoi=None, method:str="quadtree", max_vertices:int=None) -> list[SatelliteImage]
+        Same as get_products_tiled, parsing the products
+    get_count(given_request:str=None) -> int
+        Gets the number of products matching the request
+    get_products(get_all_ids:bool, given_request:str=None, max_depth:int=None) -> list[dict]
+        Gets the raw products of the request (cached if a cache is set)
+    get_table(get_all_ids:bool=True, parallel:bool=False, shards:int=None) -> CatalogueTable
+        Gets the products of the request as a columnar table
+    get_images_async(api_manager: AsyncAPIManager, get_all_ids: bool) -> list[SatelliteImage]
+        Same as get_images, but awaitable and using an AsyncAPIManager
     parse_image_ids(response: dict) -> list[dict]
         Parse the image IDs from the original data structure to a cleaner one
     """
 
 
     def __init__(self, filters: dict = None,
-                 get_all_ids = False):
+                 get_all_ids = False,
+                 lazy = False,
+                 parallel = False,
+                 cache: CatalogueCache = None,
+                 api_manager: APIManager = None,
+                 shards: int = None,
+                 fields: list[str] = None):
 
         self.logger = logging.getLogger(__name__)   
         self.__request = templates.base_url
-        self.__api_manager = APIManager()
+        self.__api_manager = api_manager if api_manager else APIManager.shared()
+        self.cache = cache
+        self.__pages_failed = False
+
+        # Part of every page request selecting the fields of the products
+        self.fields = fields
+        self.__projection = compile_projection(fields)
         
 
 
-        self.__has_filters = False
+        self.filter_tree = FilterTree()
+        self.__filter_expression = ""
+        self.__matches_nothing = False
+        self.filters : list[dict] = []
 
         self.add_dict_filters(filters) if filters else None
-        self.images : list[SatelliteImage] = self.get_images(get_all_ids=get_all_ids) 
+
+        # If lazy, the images are not requested until get_images (or
+        # get_images_async) is called, or they are iterated with iter_images
+        if lazy:
+            self.images : list[SatelliteImage] = None
+        elif shards and get_all_ids:
+            self.images : list[SatelliteImage] = self.get_images_sharded(shards=shards)
+        elif parallel and get_all_ids:
+            self.images : list[SatelliteImage] = self.get_images_parallel()
+        else:
+            self.images : list[SatelliteImage] = self.get_images(get_all_ids=get_all_ids)
 
 
 
@@ -132,67 +211,74 @@ class CopernicusRequest:
             Type of polygon to filter by (only used if type is polygon)
             Default value: None
 
+        Raises
+        ------
+        ValueError
+            If the type or the operand of the filter is not supported, or its
+            date or numeric value can not be parsed
         """
         
-        # If this is the first filter, use the filter template, if not add the
-        # specified logial operator
-        filter = templates.filter if not self.__has_filters else templates.logical_operators[filterOperator]
-        self.__has_filters = True
-
-
-        # Get the filter type based on the type and format it with the specified values        
-        match type.lower():
-            case "name":
-                filter_type = templates.query_by_name
-                operand_value = templates.operands[operand]
-                new_filter = filter_type.format(operand=operand_value, 
-                                                 value=f"'{value}'"
-                                                 )
-
-            case "collection":
-                filter_type = templates.query_by_collection
-                new_filter = filter_type.format(operand=templates.operands[operand], 
-                                                 value=f"'{value}'"
-                                                 )
-
-            case "publication_date":
-                filter_type = templates.query_by_publication_date
-                new_filter = filter_type.format(operand=templates.operands[operand], 
-                                                 value=f"{value}"
-                                                 )
-
-            case "sensing_date_start":
-                filter_type = templates.query_by_sensing_date_start
-                new_filter = filter_type.format(operand=templates.operands[operand], 
-                                                 value=f"{value}"
-                                                 )
-
-            case "sensing_date_end":
-                filter_type = templates.query_by_sensing_date_end
-                new_filter = filter_type.format(operand=templates.operands[operand], 
-                                                 value=f"{value}"
-                                                 )
-
-            case "polygon":
-                filter_type = templates.query_by_polygon
-                new_filter = filter_type.format(value=f"{value}", 
-                                                 polygon_type=polygon_type
-                                                 )
-
-            case "attribute":
-                filter_type = templates.query_by_attribute
-                new_filter = filter_type.format(operand=templates.operands[operand],
-                                                 value=f"{value}",
-                                                 attribute_name=attribute_name,
-                                                 type=attribute_type
-                                                 )
-            
-            case _:
-                self.logger.error(f"Filter of type \"{type}\" is not supported")
-                new_filter = ""
-
-
-        self.__request += filter + new_filter
+        predicate = self.__make_predicate(type, value, operand, filterOperator,
+                                          attribute_name, attribute_type, polygon_type)
+        self.filter_tree.add(predicate, filterOperator)
+        self.__compile()
+
+
+
+    def __make_predicate(self,
+                         type: str,
+                         value: str,
+                         operand: str,
+                         filterOperator: str,
+                         attribute_name: str = None,
+                         attribute_type: str = None,
+                         polygon_type: str = None) -> Predicate:
+        """
+        Builds the predicate of a filter and records it in the filters
+        attribute (see add_filter for the parameters)
+
+        Returns
+        -------
+        Predicate
+            Predicate of the filter
+
+        Raises
+        ------
+        ValueError
+            If the filter is not valid
+        """
+
+        # Invalid filters raise instead of being dropped, which would widen the request
+        predicate = Predicate(type.lower(), value, operand, attribute_name, attribute_type, polygon_type)
+
+        self.filters.append({'type': type, 'value': value, 'operand': operand, 'filterOperator': filterOperator,
+                             'attribute_name': attribute_name, 'attribute_type': attribute_type,
+                             'polygon_type': polygon_type})
+
+        return predicate
+
+
+
+    def __compile(self) -> None:
+        """
+        Compiles the filter tree to the request, once per added filter
+        instead of once per page request. If the filters can never hold the
+        request is not made (see FilterTree.matches_nothing)
+        """
+
+        self.__filter_expression = self.filter_tree.compile()
+        self.__matches_nothing = self.filter_tree.matches_nothing
+        self.__request = templates.base_url + (templates.filter + self.__filter_expression
+                                               if self.__filter_expression else "")
+
+        if self.__matches_nothing:
+            self.logger.warning("The filters of the request can never hold, no products will be requested")
+
+
+
+    def __skip(self, request:str) -> bool:
+        """ Whether a request is this one and it can not match any product """
+        return self.__matches_nothing and request == self.__request
 
 
     # @property
@@ -201,71 +287,1027 @@ class CopernicusRequest:
 
 
     
+    def iter_pages(self,
+                   get_all_ids:bool = True,
+                   given_request:str = None,
+                   max_depth:int = None):
+        """
+        Lazily iterates over the pages of the request, requesting each page
+        only when the previous one has been consumed.
+
+        Parameters
+        ----------
+        get_all_ids : bool, optional
+            Whether to follow the next page links, by default True. If False
+            only the first page (20 images) is returned
+        given_request : str, optional
+            Request to start from, by default None (the request of this object)
+        max_depth : int, optional
+            Maximum number of next page links to follow, by default None (no
+            limit)
+
+        Yields
+        ------
+        list[dict]
+            Products of each page, as returned by the API
+        """
+
+        request = given_request if given_request else self.__request
+        depth = 0
+        self.__pages_failed = False
+
+        if self.__skip(request):
+            return
+
+        while request:
+            response_json = self.fetch_page(request)
+
+            # If the request failed stop
+            if not response_json:
+                self.__pages_failed = True
+                return
+
+            yield response_json['value']
+
+            request = response_json.get('@odata.nextLink', None) if get_all_ids else None
+
+            if request and max_depth is not None and depth >= max_depth:
+                self.logger.warning(f"Stopped after {depth + 1} pages (max_depth={max_depth}), there are more images left")
+                return
+
+            depth += 1
+
+
+
+    def iter_products(self,
+                      get_all_ids:bool = True,
+                      given_request:str = None,
+                      max_depth:int = None):
+        """
+        Lazily iterates over the products of the request one at a time.
+
+        If ijson is installed (and settings.catalogue_streaming is set), each
+        page is parsed incrementally straight from the response stream: a
+        product is built and yielded as soon as its bytes arrive and the next
+        page link is read at the end, so memory does not depend on the size
+        of the pages nor on the number of products. Otherwise the pages are
+        parsed whole (see iter_pages).
+
+        Parameters
+        ----------
+        get_all_ids : bool, optional
+            Whether to follow the next page links, by default True
+        given_request : str, optional
+            Request to start from, by default None (the request of this object)
+        max_depth : int, optional
+            Maximum number of next page links to follow, by default None (no
+            limit)
+
+        Yields
+        ------
+        dict
+            Products of the request, as returned by the API
+        """
+
+        if ijson is None or not settings.catalogue_streaming:
+            for page in self.iter_pages(get_all_ids=get_all_ids, given_request=given_request, max_depth=max_depth):
+                yield from page
+            return
+
+        request = given_request if given_request else self.__request
+        depth = 0
+        self.__pages_failed = False
+
+        if self.__skip(request):
+            return
+
+        while request:
+            response = self.__api_manager.make_request(request+self.__projection, stream=True)
+
+            # If the request failed stop
+            if not response:
+                self.logger.error(f"Error getting the images of request {request}")
+                self.__pages_failed = True
+                return
+
+            try:
+                next_link = yield from stream_page(response)
+            except (ijson.JSONError, requests.RequestException, urllib3.exceptions.HTTPError) as e:
+                # Errors of the raw stream (e.g. ProtocolError, ReadTimeoutError) are not RequestException
+                self.logger.error(f"Error reading the images of request {request}: {e}")
+                self.__pages_failed = True
+                return
+            finally:
+                response.close()
+
+            request = next_link if get_all_ids else None
+
+            if request and max_depth is not None and depth >= max_depth:
+                self.logger.warning(f"Stopped after {depth + 1} pages (max_depth={max_depth}), there are more images left")
+                return
+
+            depth += 1
+
+
+
+    def fetch_page(self, request:str) -> dict:
+        """
+        Requests a single page of products, with the fields of the request
+        (every property and the expanded attributes by default, see
+        compile_projection)
+
+        Parameters
+        ----------
+        request : str
+            Request of the page
+
+        Returns
+        -------
+        dict
+            JSON response of the page, None if the request failed
+        """
+
+        response = self.__api_manager.make_request(request+self.__projection)
+
+        # If the response is not 200, log the error and return None
+        if not response:
+            self.logger.error(f"Error getting the images of request {request}")
+            return None
+
+        return response.json()
+
+
+
+    def get_count(self, given_request:str = None) -> int:
+        """
+        Gets the total number of products matching the request, using the
+        $count option of the API
+
+        Parameters
+        ----------
+        given_request : str, optional
+            Request to count, by default None (the request of this object)
+
+        Returns
+        -------
+        int
+            Number of products matching the request, None if the API did not
+            return it
+        """
+
+        request = given_request if given_request else self.__request
+        if self.__skip(request):
+            return 0
+
+        response = self.__api_manager.make_request(request+'&$count=True&$top=1&$select=Id')
+
+        if not response:
+            return None
+
+        return response.json().get('@odata.count', None)
+
+
+
+    def get_images_parallel(self,
+                            given_request:str = None,
+                            max_workers:int = None,
+                            page_size:int = None) -> list[SatelliteImage]:
+        """
+        Gets all the images of the request fetching its pages concurrently (see
+        get_products_parallel)
+
+        Parameters
+        ----------
+        given_request : str, optional
+            Request to get, by default None (the request of this object)
+        max_workers : int, optional
+            Maximum number of concurrent page requests, by default
+            settings.catalogue_workers
+        page_size : int, optional
+            Number of products per page, by default
+            settings.catalogue_max_page_size (the maximum allowed by the API)
+
+        Returns
+        -------
+        list[SatelliteImage]
+            List containig the images returned by the request
+        """
+
+        products = self.get_products_parallel(given_request=given_request,
+                                              max_workers=max_workers,
+                                              page_size=page_size)
+        return self.parse_image_ids({'value': products})
+
+
+
+    def get_products_parallel(self,
+                              given_request:str = None,
+                              max_workers:int = None,
+                              page_size:int = None) -> list[dict]:
+        """
+        Gets all the products of the request fetching its pages concurrently.
+
+        First it gets the total number of products with $count, then it plans
+        $top/$skip windows of page_size products and requests them at the same
+        time. The API does not accept $skip values bigger than
+        settings.catalogue_max_skip, so the products beyond the last window are
+        retrieved following the next page links of that window, serially; for
+        requests much bigger than that use get_products_sharded instead. If
+        the count is not available it falls back to following the next page
+        links.
+
+        The pages are merged in order and the products de-duplicated by Id.
+
+        Parameters
+        ----------
+        given_request : str, optional
+            Request to get, by default None (the request of this object)
+        max_workers : int, optional
+            Maximum number of concurrent page requests, by default
+            settings.catalogue_workers
+        page_size : int, optional
+            Number of products per page, by default
+            settings.catalogue_max_page_size (the maximum allowed by the API)
+
+        Returns
+        -------
+        list[dict]
+            Products returned by the request, as returned by the API
+        """
+
+        request = given_request if given_request else self.__request
+        max_workers = max_workers if max_workers else settings.catalogue_workers
+        page_size = page_size if page_size else settings.catalogue_max_page_size
+
+        self.logger.info("Getting image IDs in parallel")
+        start_time = time.time()
+
+        if self.cache:
+            products = self.cache.get_products(request, self.__cache_variant("all:None"))
+            if products is not None:
+                self.__pages_failed = False
+                return products
+
+        count = self.get_count(request)
+        if count is None:
+            self.logger.warning("Product count not available, following the next page links")
+            return self.get_products(get_all_ids=True, given_request=request)
+
+        windows = self.__page_windows(request, count, page_size)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pages = list(executor.map(self.fetch_page, windows))
+
+        products, complete = self.__merge_pages(pages, count)
+        products = unique_products(products)
+
+        self.__pages_failed = not complete
+
+        # Incomplete results are not cached
+        if self.cache and complete:
+            self.cache.put_products(request, products, self.__cache_variant("all:None"))
+
+        self.logger.info(f"{len(products)} of {count} image IDs retrieved in {time.time() - start_time} seconds "
+                         f"({len(windows)} pages)")
+
+        return products
+
+
+
+    def __page_windows(self, request:str, count:int, page_size:int) -> list[str]:
+        """
+        Plans the $top/$skip windows of a request over a stable order, so
+        pages do not overlap. Only the windows below settings.catalogue_max_skip
+        are planned (see __merge_pages for the rest)
+
+        Parameters
+        ----------
+        request : str
+            Request to split
+        count : int
+            Number of products of the request, None if unknown (only the first
+            page is planned)
+        page_size : int
+            Number of products per page
+
+        Returns
+        -------
+        list[str]
+            Request of each page
+        """
+
+        if count is None:
+            return [f"{request}&$orderby={settings.catalogue_page_order}&$top={page_size}"]
+
+        return [f"{request}&$orderby={settings.catalogue_page_order}&$top={page_size}&$skip={skip}"
+                for skip in range(0, min(count, settings.catalogue_max_skip + 1), page_size)]
+
+
+
+    def __merge_pages(self, pages:list[dict], count:int) -> tuple[list[dict], bool]:
+        """
+        Merges the pages of the windows of a request (see __page_windows), in
+        order, following the next page links of the last one if the windows
+        did not reach every product
+
+        Parameters
+        ----------
+        pages : list[dict]
+            JSON responses of the windows, None for the failed ones
+        count : int
+            Number of products of the request, None if unknown
+
+        Returns
+        -------
+        tuple[list[dict], bool]
+            Products of the request and whether all the pages were retrieved
+        """
+
+        products = []
+        for page in pages:
+            if page:
+                products += page['value']
+
+        # Products the $skip windows can not reach
+        complete = all(pages)
+        next_link = pages[-1].get('@odata.nextLink', None) if pages and pages[-1] else None
+        if next_link and (count is None or len(products) < count):
+            for page in self.iter_pages(get_all_ids=True, given_request=next_link):
+                products += page
+            complete = complete and not self.__pages_failed
+
+        return products, complete
+
+
+
+    def get_images_sharded(self,
+                           shards:int = None,
+                           start:str = None,
+                           end:str = None,
+                           max_workers:int = None,
+                           page_size:int = None) -> list[SatelliteImage]:
+        """
+        Gets all the images of the request splitting it in time shards (see
+        get_products_sharded)
+
+        Parameters
+        ----------
+        shards : int, optional
+            Initial number of time windows, by default settings.catalogue_shards
+        start : str, optional
+            Start of the sensing period (ISO 8601), by default the one of the
+            sensing date filters
+        end : str, optional
+            End of the sensing period (ISO 8601), by default the one of the
+            sensing date filters
+        max_workers : int, optional
+            Maximum number of concurrent requests, by default
+            settings.catalogue_workers
+        page_size : int, optional
+            Number of products per page, by default
+            settings.catalogue_max_page_size
+
+        Returns
+        -------
+        list[SatelliteImage]
+            List containig the images returned by the request
+        """
+
+        products = self.get_products_sharded(shards=shards, start=start, end=end,
+                                             max_workers=max_workers, page_size=page_size)
+        return self.parse_image_ids({'value': products})
+
+
+
+    def get_products_sharded(self,
+                             shards:int = None,
+                             start:str = None,
+                             end:str = None,
+                             max_workers:int = None,
+                             page_size:int = None) -> list[dict]:
+        """
+        Gets all the products of a request over a long sensing period,
+        splitting it in ContentDate/Start windows (shards) instead of a long
+        chain of next page links.
+
+        The period is split in shards equal windows and their products are
+        counted concurrently. Windows with more than
+        settings.catalogue_shard_max_products products are split again
+        (proportionally to their count, down to
+        settings.catalogue_shard_min_seconds) and consecutive windows with few
+        products are merged, so every shard can be fetched with $top/$skip
+        windows. Then the pages of every shard are requested concurrently,
+        merged and de-duplicated by Id.
+
+        Each shard is the filter of the request, in parentheses, and the time
+        window, so the other filters (including OR ones) keep their meaning.
+
+        Open-ended periods are sharded too: a missing start defaults to the
+        start of the collection of the request (see
+        settings.catalogue_collection_starts) and a missing end to the
+        current UTC time.
+
+        Parameters
+        ----------
+        shards : int, optional
+            Initial number of time windows, by default settings.catalogue_shards
+        start : str, optional
+            Start of the sensing period (ISO 8601), by default the latest lower
+            bound of the ContentDate/Start filters, or the start of the
+            collection
+        end : str, optional
+            End of the sensing period (ISO 8601), by default the earliest upper
+            bound of the ContentDate/Start and ContentDate/End filters, or the
+            current UTC time
+        max_workers : int, optional
+            Maximum number of concurrent requests, by default
+            settings.catalogue_workers
+        page_size : int, optional
+            Number of products per page, by default
+            settings.catalogue_max_page_size
+
+        Returns
+        -------
+        list[dict]
+            Products returned by the request, as returned by the API
+        """
+
+        shards = shards if shards else settings.catalogue_shards
+        max_workers = max_workers if max_workers else settings.catalogue_workers
+        page_size = page_size if page_size else settings.catalogue_max_page_size
+
+        if self.__matches_nothing:
+            self.__pages_failed = False
+            return []
+
+        start = start if start else self.__sensing_bound(lower=True)
+        end = end if end else self.__sensing_bound(lower=False)
+
+        # Open-ended periods share their cache entry, whatever the current time
+        variant = f"shards:{start}:{end}"
+
+        start = start if start else self.__collection_start()
+        end = end if end else format_date(datetime.now(timezone.utc).replace(tzinfo=None))
+
+        if parse_date(start) > parse_date(end):
+            self.logger.warning(f"Empty sensing period from {start} to {end}")
+            self.__pages_failed = False
+            return []
+
+        if self.cache:
+            products = self.cache.get_products(self.__request, self.__cache_variant(variant))
+            if products is not None:
+                self.__pages_failed = False
+                return products
+
+        self.logger.info(f"Getting image IDs in time shards from {start} to {end}")
+        start_time = time.time()
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            windows = self.__plan_shards(parse_date(start), parse_date(end), shards, executor)
+
+            products, complete, pages = self.__fetch_subrequests(
+                [(self.__shard_request(window_start, window_end, last), count)
+                 for window_start, window_end, last, count in windows],
+                executor, page_size)
+
+        self.__pages_failed = not complete
+
+        # Incomplete results are not cached
+        if self.cache and complete:
+            self.cache.put_products(self.__request, products, self.__cache_variant(variant))
+
+        self.logger.info(f"{len(products)} image IDs retrieved in {time.time() - start_time} seconds "
+                         f"({len(windows)} shards, {pages} pages)")
+
+        return products
+
+
+
+    def __fetch_subrequests(self,
+                            subrequests:list[tuple[str, int]],
+                            executor:ThreadPoolExecutor,
+                            page_size:int) -> tuple[list[dict], bool, int]:
+        """
+        Gets the products of several requests (e.g. time shards or AOI tiles)
+        requesting the $top/$skip pages of all of them at the same time, and
+        merges them de-duplicated by Id
+
+        Parameters
+        ----------
+        subrequests : list[tuple[str, int]]
+            Each request and its number of products (None if unknown)
+        executor : ThreadPoolExecutor
+            Executor used to request the pages
+        page_size : int
+            Number of products per page
+
+        Returns
+        -------
+        tuple[list[dict], bool, int]
+            Products, whether all the pages were retrieved and number of pages
+        """
+
+        request_windows = [self.__page_windows(request, count, page_size) for request, count in subrequests]
+        pages = list(executor.map(self.fetch_page, [window for windows in request_windows for window in windows]))
+
+        products = []
+        complete = True
+        offset = 0
+        for windows, (_, count) in zip(request_windows, subrequests):
+            request_products, request_complete = self.__merge_pages(pages[offset:offset + len(windows)], count)
+            offset += len(windows)
+            products += request_products
+            complete = complete and request_complete
+
+        return unique_products(products), complete, len(pages)
+
+
+
+    def get_images_tiled(self,
+                         aoi = None,
+                         method:str = "quadtree",
+                         max_vertices:int = None,
+                         max_workers:int = None,
+                         page_size:int = None) -> list[SatelliteImage]:
+        """
+        Gets all the images of the request over a large AOI splitting it in
+        tiles (see get_products_tiled)
+
+        Parameters
+        ----------
+        aoi : list[tuple[float]], GeoPolygon or shapely geometry, optional
+            Area of interest, by default the one of the polygon filter
+        method : str, optional
+            Tiling method, "quadtree" or "grid", by default "quadtree"
+        max_vertices : int, optional
+            Maximum number of coordinates of each tile, by default
+            settings.tiling_max_vertices
+        max_workers : int, optional
+            Maximum number of concurrent requests, by default
+            settings.catalogue_workers
+        page_size : int, optional
+            Number of products per page, by default
+            settings.catalogue_max_page_size
+
+        Returns
+        -------
+        list[SatelliteImage]
+            List containig the images returned by the request
+        """
+
+        products = self.get_products_tiled(aoi=aoi, method=method, max_vertices=max_vertices,
+                                           max_workers=max_workers, page_size=page_size)
+        return self.parse_image_ids({'value': products})
+
+
+
+    def get_products_tiled(self,
+                           aoi = None,
+                           method:str = "quadtree",
+                           max_vertices:int = None,
+                           max_workers:int = None,
+                           page_size:int = None) -> list[dict]:
+        """
+        Gets all the products of the request that intersect a large AOI,
+        splitting it in tiles (see tile_aoi) queried at the same time instead
+        of sending the whole polygon in a single request.
+
+        Every tile is simplified to at most max_vertices coordinates, so the
+        length of the requests is bounded. The polygon filters of the request
+        are replaced by the tile (if all the filters are joined with AND),
+        the tiles are counted and their pages requested concurrently, and the
+        results are merged by Id, keeping only the products whose footprint
+        intersects the AOI. AOIs without area (e.g. a point) are requested in
+        a single tile.
+
+        Parameters
+        ----------
+        aoi : list[tuple[float]], GeoPolygon or shapely geometry, optional
+            Area of interest, by default the one of the polygon filter
+        method : str, optional
+            Tiling method, "quadtree" or "grid", by default "quadtree"
+        max_vertices : int, optional
+            Maximum number of coordinates of each tile, by default
+            settings.tiling_max_vertices
+        max_workers : int, optional
+            Maximum number of concurrent requests, by default
+            settings.catalogue_workers
+        page_size : int, optional
+            Number of products per page, by default
+            settings.catalogue_max_page_size
+
+        Returns
+        -------
+        list[dict]
+            Products returned by the request, as returned by the API
+        """
+
+        max_workers = max_workers if max_workers else settings.catalogue_workers
+        page_size = page_size if page_size else settings.catalogue_max_page_size
+
+        if self.__matches_nothing:
+            self.__pages_failed = False
+            return []
+
+        only_and = len(self.filter_tree.groups) <= 1
+        polygon_filters = [predicate for group in self.filter_tree.groups for predicate in group
+                           if predicate.type == "polygon"]
+
+        if aoi is None:
+            if len(set(polygon_filters)) != 1 or not only_and:
+                self.logger.error("An AOI is needed to tile a request without a single polygon filter")
+                return None
+            aoi = from_odata_polygon(polygon_filters[0].polygon_type, polygon_filters[0].value)
+
+        aoi = as_geometry(aoi)
+
+        variant = f"tiles:{method}:{max_vertices}:{aoi.wkt}"
+        if self.cache:
+            products = self.cache.get_products(self.__request, self.__cache_variant(variant))
+            if products is not None:
+                self.__pages_failed = False
+                return products
+
+        # Filter of the request without its polygons, when they can be dropped
+        base_expression = self.filter_tree.without("polygon").compile() if only_and else self.__filter_expression
+
+        # AOIs without area (points, lines) have no tiles, they are requested whole
+        tiles = tile_aoi(aoi, method=method, max_vertices=max_vertices) or [aoi]
+
+        tile_requests = []
+        for tile in tiles:
+            polygon_type, value = to_odata_polygon(tile)
+            tile_filter = templates.query_by_polygon.format(value=value, polygon_type=polygon_type)
+            expression = f"({base_expression}){templates.logical_operators['AND']}{tile_filter}" if base_expression else tile_filter
+            tile_requests.append(templates.base_url + templates.filter + expression)
+
+        self.logger.info(f"Getting image IDs in {len(tiles)} tiles "
+                         f"(longest request {max(len(request) for request in tile_requests)} characters)")
+        start_time = time.time()
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            counts = list(executor.map(self.get_count, tile_requests))
+            products, complete, pages = self.__fetch_subrequests(list(zip(tile_requests, counts)), executor, page_size)
+
+        # The simplified tiles can exceed the AOI
+        footprints = CatalogueTable.from_products(products).geometries()
+        keep = shapely.is_missing(footprints) | shapely.intersects(footprints, aoi)
+        products = [product for product, kept in zip(products, keep) if kept]
+
+        self.__pages_failed = not complete
+
+        # Incomplete results are not cached
+        if self.cache and complete:
+            self.cache.put_products(self.__request, products, self.__cache_variant(variant))
+
+        self.logger.info(f"{len(products)} image IDs retrieved in {time.time() - start_time} seconds "
+                         f"({len(tiles)} tiles, {pages} pages)")
+
+        return products
+
+
+
+    def __plan_shards(self, start:datetime, end:datetime, shards:int, executor:ThreadPoolExecutor) -> list[tuple]:
+        """
+        Splits a sensing period in time windows adapted to the number of
+        products of each one (see get_products_sharded)
+
+        Parameters
+        ----------
+        start : datetime
+            Start of the period
+        end : datetime
+            End of the period
+        shards : int
+            Initial number of windows
+        executor : ThreadPoolExecutor
+            Executor used to count the windows concurrently
+
+        Returns
+        -------
+        list[tuple]
+            (start, end, last, count) of each window, in order. last marks the
+            window that includes the end of the period, count is None if it
+            could not be counted
+        """
+
+        max_products = settings.catalogue_shard_max_products
+        min_duration = timedelta(seconds=settings.catalogue_shard_min_seconds)
+
+        pending = split_period(start, end, shards)
+        windows = []
+
+        while pending:
+            counts = list(executor.map(
+                lambda window: self.get_count(self.__shard_request(window[0], window[1], window[1] == end)),
+                pending))
+
+            next_pending = []
+            for (window_start, window_end), count in zip(pending, counts):
+                if count == 0:
+                    continue
+
+                if count is not None and count > max_products and window_end - window_start >= 2 * min_duration:
+                    parts = min(math.ceil(count / max_products) + 1,
+                                int((window_end - window_start) / min_duration))
+                    next_pending += split_period(window_start, window_end, parts)
+                else:
+                    windows.append((window_start, window_end, window_end == end, count))
+
+            pending = next_pending
+
+        windows.sort(key=lambda window: window[0])
+
+        # Merge consecutive windows while they fit in a shard
+        merged = []
+        for window in windows:
+            if (merged and window[3] is not None and merged[-1][3] is not None
+                    and merged[-1][3] + window[3] <= max_products):
+                previous = merged.pop()
+                window = (previous[0], window[1], window[2], previous[3] + window[3])
+            merged.append(window)
+
+        self.logger.debug(f"Sensing period split in {len(merged)} shards: {[window[3] for window in merged]}")
+
+        return merged
+
+
+
+    def __shard_request(self, start:datetime, end:datetime, last:bool) -> str:
+        """
+        Builds the request of a time window: the filter of this request and
+        ContentDate/Start between start (included) and end (excluded, unless
+        it is the last window)
+        """
+
+        window = (templates.query_by_sensing_date_start.format(operand=templates.operands[">="],
+                                                                value=format_date(start))
+                  + templates.logical_operators["AND"]
+                  + templates.query_by_sensing_date_start.format(operand=templates.operands["<=" if last else "<"],
+                                                                  value=format_date(end)))
+
+        if not self.__filter_expression:
+            return templates.base_url + templates.filter + window
+
+        return templates.base_url + templates.filter + f"({self.__filter_expression})" + templates.logical_operators["AND"] + window
+
+
+
+    def __collection_start(self) -> str:
+        """
+        Gets the start of the sensing period of the collection of the request
+        (the earliest one if it filters several), from
+        settings.catalogue_collection_starts
+        """
+
+        starts = settings.catalogue_collection_starts
+        normalized = self.filter_tree.normalize()
+        predicates = normalized.groups[0].predicates if normalized and len(normalized.groups) == 1 else ()
+
+        collections = [predicate.value.upper() for predicate in predicates
+                       if predicate.type == "collection" and predicate.operand == "=="]
+        if not collections or any(collection not in starts for collection in collections):
+            return starts["default"]
+
+        return min((starts[collection] for collection in collections), key=parse_date)
+
+
+
+    def __sensing_bound(self, lower:bool) -> str:
+        """
+        Gets the bound of the sensing period of the request from its
+        normalized sensing date filters (only when every filter is joined with
+        AND)
+
+        Parameters
+        ----------
+        lower : bool
+            Whether to get the start (lower bound) or the end (upper bound)
+
+        Returns
+        -------
+        str
+            Bound of the period, None if there is none
+        """
+
+        normalized = self.filter_tree.normalize()
+        if normalized is None or len(normalized.groups) != 1:
+            return None
+
+        predicates = normalized.groups[0].predicates
+
+        if lower:
+            bounds = [predicate.value for predicate in predicates
+                      if predicate.type == "sensing_date_start" and predicate.operand in (">", ">=", "==")]
+            return max(bounds, key=parse_date) if bounds else None
+
+        bounds = [predicate.value for predicate in predicates
+                  if predicate.type in ("sensing_date_start", "sensing_date_end")
+                  and predicate.operand in ("<", "<=", "==")]
+        return min(bounds, key=parse_date) if bounds else None
+
+
+
+    def iter_images(self,
+                    get_all_ids:bool = True,
+                    given_request:str = None,
+                    max_depth:int = None):
+        """
+        Lazily iterates over the images of the request, yielding each
+        SatelliteImage as soon as its page arrives, so only one page is kept
+        in memory at a time.
+
+        Parameters
+        ----------
+        get_all_ids : bool, optional
+            Whether to follow the next page links, by default True
+        given_request : str, optional
+            Request to start from, by default None (the request of this object)
+        max_depth : int, optional
+            Maximum number of next page links to follow, by default None (no
+            limit)
+
+        Yields
+        ------
+        SatelliteImage
+            Images returned by the request
+        """
+
+        for product in self.iter_products(get_all_ids=get_all_ids, given_request=given_request, max_depth=max_depth):
+            yield SatelliteImage(api_manager=self.__api_manager, **product)
+
+
+
     def get_images(self,
                       get_all_ids:bool, 
                       given_request:str=None,
-                      depth:int=0,
-                      max_depth:int=5) -> list[SatelliteImage]:
+                      max_depth:int=None) -> list[SatelliteImage]:
         """ 
         Get the image IDs from the Copernicus API
 
-        Recucrsively gets the image IDs from the API if the attribute
+        Gets all the pages of image IDs from the API if the attribute
         get_all_ids is set to True, if not it returns the fist 20 image IDs.
         
         Parameters
         ----------
-        request : str
-            Request to the Copernicus API
         get_all_ids : bool
             Whether to get all the image IDs
-        depth : int
-            Depth of the request
+        given_request : str
+            Request to the Copernicus API, by default None (the request of this
+            object)
         max_depth : int
-            Maximum depth of the request
+            Maximum number of next page links to follow, by default None (no
+            limit)
         
         Returns
         -------
-        list[dict]
-            List containig the imges returned as dictionaries with the image
-            attributes 
+        list[SatelliteImage]
+            List containig the images returned by the request
         """
 
-        # Log the start time if depth is 0
-        if depth == 0:
-            self.logger.info("Getting image IDs") 
-            start_time = time.time()
+        self.logger.info("Getting image IDs") 
+        start_time = time.time()
+
+        if self.cache:
+            images = self.parse_image_ids({'value': self.get_products(get_all_ids=get_all_ids,
+                                                                      given_request=given_request,
+                                                                      max_depth=max_depth)})
+        else:
+            images = list(self.iter_images(get_all_ids=get_all_ids, given_request=given_request, max_depth=max_depth))
+
+        end_time = time.time()
+        self.logger.info(f"{len(images)} image IDs retrieved in {end_time - start_time} seconds")
+
+        return images
+
+
+
+    def get_products(self,
+                     get_all_ids:bool,
+                     given_request:str = None,
+                     max_depth:int = None) -> list[dict]:
+        """
+        Gets the products of the request as returned by the API (without
+        building SatelliteImage objects), from the cache if possible
+
+        Parameters
+        ----------
+        get_all_ids : bool
+            Whether to get all the pages
+        given_request : str, optional
+            Request to the Copernicus API, by default None (the request of this
+            object)
+        max_depth : int, optional
+            Maximum number of next page links to follow, by default None (no
+            limit)
+
+        Returns
+        -------
+        list[dict]
+            Products returned by the request
+        """
 
-        # Make the request to the API
         request = given_request if given_request else self.__request
-        response_json = self.__api_manager.make_request(request+'&$expand=Attributes')
+        variant = f"all:{max_depth}" if get_all_ids else "first"
 
-        # If the response is not 200, log the error and return None
-        if response_json.status_code != 200:
-            self.logger.error(f"Error: {response_json.status_code}")
-            self.logger.error(response_json.text)
-            print(str(request))
-            return None
+        products = self.cache.get_products(request, self.__cache_variant(variant)) if self.cache else None
+        if products is not None:
+            self.__pages_failed = False
+            return products
+
+        products = list(self.iter_products(get_all_ids=get_all_ids, given_request=request, max_depth=max_depth))
+
+        # Incomplete results are not cached
+        if self.cache and not self.__pages_failed:
+            self.cache.put_products(request, products, self.__cache_variant(variant))
+
+        return products
+
+
+
+    def get_table(self,
+                  get_all_ids:bool = True,
+                  parallel:bool = False,
+                  given_request:str = None,
+                  shards:int = None) -> CatalogueTable:
+        """
+        Gets the products of the request as a columnar CatalogueTable, to
+        filter, sort and rank them with vectorized operations. SatelliteImage
+        objects are only built for the rows requested with
+        CatalogueTable.images
+
+        Parameters
+        ----------
+        get_all_ids : bool, optional
+            Whether to get all the pages, by default True
+        parallel : bool, optional
+            Whether to fetch the pages concurrently (see get_products_parallel),
+            by default False
+        given_request : str, optional
+            Request to the Copernicus API, by default None (the request of this
+            object)
+        shards : int, optional
+            Split the request in this number of time shards (see
+            get_products_sharded), by default None (no sharding)
+
+        Returns
+        -------
+        CatalogueTable
+            Table with the products of the request
+        """
+
+        if shards and get_all_ids and not given_request:
+            products = self.get_products_sharded(shards=shards)
+        elif parallel and get_all_ids:
+            products = self.get_products_parallel(given_request=given_request)
+        else:
+            products = self.get_products(get_all_ids=get_all_ids, given_request=given_request)
+
+        return CatalogueTable.from_products(products, api_manager=self.__api_manager)
+
+
+
+    async def get_images_async(self, api_manager, get_all_ids:bool) -> list[SatelliteImage]:
+        """
+        Async version of get_images, making the catalogue requests with an
+        AsyncAPIManager and following the next page links in a loop
+
+        Parameters
+        ----------
+        api_manager : AsyncAPIManager
+            AsyncAPIManager object to make the requests
+        get_all_ids : bool
+            Whether to get all the image IDs
 
-        # Parse the response
-        response_json = response_json.json()
+        Returns
+        -------
+        list[SatelliteImage]
+            List containig the images returned by the request, None if any of
+            the requests failed
+        """
+
+        self.logger.info("Getting image IDs")
+        start_time = time.time()
 
-        # If specified, recursively get next page ids if there are more pages to
-        # get and depth is less than max depth 
-        if '@odata.nextLink' in response_json and depth < max_depth and get_all_ids:
-            next_page_request = response_json['@odata.nextLink']
-            next_page_response = self.get_images(get_all_ids=get_all_ids, given_request=next_page_request, depth=depth+1)
-            response_json['value'] += next_page_response['value']
+        products = []
+        request = None if self.__matches_nothing else self.__request
 
-        # If depth is 0 all the images have been retrieved
-        if depth == 0:
-            end_time = time.time()
-            total_images_recieved = len(response_json['value'])
-            self.logger.info(f"{total_images_recieved} image IDs retrieved in {end_time - start_time} seconds")
+        while request:
+            response = await api_manager.make_request(request+self.__projection)
+            if not response:
+                self.logger.error(f"Error getting images of request {request}")
+                return None
 
-            # Parse all the images retrieved 
-            response_json = self.parse_image_ids(response_json)
+            response_json = await response.json()
+            products += response_json['value']
 
-        return response_json
+            request = response_json.get('@odata.nextLink', None) if get_all_ids else None
+
+        self.logger.info(f"{len(products)} image IDs retrieved in {time.time() - start_time} seconds")
+
+        self.images = self.parse_image_ids({'value': products})
+        return self.images
 
 
 
@@ -296,6 +1338,52 @@ class CopernicusRequest:
     
 
 
+    def and_filter(self,
+                   type: str,
+                   value: str,
+                   operand: str,
+                   attribute_name: str = None,
+                   attribute_type: str = None,
+                   polygon_type: str = None) -> None:
+        """
+        Adds a filter that must hold together with all the current ones. Unlike
+        add_filter, if any of them is joined with OR the new one is added to
+        every OR group, so it applies to all of them (see add_filter for the
+        parameters)
+
+        Returns
+        -------
+        None
+
+        Raises
+        ------
+        ValueError
+            If the filter is not valid (see add_filter)
+        """
+
+        predicate = self.__make_predicate(type, value, operand, "AND",
+                                          attribute_name, attribute_type, polygon_type)
+        self.filter_tree.and_all(predicate)
+        self.__compile()
+
+
+
+    def __cache_variant(self, variant:str) -> str:
+        """
+        Variant of the cache entries of the request: the results of the same
+        request with other fields are cached separately
+        """
+
+        return f"{variant}|{self.__projection}"
+
+
+
+    @property
+    def complete(self) -> bool:
+        """ Whether every page of the last products retrieved was received """
+        return not self.__pages_failed
+
+
     @property 
     def request(self) -> str:
         return self.__request
@@ -303,7 +1391,160 @@ class CopernicusRequest:
 
     def __str__(self):
         return self.__request
-    
 
 
-        
\ No newline at end of file
+
+def unique_products(products: list[dict]) -> list[dict]:
+    """
+    Removes the repeated products of a list (by Id), keeping the order of their
+    first appearance
+
+    Parameters
+    ----------
+    products : list[dict]
+        Products as returned by the API
+
+    Returns
+    -------
+    list[dict]
+        Products without duplicates
+    """
+
+    seen_ids = set()
+    unique = []
+
+    for product in products:
+        if product['Id'] in seen_ids:
+            continue
+        seen_ids.add(product['Id'])
+        unique.append(product)
+
+    return unique
+
+
+
+def split_period(start:datetime, end:datetime, parts:int) -> list[tuple[datetime, datetime]]:
+    """
+    Splits a period in consecutive windows of the same duration
+
+    Parameters
+    ----------
+    start : datetime
+        Start of the period
+    end : datetime
+        End of the period
+    parts : int
+        Number of windows
+
+    Returns
+    -------
+    list[tuple[datetime, datetime]]
+        (start, end) of each window
+    """
+
+    parts = max(1, parts)
+    step = (end - start) / parts
+    bounds = [start + step * index for index in range(parts)] + [end]
+
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+
+def stream_page(response:requests.models.Response):
+    """
+    Parses a page of products incrementally from a streamed response (needs
+    ijson), yielding every product as soon as it is complete
+
+    Parameters
+    ----------
+    response : requests.models.Response
+        Streamed response of the page
+
+    Yields
+    ------
+    dict
+        Products of the page, as returned by the API
+
+    Returns
+    -------
+    str
+        Next page link of the page, None if it is the last one
+    """
+
+    response.raw.decode_content = True
+
+    next_link = None
+    builder = None
+
+    for prefix, event, value in ijson.parse(response.raw, use_float=True):
+        if builder is not None:
+            builder.event(event, value)
+            if prefix == 'value.item' and event == 'end_map':
+                yield builder.value
+                builder = None
+
+        elif prefix == 'value.item' and event == 'start_map':
+            builder = ijson.ObjectBuilder()
+            builder.event(event, value)
+
+        elif prefix == '@odata.nextLink' and event == 'string':
+            next_link = value
+
+    return next_link
+
+
+
+# Properties of the API products that SatelliteImage does not store as a
+# field, but can be selected (see compile_projection)
+product_properties = ("ContentDate", "GeoFootprint", "Footprint", "Checksum", "S3Path", "EvictionDate")
+
+
+
+def compile_projection(fields:list[str] = None) -> str:
+    """
+    Compiles the fields needed of every product to the $select and $expand
+    options of the requests, so the pages only carry those fields. Id and
+    Name are always selected, and the attributes are only expanded if any of
+    the fields is one of them.
+
+    Parameters
+    ----------
+    fields : list[str], optional
+        SatelliteImage fields (e.g. "id", "contentLength", "geofootprint",
+        "cloudCover") or properties of the API (e.g. "ContentDate"), by
+        default None (every property and the attributes)
+
+    Returns
+    -------
+    str
+        Options to append to the requests of the pages
+
+    Raises
+    ------
+    ValueError
+        If any field is neither a SatelliteImage field nor a property of the
+        API products
+    """
+
+    if fields is None:
+        return '&$expand=Attributes'
+
+    api_properties = {field: property for property, field in SatelliteImage.product_fields.items()}
+    api_properties.update({"geofootprint": "GeoFootprint", "polygon": "GeoFootprint"})
+
+    known_fields = (set(api_properties) | set(api_properties.values()) | set(product_properties)
+                    | SatelliteImage.known_attributes | {"Attributes"})
+    unknown_fields = [field for field in fields if field not in known_fields]
+    if unknown_fields:
+        raise ValueError(f"Unknown product fields: {', '.join(unknown_fields)}")
+
+    properties = ["Id", "Name"]
+    expand = False
+
+    for field in fields:
+        if field in SatelliteImage.known_attributes or field == "Attributes":
+            expand = True
+        elif api_properties.get(field, field) not in properties:
+            properties.append(api_properties.get(field, field))
+
+    return f"&$select={','.join(properties)}" + ('&$expand=Attributes' if expand else '')
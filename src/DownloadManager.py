@@ -0,0 +1,199 @@
+
+
+
+import os
+import time
+import logging
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit
+
+from config.request_templates import templates
+from config.settings import settings
+from src.APIManager import APIManager
+from src.SatelliteImage import SatelliteImage
+from src.BatchResolver import resolve_images
+
+
+@dataclass
+class DownloadResult:
+    """
+    Outcome of the download of a single image
+
+    Attributes
+    ----------
+    image : SatelliteImage
+        Image that was downloaded
+    path : str
+        Path where the image was (or should have been) saved
+    bytes : int
+        Number of bytes written to path
+    duration : float
+        Seconds spent resolving the URL and downloading the image
+    error : str
+        Description of the error if the download failed, None otherwise
+    """
+
+    image: SatelliteImage
+    path: str
+    bytes: int = 0
+    duration: float = 0.0
+    error: str = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+
+def image_file_name(image: SatelliteImage) -> str:
+    """
+    Builds the file name used to save an image, based on the product name
+
+    Parameters
+    ----------
+    image : SatelliteImage
+        Image to name
+
+    Returns
+    -------
+    str
+        File name of the image (e.g. S2A_MSIL2A_..._20230204T135003.jp2)
+    """
+
+    name = image.name if image.name else image.id
+    return f"{name.removesuffix('.SAFE')}.jp2"
+
+
+
+def download_image(image: SatelliteImage, image_path: str, block_size: int = 1024,
+                   segments: int = 1, api_manager: APIManager = None) -> DownloadResult:
+    """
+    Resolves the URL of an image and downloads it, catching any error so it can
+    be reported instead of raised
+
+    Parameters
+    ----------
+    image : SatelliteImage
+        Image to download
+    image_path : str
+        Path to save the image
+    block_size : int, optional
+        Size of the blocks to download the image, by default 1024
+    segments : int, optional
+        Number of concurrent byte ranges of the image, by default 1
+    api_manager : APIManager, optional
+        APIManager used for the requests, by default None (the one of the
+        image)
+
+    Returns
+    -------
+    DownloadResult
+        Result of the download
+    """
+
+    result = DownloadResult(image=image, path=image_path)
+    start_time = time.time()
+
+    try:
+        if not image.image_request:
+            image.get_image_url(api_manager)
+
+        if not image.image_request.is_resolved:
+            reason = f": {image.image_request.error}" if image.image_request.error else ""
+            raise RuntimeError(f"Could not resolve the image URL of product {image.id}{reason}")
+
+        result.bytes = image.download(block_size=block_size, image_path=image_path,
+                                      show_progress=False, segments=segments, api_manager=api_manager)
+
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+
+    result.duration = time.time() - start_time
+    return result
+
+
+
+def download_many(images: list[SatelliteImage],
+                  dest_dir: str,
+                  max_workers: int = 4,
+                  api_manager: APIManager = None,
+                  block_size: int = 1024 * 1024,
+                  segments: int = 1) -> list[DownloadResult]:
+    """
+    Downloads a list of images concurrently, with at most max_workers images
+    being resolved and streamed at the same time.
+
+    The URLs of the images that were not resolved yet are resolved all
+    together beforehand (see BatchResolver.resolve_images), with
+    settings.resolve_workers concurrent requests. A failed image
+    does not stop the rest of the downloads, its error is reported in its
+    DownloadResult.
+
+    Parameters
+    ----------
+    images : list[SatelliteImage]
+        Images to download
+    dest_dir : str
+        Directory where the images are saved, it is created if needed
+    max_workers : int, optional
+        Maximum number of concurrent downloads, by default 4
+    api_manager : APIManager, optional
+        APIManager used for every image, by default None (each image uses its
+        own). The images are not modified
+    block_size : int, optional
+        Size of the blocks to download the images, by default 1MB
+    segments : int, optional
+        Number of concurrent byte ranges of each image, by default 1. Up to
+        max_workers * segments connections may be open at the same time
+
+    Returns
+    -------
+    list[DownloadResult]
+        Results of the downloads, in the same order as images
+    """
+
+    logger = logging.getLogger(__name__)
+    os.makedirs(dest_dir, exist_ok=True)
+
+    # More connections than the pool keeps alive would open (and discard)
+    # extra connections to the zipper host
+    if images:
+        zipper_host = urlsplit(templates.image_base_url).hostname
+        pool_size = (api_manager if api_manager else images[0].api_manager).get_pool_settings(zipper_host)["pool_maxsize"]
+        if max_workers * segments > pool_size:
+            logger.warning(f"{max_workers * segments} concurrent connections exceed the {zipper_host} pool size ({pool_size})")
+
+    start_time = time.time()
+
+    unresolved = [image for image in images if not image.image_request]
+    if unresolved:
+        try:
+            resolve_images(unresolved, max_workers=settings.resolve_workers, api_manager=api_manager)
+        except Exception as e:
+            # The images left without a request are resolved one by one
+            logger.error(f"Error resolving the images in batch: {e}")
+
+    logger.info(f"Downloading {len(images)} images to {dest_dir} with {max_workers} workers")
+
+    results = [None] * len(images)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(download_image, image, os.path.join(dest_dir, image_file_name(image)),
+                            block_size, segments, api_manager): index
+            for index, image in enumerate(images)
+        }
+
+        for future in as_completed(futures):
+            result = future.result()
+            results[futures[future]] = result
+
+            if result.ok:
+                logger.info(f"Downloaded {result.path} ({result.bytes} bytes in {result.duration:.2f} seconds)")
+            else:
+                logger.error(f"Error downloading {result.path}: {result.error}")
+
+    failed = sum(1 for result in results if not result.ok)
+    logger.info(f"{len(images) - failed} images downloaded, {failed} failed, in {time.time() - start_time:.2f} seconds")
+
+    return results
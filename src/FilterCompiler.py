@@ -0,0 +1,398 @@
+
+
+import logging
+from datetime import datetime
+from dataclasses import dataclass, field
+
+from config.request_templates import templates
+
+
+# Order of the filter types in the canonical form
+filter_types = ("collection", "name", "sensing_date_start", "sensing_date_end",
+                "publication_date", "attribute", "polygon")
+
+# Filter types compared as dates, and attribute types compared as numbers, so
+# their ranges can be merged
+date_types = ("sensing_date_start", "sensing_date_end", "publication_date")
+numeric_attribute_types = ("Double", "Integer")
+
+
+@dataclass(frozen=True)
+class Predicate:
+    """
+    A single filter of a request (see CopernicusRequest.add_filter for its
+    fields), the leaf of the filter AST
+
+    Methods
+    -------
+    compile() -> str
+        Formats the filter with its template
+
+    Raises
+    ------
+    ValueError
+        If the type or the operand is not supported, or the value of a date
+        or numeric filter can not be parsed
+    """
+
+    type: str
+    value: str
+    operand: str = None
+    attribute_name: str = None
+    attribute_type: str = None
+    polygon_type: str = None
+
+    def __post_init__(self):
+        if self.type not in filter_types:
+            raise ValueError(f"Filter of type \"{self.type}\" is not supported")
+
+        if self.type != "polygon" and self.operand not in templates.operands:
+            raise ValueError(f"Operand \"{self.operand}\" is not supported")
+
+        # Dates and numbers must be comparable to merge their ranges
+        try:
+            self.comparable_value
+        except (ValueError, TypeError, AttributeError) as e:
+            raise ValueError(f"Invalid value {self.value!r} of a {self.type} filter: {e}") from e
+
+
+    def compile(self) -> str:
+        """
+        Formats the filter with its template
+
+        Returns
+        -------
+        str
+            OData expression of the filter
+        """
+
+        match self.type:
+            case "name":
+                return templates.query_by_name.format(operand=templates.operands[self.operand],
+                                                      value=f"'{self.value}'")
+
+            case "collection":
+                return templates.query_by_collection.format(operand=templates.operands[self.operand],
+                                                            value=f"'{self.value}'")
+
+            case "publication_date":
+                return templates.query_by_publication_date.format(operand=templates.operands[self.operand],
+                                                                  value=f"{self.value}")
+
+            case "sensing_date_start":
+                return templates.query_by_sensing_date_start.format(operand=templates.operands[self.operand],
+                                                                    value=f"{self.value}")
+
+            case "sensing_date_end":
+                return templates.query_by_sensing_date_end.format(operand=templates.operands[self.operand],
+                                                                  value=f"{self.value}")
+
+            case "polygon":
+                return templates.query_by_polygon.format(value=f"{self.value}",
+                                                         polygon_type=self.polygon_type)
+
+            case "attribute":
+                return templates.query_by_attribute.format(operand=templates.operands[self.operand],
+                                                           value=f"{self.value}",
+                                                           attribute_name=self.attribute_name,
+                                                           type=self.attribute_type)
+
+
+    @property
+    def field(self) -> tuple:
+        """ Field the filter applies to """
+        return (self.type, self.attribute_name)
+
+
+    @property
+    def is_range(self) -> bool:
+        """ Whether the values of the field are ordered (dates and numbers) """
+        return self.type in date_types or (self.type == "attribute" and self.attribute_type in numeric_attribute_types)
+
+
+    @property
+    def comparable_value(self):
+        """ Value of the filter as a date or a number, if it is a range """
+        if self.type in date_types:
+            return parse_date(self.value)
+        if self.type == "attribute" and self.attribute_type in numeric_attribute_types:
+            return float(self.value)
+        return self.value
+
+
+    @property
+    def sort_key(self) -> tuple:
+        """ Position of the filter in the canonical form """
+        return (filter_types.index(self.type), self.attribute_name or "", self.operand or "", str(self.value))
+
+
+
+@dataclass(frozen=True)
+class And:
+    """
+    Filters that must all hold (a node of the filter AST)
+    """
+
+    predicates: tuple[Predicate, ...]
+
+    def compile(self) -> str:
+        return templates.logical_operators["AND"].join(predicate.compile() for predicate in self.predicates)
+
+
+
+@dataclass(frozen=True)
+class Or:
+    """
+    Groups of filters of which at least one must hold (the root of the filter
+    AST, in disjunctive normal form)
+    """
+
+    groups: tuple[And, ...]
+
+    def compile(self) -> str:
+        if len(self.groups) == 1:
+            return self.groups[0].compile()
+
+        return templates.logical_operators["OR"].join(
+            f"({group.compile()})" if len(group.predicates) > 1 else group.compile()
+            for group in self.groups)
+
+
+
+@dataclass
+class FilterTree:
+    """
+    Filters of a request as an AST in disjunctive normal form: an OR of
+    AND groups of predicates. Filters joined with AND go to the current
+    group and filters joined with OR start a new one, which is how OData
+    evaluates the concatenated filters (and binds tighter than or).
+
+    The tree is normalized before compiling it (see normalize): repeated and
+    redundant predicates are dropped (e.g. overlapping date ranges keep only
+    their tightest bounds), groups that can never hold are removed, and the
+    rest is sorted in a canonical order. Logically identical filter sets
+    therefore compile to the same string, which is also used as the cache key
+    of the request.
+
+    Attributes
+    ----------
+    groups : list[list[Predicate]]
+        AND groups of predicates, as added
+
+    Methods
+    -------
+    add(predicate: Predicate, operator: str = "AND") -> None
+        Adds a predicate joined with AND or OR
+    and_all(predicate: Predicate) -> None
+        Adds a predicate that must hold together with all the current ones
+    without(type: str) -> FilterTree
+        Copy of the tree without the predicates of a type
+    normalize() -> Or
+        Canonical form of the tree, None if it can never hold
+    compile() -> str
+        OData expression of the canonical form
+    """
+
+    groups: list = field(default_factory=list)
+
+    def add(self, predicate: Predicate, operator: str = "AND") -> None:
+        """
+        Adds a predicate joined with AND (to the current group) or OR (in a
+        new group)
+        """
+
+        if not self.groups or operator == "OR":
+            self.groups.append([predicate])
+        else:
+            self.groups[-1].append(predicate)
+
+
+    def and_all(self, predicate: Predicate) -> None:
+        """
+        Adds a predicate that must hold together with all the current ones
+        ((A or B) and p is (A and p) or (B and p))
+        """
+
+        if not self.groups:
+            self.groups.append([predicate])
+            return
+
+        for group in self.groups:
+            group.append(predicate)
+
+
+    def without(self, type: str) -> "FilterTree":
+        """
+        Copy of the tree without the predicates of a type
+        """
+
+        return FilterTree([[predicate for predicate in group if predicate.type != type] for group in self.groups])
+
+
+    @property
+    def is_empty(self) -> bool:
+        """ Whether there are no filters (every product matches) """
+        return not any(self.groups)
+
+
+    @property
+    def matches_nothing(self) -> bool:
+        """ Whether the filters can never hold (no product matches) """
+        return not self.is_empty and self.normalize() is None
+
+
+    def normalize(self) -> Or:
+        """
+        Builds the canonical form of the tree
+
+        Returns
+        -------
+        Or
+            Normalized groups in canonical order, None if no group can hold
+            (also if there are no filters, see is_empty)
+        """
+
+        groups = set()
+        for group in self.groups:
+            normalized = normalize_group(group)
+            if normalized is not None:
+                groups.add(normalized)
+
+        # A group that contains all the predicates of another one is redundant
+        # (A or (A and B) is A)
+        groups = [group for group in groups
+                  if not any(other != group and set(other) < set(group) for other in groups)]
+
+        if not groups:
+            return None
+
+        return Or(tuple(sorted((And(group) for group in groups), key=lambda group: group.compile())))
+
+
+    def compile(self) -> str:
+        """
+        Compiles the canonical form of the tree to an OData expression
+
+        Returns
+        -------
+        str
+            Expression, empty if there are no filters and "false" if they can
+            never hold
+        """
+
+        if self.is_empty:
+            return ""
+
+        normalized = self.normalize()
+        return normalized.compile() if normalized else "false"
+
+
+
+def normalize_group(predicates: list[Predicate]) -> tuple[Predicate, ...]:
+    """
+    Normalizes an AND group of predicates: removes the repeated ones, keeps
+    only the tightest lower and upper bound of every date or numeric field,
+    and sorts them in canonical order
+
+    Parameters
+    ----------
+    predicates : list[Predicate]
+        Predicates of the group
+
+    Returns
+    -------
+    tuple[Predicate, ...]
+        Normalized predicates, None if the group can never hold (e.g. a start
+        date after the end date, or a field equal to two different values)
+    """
+
+    logger = logging.getLogger(__name__)
+
+    kept = []
+    fields = {}
+
+    for predicate in sorted(set(predicates), key=lambda predicate: predicate.sort_key):
+        if predicate.operand in (">", ">=", "<", "<=", "==") and predicate.type != "polygon":
+            fields.setdefault(predicate.field, []).append(predicate)
+        else:
+            kept.append(predicate)
+
+    for field_predicates in fields.values():
+        lower, upper, equal = None, None, None
+
+        for predicate in field_predicates:
+            value = predicate.comparable_value
+
+            if predicate.operand == "==":
+                if equal is not None and equal[0] != value:
+                    logger.debug(f"Contradictory filters: {equal[1].compile()} and {predicate.compile()}")
+                    return None
+                equal = equal if equal else (value, predicate)
+
+            elif not predicate.is_range:
+                kept.append(predicate)
+
+            elif predicate.operand in (">", ">="):
+                if lower is None or value > lower[0] or (value == lower[0] and predicate.operand == ">"):
+                    lower = (value, predicate)
+
+            elif upper is None or value < upper[0] or (value == upper[0] and predicate.operand == "<"):
+                upper = (value, predicate)
+
+        if equal:
+            # The bounds are redundant if the value satisfies them
+            if not predicate_holds(lower, equal[0]) or not predicate_holds(upper, equal[0]):
+                return None
+            kept.append(equal[1])
+            continue
+
+        if lower and upper:
+            strict = lower[1].operand == ">" or upper[1].operand == "<"
+            if lower[0] > upper[0] or (lower[0] == upper[0] and strict):
+                logger.debug(f"Empty range: {lower[1].compile()} and {upper[1].compile()}")
+                return None
+
+        kept += [bound[1] for bound in (lower, upper) if bound]
+
+    # A field can not be equal to a value and different from it
+    equal_values = {(predicate.field, predicate.comparable_value) for predicate in kept if predicate.operand == "=="}
+    if any((predicate.field, predicate.comparable_value) in equal_values
+           for predicate in kept if predicate.operand == "!="):
+        return None
+
+    return tuple(sorted(kept, key=lambda predicate: predicate.sort_key))
+
+
+
+def predicate_holds(bound: tuple, value) -> bool:
+    """
+    Whether a value satisfies a bound (value, predicate) of normalize_group,
+    True if there is no bound
+    """
+
+    if bound is None:
+        return True
+
+    match bound[1].operand:
+        case ">": return value > bound[0]
+        case ">=": return value >= bound[0]
+        case "<": return value < bound[0]
+        case "<=": return value <= bound[0]
+
+
+
+def parse_date(date:str) -> datetime:
+    """
+    Parses an ISO 8601 date of the API (e.g. 2022-05-03T00:00:00.000Z)
+    """
+
+    return datetime.fromisoformat(date.replace("Z", "+00:00")).replace(tzinfo=None)
+
+
+
+def format_date(date:datetime) -> str:
+    """
+    Formats a date as the API expects it (e.g. 2022-05-03T00:00:00.000Z)
+    """
+
+    return date.strftime("%Y-%m-%dT%H:%M:%S.") + f"{date.microsecond // 1000:03d}Z"
@@ -1,5 +1,6 @@
 
 from shapely.geometry import Polygon    # Probbaly will be used in the future
+from shapely.geometry.base import BaseGeometry
 
 
 class GeoPolygon():
@@ -10,4 +11,16 @@ class GeoPolygon():
         self.coordinates = coordinates
         self.area = self.polygon.area
 
-        
+
+
+def as_geometry(polygon) -> BaseGeometry:
+    """
+    Converts a list of coordinates or a GeoPolygon to a shapely geometry
+    (shapely geometries are returned as they are)
+    """
+
+    if isinstance(polygon, GeoPolygon):
+        return polygon.polygon
+    if isinstance(polygon, BaseGeometry):
+        return polygon
+    return Polygon(polygon)
@@ -1,9 +1,13 @@
 
 
+import logging
+
 from tqdm import tqdm
 
 from config.request_templates import templates
+from config.settings import settings
 from src.APIManager import APIManager
+from src.NodeCache import NodeCache
 
 
 
@@ -20,8 +24,16 @@ class ImageRequest():
 
     Attributes
     ----------
+    image_id : str
+        ID of the product
     request : str
         URL of the final image request
+    content_length : int
+        Size in bytes of the final image, as listed in its node (None if
+        unknown)
+    error : str
+        Error that stopped the resolution of the image in a batch (see
+        BatchResolver.resolve_images), None if there was none
 
     
     Methods
@@ -29,6 +41,11 @@ class ImageRequest():
     get_final_image_url()
         Gets the final image URL of the specified image_id, storing it in the
         request attribute
+    get_final_image_url_async(api_manager)
+        Same as get_final_image_url, but awaitable and using an
+        AsyncAPIManager
+    walk_nodes()
+        Generator with the node walk shared by the blocking and async versions
     download_image(block_size=1024)
         Downloads the image from the API and returns a generator with the image
         data, yielding it in blocks of block_size bytes.
@@ -37,100 +54,224 @@ class ImageRequest():
 
 
 
-    def __init__(self, image_id: str = None, api_manager: APIManager = None):
+    def __init__(self, image_id: str = None, api_manager: APIManager = None, resolve: bool = True,
+                 node_cache: NodeCache = None, predicted_node: str = None):
         """
         Parameters
         ----------
         image_id : str, optional
             ID of the image to get, by default None
         api_manager : APIManager, optional
-            APIManager object to make the requests, by default None
+            APIManager object to make the requests, by default None (the
+            shared APIManager)
+        resolve : bool, optional
+            Whether to find the final image URL right away, by default True.
+            If False, the URL can be resolved later with get_final_image_url
+            or get_final_image_url_async
+        node_cache : NodeCache, optional
+            Cache of resolved node paths, by default None (the process-wide
+            NodeCache if settings.node_cache_enabled)
+        predicted_node : str, optional
+            Predicted URL of the TCI node (see NodePrediction), by default
+            None. It is verified with a single request before walking the
+            nodes, which is only done if the prediction is wrong
         """
 
+        self.logger = logging.getLogger(__name__)
+
+        self.image_id = image_id
         self.request = templates.image_base_url.format(product_id=image_id)
+        self.predicted_node = predicted_node
+
+        if node_cache is None and settings.node_cache_enabled:
+            node_cache = NodeCache.default()
+        self.__node_cache = node_cache
         
-        self.__api_manager = api_manager if api_manager else APIManager()
+        self.__api_manager = api_manager if api_manager else APIManager.shared()
         self.__is_image_10m = False
+        self.content_length = None
+        self.error = None
 
-        self.get_final_image_url()
+        if resolve:
+            self.get_final_image_url()
 
 
 
-    def get_final_image_url(self):
+    def walk_nodes(self):
         """
-        Finds the final image URL of the specified image_id, storing it in the
-        \"request\" attribute
-
-        By means of several requests to the Copernicus API, it gets the final
-        URL, determining in the process if several resolutions of it are
-        available or not.
-
-        Parameters
-        ----------
-        None
-
-        Returns
-        -------
-        None
+        Walks the node structure of the product up to the final TCI image,
+        updating the \"request\" attribute at every level.
+
+        This generator does no I/O by itself: it yields the URL of the next
+        node listing to request and expects the JSON of its response (or None
+        if the request failed) to be sent back, so the same walk can be driven
+        by the blocking APIManager or by the AsyncAPIManager.
+
+        Products already resolved are taken from the node cache, without
+        yielding any request. If a predicted node is given, it is requested
+        first and the walk only happens if it does not exist.
+
+        Yields
+        ------
+        str
+            URL of the next node listing to request
         """
 
+        if self.__node_cache is not None:
+            entry = self.__node_cache.get(self.image_id)
+            if entry is not None:
+                self.request = entry['request']
+                self.content_length = entry['content_length']
+                self.__is_image_10m = entry['is_image_10m']
+                return None
+
+        # Verify the predicted TCI node, a single request instead of the walk
+        if self.predicted_node:
+            response = yield self.predicted_node
+            node = response.get('result', response) if response else None
+            node = node[0] if isinstance(node, list) and node else node
+
+            if node and 'TCI' in node.get('Name', ''):
+                self.request = self.predicted_node + "/$value"
+                self.content_length = node.get('ContentLength', None)
+                self.__is_image_10m = node['Name'][-7:] == "10m.jp2"
+                self.__remember_nodes([node])
+                return None
 
         # Get image name
-        response = self.__api_manager.make_request(self.request, 
-                                                 params={})
-        response = response.json()
-
+        response = yield self.request
+        if not response:
+            return None
 
         product_name = response['result'][0]['Name']
-
         self.request += f"({product_name})/Nodes(GRANULE)/Nodes"
 
 
         # Get GRANULE name
-        response = self.__api_manager.make_request(self.request,
-                                                params={})
-        
+        response = yield self.request
         if not response:
             return None
 
-        response = response.json()
         granule_name = response['result'][0]['Name']
         self.request += f"({granule_name})/Nodes(IMG_DATA)/Nodes"
 
 
         # Get image resolution
-        response = self.__api_manager.make_request(self.request,
-                                                params={})
-        response = response.json()
-        
+        response = yield self.request
+        if not response:
+            return None
+
 
         # Check if image Nodes have an extra resolution folder
         # if it has it, expand it to get the final TCI image
         for node in response['result']:
             if node['Name'] == 'R10m':
                 self.request += f"(R60m)/Nodes"
-                response = self.__api_manager.make_request(self.request,
-                                                        params={})
-                response = response.json()
+                response = yield self.request
+                if not response:
+                    return None
                 break
         
         # Get the final TCI image, if it ends in 10m, it is a 10m image
         for node in response['result']:
             if 'TCI' in  node['Name']:
                 self.request += f"({node['Name']})/$value"
+                self.content_length = node.get('ContentLength', None)
 
                 if node['Name'][-7:] == "10m.jp2":
-                    print('10m photo')
+                    self.logger.debug(f"{self.image_id}: 10m image")
                     self.__is_image_10m = True
 
                 else: 
-                    print('Not 10m photo')
+                    self.logger.debug(f"{self.image_id}: not a 10m image")
                     self.__is_image_10m = False
 
+                self.__remember_nodes(response['result'])
                 break
 
 
-    
+
+    def __remember_nodes(self, nodes: list[dict]):
+        """
+        Stores the resolved image in the node cache (if any)
+        """
+
+        if self.__node_cache is not None:
+            self.__node_cache.put(self.image_id, {
+                'request': self.request,
+                'nodes': nodes,
+                'is_image_10m': self.__is_image_10m,
+                'content_length': self.content_length
+            })
+
+
+
+    def get_final_image_url(self):
+        """
+        Finds the final image URL of the specified image_id, storing it in the
+        \"request\" attribute
+
+        By means of several requests to the Copernicus API, it gets the final
+        URL, determining in the process if several resolutions of it are
+        available or not.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        walker = self.walk_nodes()
+        try:
+            url = next(walker)
+            while True:
+                response = self.__api_manager.make_request(url, params={}, log_errors=url != self.predicted_node)
+                url = walker.send(response.json() if response else None)
+        except StopIteration:
+            pass
+
+
+
+    async def get_final_image_url_async(self, api_manager):
+        """
+        Async version of get_final_image_url, making the node requests with an
+        AsyncAPIManager
+
+        Parameters
+        ----------
+        api_manager : AsyncAPIManager
+            AsyncAPIManager object to make the requests
+
+        Returns
+        -------
+        None
+        """
+
+        walker = self.walk_nodes()
+        try:
+            url = next(walker)
+            while True:
+                response = await api_manager.make_request(url, params={}, log_errors=url != self.predicted_node)
+                url = walker.send(await response.json() if response else None)
+        except StopIteration:
+            pass
+
+
+
+    @property
+    def is_resolved(self) -> bool:
+        return self.request.endswith("/$value")
+
+
+    @property
+    def is_image_10m(self) -> bool:
+        return self.__is_image_10m
+
+
+
     # def download_image(self, block_size=1024):
     #     """
     #     Downloads the image from the Copernicus API and returns a generator
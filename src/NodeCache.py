@@ -0,0 +1,137 @@
+
+
+
+import logging
+import threading
+from collections import OrderedDict
+
+from config.settings import settings
+from src.SQLiteCache import SQLiteCache
+
+
+class NodeCache:
+    """
+    Cache of the resolved node paths of the products (see ImageRequest), keyed
+    on the product Id.
+
+    The node structure of a product never changes, so entries never expire.
+    Lookups go first to an in-memory LRU of max_entries entries and then to a
+    persistent SQLite layer, which is used to fill the LRU.
+
+    Each entry is a dictionary with:
+        request : str
+            Final URL of the image
+        nodes : list[dict]
+            Node listing of the folder holding the image
+        is_image_10m : bool
+            Whether the image has a 10m resolution
+        content_length : int
+            Size in bytes of the image
+
+    Methods
+    -------
+    get(product_id: str) -> dict
+        Gets the entry of a product, None if it was never resolved
+    put(product_id: str, entry: dict) -> None
+        Stores the entry of a product
+    default() -> NodeCache
+        Gets the process-wide node cache
+    """
+
+    __default = None
+    __default_lock = threading.Lock()
+
+
+
+    def __init__(self, path: str = None, max_entries: int = None):
+
+        self.logger = logging.getLogger(__name__)
+
+        self.max_entries = max_entries if max_entries else settings.node_cache_max_entries
+        self.__memory = OrderedDict()
+        self.__lock = threading.Lock()
+
+        # Node paths never change, so the disk layer has no ttl
+        self.__disk = SQLiteCache(path if path else settings.node_cache_path, table="nodes")
+
+
+
+    @classmethod
+    def default(cls) -> "NodeCache":
+        """
+        Gets the process-wide node cache, creating it on first use
+
+        Returns
+        -------
+        NodeCache
+            Node cache shared by every ImageRequest
+        """
+
+        with cls.__default_lock:
+            if cls.__default is None:
+                cls.__default = cls()
+            return cls.__default
+
+
+
+    def get(self, product_id: str) -> dict:
+        """
+        Gets the resolved nodes of a product
+
+        Parameters
+        ----------
+        product_id : str
+            Id of the product
+
+        Returns
+        -------
+        dict
+            Entry of the product, None if it is not cached
+        """
+
+        with self.__lock:
+            if product_id in self.__memory:
+                self.__memory.move_to_end(product_id)
+                return self.__memory[product_id]
+
+        entry = self.__disk.get(product_id)
+        if entry is not None:
+            self.__remember(product_id, entry)
+
+        return entry
+
+
+
+    def put(self, product_id: str, entry: dict) -> None:
+        """
+        Stores the resolved nodes of a product in memory and on disk
+
+        Parameters
+        ----------
+        product_id : str
+            Id of the product
+        entry : dict
+            Entry of the product
+
+        Returns
+        -------
+        None
+        """
+
+        self.__remember(product_id, entry)
+        self.__disk.put(product_id, entry)
+
+
+
+    def __remember(self, product_id: str, entry: dict) -> None:
+        """
+        Stores an entry in the in-memory LRU, dropping the least recently used
+        one if it is full
+        """
+
+        with self.__lock:
+            self.__memory[product_id] = entry
+            self.__memory.move_to_end(product_id)
+
+            while len(self.__memory) > self.max_entries:
+                self.__memory.popitem(last=False)
@@ -0,0 +1,76 @@
+
+
+
+import re
+
+from config.request_templates import templates
+
+
+# S2A_OPER_MSI_L2A_TL_2APS_20230204T135003_A039765_T30TVK_N05.09
+absolute_orbit_pattern = re.compile(r"_A(\d{6})_")
+# S2A_OPER_MSI_L2A_DS_2APS_20230204T135003_S20230204T110600_N05.09
+datastrip_sensing_pattern = re.compile(r"_S(\d{8}T\d{6})_")
+
+
+
+def predict_tci_node(image) -> str:
+    """
+    Predicts the URL of the TCI node of a Sentinel-2 product from its metadata,
+    following the SAFE naming conventions, so it can be verified with a single
+    request instead of walking the product nodes.
+
+    The prediction mirrors the node walk of ImageRequest: the 60m TCI for L2A
+    products (inside IMG_DATA/R60m) and the only TCI for L1C products.
+
+        <name>/GRANULE/<level>_T<tile>_A<orbit>_<datastrip sensing>/IMG_DATA/[R60m/]T<tile>_<sensing>_TCI[_60m].jp2
+
+    Parameters
+    ----------
+    image : SatelliteImage
+        Image with its attributes unwrapped (name, tileId, granuleIdentifier
+        and datastripId are used)
+
+    Returns
+    -------
+    str
+        URL of the TCI node (without the final /$value), None if the product
+        is not a Sentinel-2 MSI product or some metadata is missing
+    """
+
+    name = getattr(image, "name", None)
+    if not name or not name.startswith("S2"):
+        return None
+
+    # S2A_MSIL2A_20230204T110251_N0509_R094_T30TVK_20230204T135003.SAFE
+    name_parts = name.removesuffix(".SAFE").split("_")
+    if len(name_parts) != 7 or not name_parts[1].startswith("MSI"):
+        return None
+
+    level = name_parts[1][3:]
+    sensing = name_parts[2]
+    tile = getattr(image, "tileId", None) or name_parts[5][1:]
+
+    orbit = absolute_orbit_pattern.search(getattr(image, "granuleIdentifier", None) or "")
+    datastrip_sensing = datastrip_sensing_pattern.search(getattr(image, "datastripId", None) or "")
+    if not orbit or not datastrip_sensing:
+        return None
+
+    granule_name = templates.s2_granule_name.format(level=level,
+                                                    tile=tile,
+                                                    orbit=orbit.group(1),
+                                                    datastrip_sensing=datastrip_sensing.group(1))
+
+    match level:
+        case "L2A":
+            tci_name = templates.s2_tci_name_l2a.format(tile=tile, sensing=sensing)
+            node = templates.s2_tci_node_l2a
+
+        case "L1C":
+            tci_name = templates.s2_tci_name_l1c.format(tile=tile, sensing=sensing)
+            node = templates.s2_tci_node_l1c
+
+        case _:
+            return None
+
+    node = node.format(product_name=name, granule_name=granule_name, tci_name=tci_name)
+    return templates.image_base_url.format(product_id=image.id) + node
@@ -0,0 +1,235 @@
+
+
+
+import json
+import time
+import sqlite3
+import logging
+import threading
+import os
+
+
+class SQLiteCache:
+    """
+    A small persistent key/value cache stored in a SQLite database, holding
+    JSON serializable values.
+
+    Entries older than ttl seconds are considered stale and are not returned.
+    When the total size of the stored values exceeds max_bytes, the least
+    recently used entries are evicted.
+
+    Attributes
+    ----------
+    path : str
+        Path of the SQLite database
+    table : str
+        Name of the table holding the entries
+    ttl : float
+        Seconds an entry is valid for (None means forever)
+    max_bytes : int
+        Maximum total size of the stored values (None means unbounded)
+
+    Methods
+    -------
+    get(key: str) -> object
+        Gets the value of a key, None if missing or stale
+    put(key: str, value: object) -> None
+        Stores the value of a key, evicting old entries if needed
+    delete(key: str) -> None
+        Removes a key
+    clear() -> None
+        Removes every entry
+    evict() -> None
+        Removes the stale entries and the least recently used ones over
+        max_bytes
+    keys() -> list[str]
+        Gets every key that is not stale
+    values() -> list
+        Gets every value that is not stale
+    """
+
+
+
+    def __init__(self, path: str, table: str = "cache", ttl: float = None, max_bytes: int = None):
+
+        self.logger = logging.getLogger(__name__)
+
+        self.path = path
+        self.table = table
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+
+        with self.__lock, self.__connection:
+            self.__connection.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.table} (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL
+                )""")
+
+
+
+    def get(self, key: str) -> object:
+        """
+        Gets the value of a key
+
+        Parameters
+        ----------
+        key : str
+            Key to get
+
+        Returns
+        -------
+        object
+            Stored value, None if the key is missing or stale
+        """
+
+        with self.__lock, self.__connection:
+            row = self.__connection.execute(f"SELECT value, created FROM {self.table} WHERE key = ?",
+                                            (key,)).fetchone()
+
+            if not row:
+                return None
+
+            value, created = row
+            if self.ttl is not None and time.time() - created > self.ttl:
+                return None
+
+            self.__connection.execute(f"UPDATE {self.table} SET accessed = ? WHERE key = ?",
+                                      (time.time(), key))
+
+        return json.loads(value)
+
+
+
+    def put(self, key: str, value: object) -> None:
+        """
+        Stores the value of a key, replacing the previous one
+
+        Parameters
+        ----------
+        key : str
+            Key to store
+        value : object
+            JSON serializable value
+
+        Returns
+        -------
+        None
+        """
+
+        serialized = json.dumps(value, separators=(",", ":"))
+        now = time.time()
+
+        with self.__lock, self.__connection:
+            self.__connection.execute(f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?, ?, ?)",
+                                      (key, serialized, len(serialized), now, now))
+
+        self.evict()
+
+
+
+    def delete(self, key: str) -> None:
+        """
+        Removes a key from the cache
+        """
+
+        with self.__lock, self.__connection:
+            self.__connection.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+
+
+    def clear(self) -> None:
+        """
+        Removes every entry of the cache
+        """
+
+        with self.__lock, self.__connection:
+            self.__connection.execute(f"DELETE FROM {self.table}")
+
+
+
+    def evict(self) -> None:
+        """
+        Removes the stale entries and, if the cache is still bigger than
+        max_bytes, the least recently used entries until it fits
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        with self.__lock, self.__connection:
+            if self.ttl is not None:
+                self.__connection.execute(f"DELETE FROM {self.table} WHERE created < ?",
+                                          (time.time() - self.ttl,))
+
+            if self.max_bytes is None:
+                return
+
+            total_size = self.__connection.execute(f"SELECT COALESCE(SUM(size), 0) FROM {self.table}").fetchone()[0]
+            if total_size <= self.max_bytes:
+                return
+
+            evicted = 0
+            for key, size in self.__connection.execute(f"SELECT key, size FROM {self.table} ORDER BY accessed").fetchall():
+                if total_size <= self.max_bytes:
+                    break
+                self.__connection.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                total_size -= size
+                evicted += 1
+
+        self.logger.debug(f"Evicted {evicted} entries from {self.path}")
+
+
+
+    def keys(self) -> list[str]:
+        """
+        Gets every key of the cache that is not stale
+        """
+
+        min_created = time.time() - self.ttl if self.ttl is not None else 0
+
+        with self.__lock, self.__connection:
+            rows = self.__connection.execute(f"SELECT key FROM {self.table} WHERE created >= ?",
+                                             (min_created,)).fetchall()
+
+        return [row[0] for row in rows]
+
+
+
+    def values(self) -> list:
+        """
+        Gets every value of the cache that is not stale, without updating
+        their last access time
+        """
+
+        min_created = time.time() - self.ttl if self.ttl is not None else 0
+
+        with self.__lock, self.__connection:
+            rows = self.__connection.execute(f"SELECT value FROM {self.table} WHERE created >= ?",
+                                             (min_created,)).fetchall()
+
+        return [json.loads(row[0]) for row in rows]
+
+
+
+    def close(self) -> None:
+        """
+        Closes the connection to the database
+        """
+
+        with self.__lock:
+            self.__connection.close()
@@ -1,6 +1,9 @@
 
+import os
+
 # from src.copernicus_request import CopernicusRequest
 from src.ImageRequest import ImageRequest
+from src.NodePrediction import predict_tci_node
 from src.APIManager import APIManager 
 from src.GeoPolygon import GeoPolygon
 
@@ -13,6 +16,9 @@ class SatelliteImage:
     ----------
     api_manager : APIManager
         APIManager object to make the requests
+        Default value: the shared APIManager
+    polygon : GeoPolygon
+        Footprint of the image, built lazily on first access
     image_path : str 
         Path to save the image
         Default value: 'tmp/test.jp2'
@@ -23,6 +29,8 @@ class SatelliteImage:
     -------
     get_image_url()
         Gets the image URL from the API, aka instanciates the ImageRequest object
+    get_image_url_async(api_manager)
+        Same as get_image_url, but awaitable and using an AsyncAPIManager
     download(block_size=1024, image_path=None)
         Downloads the image from the API and saves it in the specified path
     parse_kwargs(kwargs)
@@ -34,65 +42,234 @@ class SatelliteImage:
     """
 
 
+    # Product properties of the API and the attribute they are stored in
+    product_fields = {
+        "Id": "id",
+        "Name": "name",
+        "ContentType": "contentType",
+        "ContentLength": "contentLength",
+        "OriginDate": "originDate",
+        "PublicationDate": "publicationDate",
+        "ModificationDate": "modificationDate",
+        "Online": "online"
+    }
+
+    # Attributes of the API (Attributes list) stored with the same name
+    attribute_fields = (
+        "origin",
+        "tileId",
+        "cloudCover",
+        "datastripId",
+        "orbitNumber",
+        "sourceProduct",
+        "processingDate",
+        "productGroupId",
+        "operationalMode",
+        "processingLevel",
+        "processorVersion",
+        "granuleIdentifier",
+        "platformShortName",
+        "instrumentShortName",
+        "relativeOrbitNumber",
+        "sourceProductOriginDate",
+        "platformSerialIdentifier",
+        "productType",
+        "beginningDateTime",
+        "endingDateTime"
+    )
+    known_attributes = frozenset(attribute_fields)
+
+    # Fixed attribute set, no per-instance __dict__
+    __slots__ = (tuple(product_fields.values()) + attribute_fields +
+                 ("geofootprint", "_polygon", "_api_manager", "image_path", "image_request"))
+
+
     def __init__(self, 
                  api_manager:APIManager = None, 
                  image_path:str = 'tmp/test.jp2',
                  **kwargs) -> None:
 
         self.parse_kwargs(kwargs)
-        self.api_manager = APIManager() if not api_manager else api_manager
+        self.api_manager = api_manager
         self.image_path = image_path
         self.image_request = None
 
 
-    def get_image_url(self):
+    def get_image_url(self, api_manager:APIManager=None):
         """
         Instanciates the ImageRequest object to get the image URL
 
         Parameters
         ----------
+        api_manager : APIManager, optional
+            APIManager used for the requests, by default None (the one of the
+            image)
+
+        Returns
+        -------
         None
+        """
+        self.image_request = ImageRequest(self.id, api_manager if api_manager else self.api_manager,
+                                          predicted_node=predict_tci_node(self))
+
+
+    async def get_image_url_async(self, api_manager):
+        """
+        Async version of get_image_url, resolving the ImageRequest with an
+        AsyncAPIManager
+
+        Parameters
+        ----------
+        api_manager : AsyncAPIManager
+            AsyncAPIManager object to make the requests
 
         Returns
         -------
         None
         """
-        self.image_request = ImageRequest(self.id, self.api_manager)
+        image_request = ImageRequest(self.id, self.api_manager, resolve=False,
+                                     predicted_node=predict_tci_node(self))
+        await image_request.get_final_image_url_async(api_manager)
+        self.image_request = image_request
 
 
-    def download(self, block_size:int=1024, image_path:str=None):
+    def download(self, block_size:int=1024, image_path:str=None, show_progress:bool=True,
+                 segments:int=1, api_manager:APIManager=None) -> int:
         """
         Downloads the image from the API and saves it in the specified path
 
+        The image is written to a "<image_path>.part" file which is only
+        renamed to image_path once its size matches the expected one (the
+        ContentLength of the image node, or the content-length header). If a
+        .part file already exists, the download is resumed from its last byte
+        with a Range request.
+
+        If segments is bigger than 1 and the server supports Range requests,
+        the image is split in that many byte ranges downloaded concurrently
+        (see APIManager.download_segmented). Segmented downloads always start
+        from scratch and are written to a separate "<image_path>.seg" file:
+        it is preallocated to the full size, so it is never resumed as a
+        .part file.
+
         Parameters
         ----------
         block_size : int, optional
             Size of the blocks to download the image, by default 1024
         image_path : str, optional
             Path to save the image, by default None
+        show_progress : bool, optional
+            Whether to print the download progress bar, by default True
+        segments : int, optional
+            Number of concurrent byte ranges to download, by default 1 (a
+            single stream)
+        api_manager : APIManager, optional
+            APIManager used for the requests, by default None (the one of the
+            image)
 
         Returns
         -------
-        None
+        int
+            Number of bytes written to image_path during this call
+
+        Raises
+        ------
+        IOError
+            If the downloaded file does not have the expected size
         """
 
         if not self.image_request: 
             print("No image request found, getting image request")
-            self.get_image_url()
+            self.get_image_url(api_manager)
 
+        api_manager = api_manager if api_manager else self.api_manager
         image_path = image_path if image_path else self.image_path
+        part_path = image_path + ".part"
+        expected_size = self.image_request.content_length
+
+        start = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+
+        # A .part file bigger than the image can not be resumed
+        if expected_size and start > expected_size:
+            start = 0
+
+        written_bytes = None
+        download_path = part_path
+
+        if segments > 1:
+            segmented_path = image_path + ".seg"
+            written_bytes = api_manager.download_segmented(self.image_request.request, segmented_path,
+                                                           segments=segments,
+                                                           block_size=block_size,
+                                                           show_progress=show_progress)
+            if written_bytes is not None:
+                download_path = segmented_path
+
+        # Single stream download, also used when the server does not support
+        # Range requests
+        if written_bytes is None:
+            written_bytes, expected_size = self.__download_stream(api_manager, part_path, start, expected_size,
+                                                                  block_size, show_progress)
+
+        downloaded_size = os.path.getsize(download_path)
+        if expected_size and downloaded_size != expected_size:
+            if download_path != part_path:
+                os.remove(download_path)
+            raise IOError(f"Downloaded {downloaded_size} of {expected_size} bytes of {image_path}, "
+                          f"download again to resume it")
+
+        os.replace(download_path, image_path)
+
+        # A previous single stream attempt is superseded by the segmented one
+        if download_path != part_path and os.path.exists(part_path):
+            os.remove(part_path)
+
+        return written_bytes
+
 
-        image_data_iterator = self.api_manager.get_image_stream(self.image_request.request, 
-                                                                block_size=block_size)
-        with open(image_path, "wb") as image_file:
-            for data in image_data_iterator:
-                image_file.write(data)
+
+    def __download_stream(self, api_manager:APIManager, part_path:str, start:int, expected_size:int,
+                          block_size:int, show_progress:bool) -> tuple[int, int]:
+        """
+        Downloads the image in a single stream, appending to part_path from
+        byte start (if the server accepts the Range request)
+
+        Returns
+        -------
+        tuple[int, int]
+            Number of bytes written and expected size of the image (taken from
+            the content-length header if it was not known)
+        """
+
+        written_bytes = 0
+
+        if not expected_size or start < expected_size:
+            response = api_manager.open_stream(self.image_request.request, start=start)
+
+            # The server ignored the Range header, start from scratch
+            if response.status_code == 200:
+                start = 0
+
+            if not expected_size and 'content-length' in response.headers:
+                expected_size = start + int(response.headers['content-length'])
+
+            image_data_iterator = api_manager.iter_stream(response, block_size=block_size,
+                                                          show_progress=show_progress)
+            with open(part_path, "ab" if start else "wb") as image_file:
+                for data in image_data_iterator:
+                    image_file.write(data)
+                    written_bytes += len(data)
+
+        return written_bytes, expected_size
 
 
 
     def parse_kwargs(self, kwargs:dict):
         """
-        Parses the attributes from the API to the class attributes
+        Parses the attributes from the API to the class attributes, following
+        the product_fields table
+
+        The footprint polygon is not built here, only when the polygon
+        attribute is first accessed.
 
         Parameters
         ----------
@@ -104,16 +281,11 @@ class SatelliteImage:
         None
         """
 
-        self.id                 = kwargs.get("Id", None)
-        self.name               = kwargs.get("Name", None)
-        self.contentType        = kwargs.get("ContentType", None)
-        self.contentLength      = kwargs.get("ContentLength", None)
-        self.originDate         = kwargs.get("OriginDate", None)
-        self.publicationDate    = kwargs.get("PublicationDate", None)
-        self.modificationDate   = kwargs.get("ModificationDate", None)
-        self.online             = kwargs.get("Online", None)
+        for api_name, field in self.product_fields.items():
+            setattr(self, field, kwargs.get(api_name, None))
+
         self.geofootprint       = self.get_geo_footprint(kwargs.get("GeoFootprint", None))
-        self.polygon            = GeoPolygon(self.geofootprint) if self.geofootprint else None
+        self._polygon           = None
 
         self.unwrap_attributes(kwargs.get("Attributes", None))
 
@@ -143,7 +315,8 @@ class SatelliteImage:
 
     def unwrap_attributes(self, attributes:dict=None):
         """
-        Unwraps the attributes from the API to the class attributes
+        Unwraps the attributes from the API to the class attributes listed in
+        attribute_fields, any other attribute is ignored
 
         Parameters
         ----------
@@ -157,67 +330,41 @@ class SatelliteImage:
 
         if not attributes: return None
 
+        known_attributes = self.known_attributes
         for attribute in attributes:
-            match attribute["Name"]:
-                case "origin":
-                    self.origin = attribute["Value"]
-
-                case "tileId":
-                    self.tileId = attribute["Value"]
-
-                case "cloudCover":
-                    self.cloudCover = attribute["Value"]
-
-                case "datastripId":
-                    self.datastripId = attribute["Value"]
-
-                case "orbitNumber":
-                    self.orbitNumber = attribute["Value"]
-
-                case "sourceProduct":
-                    self.sourceProduct = attribute["Value"]
+            name = attribute["Name"]
+            if name in known_attributes:
+                setattr(self, name, attribute["Value"])
 
-                case "processingDate":
-                    self.processingDate = attribute["Value"]
 
-                case "productGroupId":
-                    self.productGroupId = attribute["Value"]
 
-                case "operationalMode":
-                    self.operationalMode = attribute["Value"]
-
-                case "processingLevel":
-                    self.processingLevel = attribute["Value"]
-
-                case "processorVersion":
-                    self.processorVersion = attribute["Value"]
-
-                case "granuleIdentifier":
-                    self.granuleIdentifier = attribute["Value"]
-
-                case "platformShortName":
-                    self.platformShortName = attribute["Value"]
+    @property
+    def polygon(self) -> GeoPolygon:
+        """
+        Footprint of the image, built the first time it is accessed (None if
+        the image has no footprint)
+        """
 
-                case "instrumentShortName":
-                    self.instrumentShortName = attribute["Value"]
+        if self._polygon is None and self.geofootprint:
+            self._polygon = GeoPolygon(self.geofootprint)
+        return self._polygon
 
-                case "relativeOrbitNumber":
-                    self.relativeOrbitNumber = attribute["Value"]
 
-                case "sourceProductOriginDate":
-                    self.sourceProductOriginDate = attribute["Value"]
+    @property
+    def api_manager(self) -> APIManager:
+        return self._api_manager if self._api_manager else APIManager.shared()
 
-                case "platformSerialIdentifier":
-                    self.platformSerialIdentifier = attribute["Value"]
 
-                case "productType":
-                    self.productType = attribute["Value"]
+    @api_manager.setter
+    def api_manager(self, api_manager:APIManager):
+        self._api_manager = api_manager
 
-                case "beginningDateTime":
-                    self.beginningDateTime = attribute["Value"]
 
-                case "endingDateTime":
-                    self.endingDateTime = attribute["Value"]
+    def __getattr__(self, name:str):
+        # Only called for unset slots: attributes missing from the API are None
+        if name in SatelliteImage.known_attributes:
+            return None
+        raise AttributeError(f"'SatelliteImage' object has no attribute '{name}'")
 
 
 
@@ -0,0 +1,92 @@
+''''''
+
+import os
+import json
+import hashlib
+import logging
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:     # Windows
+    fcntl = None
+
+from config.settings import settings
+
+
+class TokenCache:
+    """ File shared by several processes to reuse the same access and refresh
+    tokens, so only one of them talks to the identity server at a time.
+
+    The file lives in the runtime directory of the user ($XDG_RUNTIME_DIR, or
+    the temporary directory) and is only readable by its owner. Every access
+    must be done holding lock(), an exclusive lock on a sibling .lock file.
+    """
+
+    def __init__(self, username: str, path: str = None):
+
+        self.logger = logging.getLogger(__name__)
+
+        if not path:
+            directory = settings.token_cache_dir or os.getenv("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+            user_hash = hashlib.sha256(username.encode("utf-8")).hexdigest()[:16]
+            path = os.path.join(directory, f"copernicus_token_{user_hash}.json")
+
+        self.path = path
+        self.lock_path = path + ".lock"
+
+        if fcntl is None:
+            self.logger.warning("File locks are not available, the token cache is not process safe")
+
+
+
+    @contextmanager
+    def lock(self):
+        """ Holds an exclusive lock on the cache, blocking until it is free
+
+        :params: None
+        :return: None
+        """
+
+        file_descriptor = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if fcntl:
+                fcntl.flock(file_descriptor, fcntl.LOCK_EX)
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(file_descriptor, fcntl.LOCK_UN)
+            os.close(file_descriptor)
+
+
+
+    def load(self) -> dict:
+        """ Loads the cached token response (must be called holding the lock)
+
+        :params: None
+        :return: dict - Token response plus its "token_start_time", None if
+            there is no cached token
+        """
+
+        try:
+            with open(self.path, "r") as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+
+
+
+    def save(self, token: dict) -> None:
+        """ Saves a token response (must be called holding the lock)
+
+        :params: token: dict - Token response plus its "token_start_time"
+        :return: None
+        """
+
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".")
+        with os.fdopen(file_descriptor, "w") as cache_file:
+            json.dump(token, cache_file)
+
+        os.chmod(temporary_path, 0o600)
+        os.replace(temporary_path, self.path)
@@ -1,15 +1,19 @@
 ''''''
 
 import os
-import json
 import time
 import logging
 import threading
-import subprocess
+import requests
+from contextlib import nullcontext
+
+from config.request_templates import templates
+from config.settings import settings
+from src.TokenCache import TokenCache
 
 
 class TokenManager:
-    def __init__(self):
+    def __init__(self, session: requests.Session = None, shared: bool = None):
 
         self.COPERNICUS_USERNAME = os.getenv("COPERNICUS_USERNAME", None)
         self.COPERNICUS_PASSWORD = os.getenv("COPERNICUS_PASSWORD", None)
@@ -17,13 +21,27 @@ class TokenManager:
         if not self.COPERNICUS_USERNAME or not self.COPERNICUS_PASSWORD:
             raise ValueError("COPERNICUS_USERNAME and COPERNICUS_PASSWORD must be set in the environment variables")
 
+        # Pooled session used to talk to the identity server
+        self.session = session if session else requests.Session()
+
+        # Token file shared with the other processes of the same user
+        shared = settings.token_cache_enabled if shared is None else shared
+        self.token_cache = TokenCache(self.COPERNICUS_USERNAME) if shared else None
+
+        self.token = None
+        self.refresh_token = None
+
         self.token_start_time = None
         self.token_duration = None
+        self.refresh_token_duration = None
 
-        self.token_refresh_time_buffer = 10
+        self.token_refresh_time_buffer = settings.token_refresh_time_buffer
 
         self.logger = logging.getLogger(__name__)
 
+        self.__lock = threading.RLock()
+        self.__scheduler_thread = None
+
 
 
     @property
@@ -31,108 +49,242 @@ class TokenManager:
         return {"Authorization": f"Bearer {self.token}"}
 
     def get_headers(self) -> dict:
-        return 
+        return
+
+
+    @property
+    def token_expiration_time(self) -> float:
+        """ Time (epoch seconds) at which the access token expires """
+        return self.token_start_time + self.token_duration
+
+    @property
+    def refresh_token_expiration_time(self) -> float:
+        """ Time (epoch seconds) at which the refresh token expires """
+        return self.token_start_time + self.refresh_token_duration
+
 
-        
     def start(self):
-        """ Starts the token manager
-        
+        """ Starts the token manager, reusing the token of the shared token
+        cache if there is a valid one
+
         :params: None
         :return: None
         """
 
-        self.generate_acess_token()
+        with self.__lock, self.__shared_lock():
+            self.__load_shared_token()
+
+            if not self.token or self.__is_token_expiring():
+                self.__renew_token()
+            else:
+                self.logger.info("Reusing the token of the shared token cache")
+
+        self.start_token_scheduler()
         self.logger.info("Token manager started")
 
 
 
+    def __shared_lock(self):
+        """ Lock of the shared token cache, a no-op if it is disabled """
+        return self.token_cache.lock() if self.token_cache else nullcontext()
+
+
+
+    def __is_token_expiring(self) -> bool:
+        """ Whether the access token expires within token_refresh_time_buffer """
+        return time.time() >= self.token_expiration_time - self.token_refresh_time_buffer
+
+
+
+    def __load_shared_token(self) -> bool:
+        """ Adopts the token of the shared token cache if it is newer than the
+        current one (must be called holding the shared lock)
+
+        :params: None
+        :return: bool - Whether the token was adopted
+        """
+
+        if not self.token_cache:
+            return False
+
+        cached = self.token_cache.load()
+        if not cached or (self.token_start_time and cached["token_start_time"] <= self.token_start_time):
+            return False
+
+        self.set_token(cached, start_time=cached["token_start_time"], save=False)
+        return True
+
+
+
+    def request_token(self, data: dict) -> dict:
+        """ Makes a request to the token endpoint of the identity server
+
+        :params: data: dict - Form data of the request (grant type and
+            credentials)
+        :return: dict - JSON response of the identity server
+        """
+
+        response = self.session.post(templates.token_url,
+                                     data={**data, "client_id": templates.token_client_id},
+                                     timeout=(settings.token_connect_timeout, settings.token_read_timeout))
+
+        if response.status_code != 200:
+            self.logger.error(f"Error requesting token: {response.status_code}")
+            self.logger.error(response.text)
+            response.raise_for_status()
+
+        return response.json()
+
+
+
+    def set_token(self, response: dict, start_time: float = None, save: bool = True) -> None:
+        """ Stores the tokens and their durations from a token response, also
+        in the shared token cache if enabled
+
+        :params: response: dict - JSON response of the identity server
+        :params: start_time: float - Time at which the token was generated, by
+            default now
+        :params: save: bool - Whether to write it to the shared token cache
+        :return: None
+        """
+
+        with self.__lock:
+            # Extract the refresh token and the main token
+            self.token = response["access_token"]
+            self.refresh_token = response["refresh_token"]
+
+            # Extract the token duration and the refresh token duration
+            self.token_start_time = start_time if start_time else time.time()
+            self.token_duration = response["expires_in"]
+            self.refresh_token_duration = response["refresh_expires_in"]
+
+            if self.token_cache and save:
+                self.token_cache.save({
+                    "access_token": self.token,
+                    "refresh_token": self.refresh_token,
+                    "expires_in": self.token_duration,
+                    "refresh_expires_in": self.refresh_token_duration,
+                    "token_start_time": self.token_start_time
+                })
+
+
+
     def generate_acess_token(self) -> None:
-        """ Generates the access token for the Copernicus API, firstly it
-        generates the main token and then starts a scheduler to refresh the
-        token periodically
-        
+        """ Generates the access token for the Copernicus API with the user
+        credentials (password grant)
+
         :params: None
         :return: None
         """
 
-        # Cli command to generate the main token
-        token_command = f"curl --location --request POST 'https://identity.dataspace.copernicus.eu/auth/realms/CDSE/protocol/openid-connect/token' \
-                            --header 'Content-Type: application/x-www-form-urlencoded' \
-                            --data-urlencode 'grant_type=password' \
-                            --data-urlencode 'username={self.COPERNICUS_USERNAME}' \
-                            --data-urlencode 'password={self.COPERNICUS_PASSWORD}' \
-                            --data-urlencode 'client_id=cdse-public'\
-                        "
-        
         # Generate the main token
         self.logger.info("Generating main token")
-        response = subprocess.check_output(token_command, shell=True)
-        response = json.loads(response)
-        self.logger.info("Main token generated")
+        response = self.request_token({
+            "grant_type": "password",
+            "username": self.COPERNICUS_USERNAME,
+            "password": self.COPERNICUS_PASSWORD
+        })
+        self.set_token(response)
+        self.logger.info(f"Main token generated, it expires in {self.token_duration} seconds")
 
-        # Extract the refresh token and the main token
-        self.refresh_token = response["refresh_token"]
-        self.token = response["access_token"]
 
-        # Extract the token duration and the refresh token duration
-        self.token_start_time = time.time()
-        self.token_duration = response["expires_in"]
-        self.refresh_token_duration = response["refresh_expires_in"]
 
-        # Calculate the time to refresh the token
-        refresh_time = self.refresh_token_duration - self.token_refresh_time_buffer
+    def regenerate_token(self):
+        """ Regenerates the token using the refresh token, generating a new one
+        with the user credentials if the refresh token has expired or is
+        rejected.
 
-        # Start the token scheduler
-        self.logger.info(f"Token will be refreshed in {refresh_time} seconds")
-        self.start_token_scheduler(refresh_time)
-        self.logger.info("Token scheduler started")
+        If another process already refreshed the token in the shared token
+        cache, that token is reused instead.
+
+        :params: None
+        :return: None
+        """
 
+        with self.__lock, self.__shared_lock():
+            if self.__load_shared_token() and not self.__is_token_expiring():
+                self.logger.info("Token refreshed by another process")
+                return
 
+            self.__renew_token()
+
+
+
+    def __renew_token(self):
+        """ Gets a new token with the refresh token, or with the user
+        credentials if there is no valid refresh token (must be called holding
+        the locks)
 
-    def regenerate_token(self):
-        """ Regenerates the token using the refresh token
-        
         :params: None
         :return: None
         """
 
-        # Cli command to refresh the token
-        token_command = f"curl --location --request POST 'https://identity.dataspace.copernicus.eu/auth/realms/CDSE/protocol/openid-connect/token' \
-                            --header 'Content-Type: application/x-www-form-urlencoded' \
-                            --data-urlencode 'grant_type=refresh_token' \
-                            --data-urlencode 'refresh_token={self.refresh_token}' \
-                            --data-urlencode 'client_id=cdse-public'"
+        with self.__lock:
+            if not self.refresh_token or time.time() >= self.refresh_token_expiration_time - self.token_refresh_time_buffer:
+                self.logger.info("Refresh token expired, generating a new token")
+                self.generate_acess_token()
+                return
 
-        # Refreshing the token
-        self.logger.info("Refreshing token")
-        response = subprocess.check_output(token_command, shell=True)
-        response = json.loads(response)
+            # Refreshing the token
+            self.logger.info("Refreshing token")
+            try:
+                response = self.request_token({
+                    "grant_type": "refresh_token",
+                    "refresh_token": self.refresh_token
+                })
+                self.set_token(response)
+
+            except (requests.RequestException, KeyError, ValueError) as e:
+                self.logger.error(f"Error refreshing token: {e}")
+                self.generate_acess_token()
+                return
+
+            self.logger.info("Token refreshed correctly")
 
-        try:
-            self.token = response["access_token"]
-            self.refresh_token = response["refresh_token"]
-        except KeyError as e:
-            self.logger.error("Error refreshing token: {e}")
-            return
-        
-        self.logger.info("Token refreshed correctly")
 
 
+    def refresh_if_stale(self, used_token: str) -> None:
+        """ Refreshes the token after it has been rejected by the API, unless
+        another thread already refreshed it
 
-    def start_token_scheduler(self, refresh_time: int = 3600):
-        """ Starts a scheduler to refresh the token periodically
-        
-        :params: refresh_time: int - Time in seconds to refresh the token
+        :params: used_token: str - Token that was rejected
         :return: None
         """
 
+        with self.__lock:
+            if used_token == self.token:
+                self.regenerate_token()
+
+
+
+    def start_token_scheduler(self):
+        """ Starts a scheduler that refreshes the token token_refresh_time_buffer
+        seconds before the access token expires
+
+        :params: None
+        :return: None
+        """
+
+        if self.__scheduler_thread and self.__scheduler_thread.is_alive():
+            return
+
         def token_scheduler():
             while True:
-                time.sleep(refresh_time)
-                self.regenerate_token()
+                refresh_time = self.token_expiration_time - self.token_refresh_time_buffer - time.time()
+                if refresh_time > 0:
+                    time.sleep(refresh_time)
+
+                # The token may have been refreshed meanwhile (e.g. after a 401)
+                if time.time() >= self.token_expiration_time - self.token_refresh_time_buffer:
+                    try:
+                        self.regenerate_token()
+                    except (requests.RequestException, KeyError, ValueError) as e:
+                        # Also malformed responses, the thread must keep rescheduling
+                        self.logger.error(f"Error regenerating token: {e}")
+                        time.sleep(self.token_refresh_time_buffer)
 
         # Start the token scheduler in the background
-        scheduler_thread = threading.Thread(target=token_scheduler)
-        scheduler_thread.daemon = True
-        scheduler_thread.start()
-
+        self.__scheduler_thread = threading.Thread(target=token_scheduler)
+        self.__scheduler_thread.daemon = True
+        self.__scheduler_thread.start()
+        self.logger.info("Token scheduler started")
@@ -1,16 +1,29 @@
 
-import strategies
+from src.modules.image_selection import strategies
 
-def select_image(images: list[dict], selection_strategy: str) -> dict:
+def select_image(images, selection_strategy, k: int = None, **parameters):
     '''
     Image selection strategies:
         - latest
-        - has specified coordinate most centered
-        - Lowest cloud coverage
-        - Clesest to specified date
-        - Contiains specified attribute
-        - Contains specified polygon
+        - has specified coordinate most centered (most_centered, coordinate=)
+        - Lowest cloud coverage (lowest_cloud_cover)
+        - Clesest to specified date (closest_to_date, date=)
+        - Contiains specified attribute (has_attribute, attribute=, value=)
+        - Contains specified polygon (contains_polygon, polygon=)
+        - Largest intersection with specified polygon (largest_intersection, polygon=)
+
+    selection_strategy can also be a dictionary {strategy: weight} to combine
+    several of them. The candidates (products of the API, SatelliteImage
+    objects or a CatalogueTable) are scored all at once and only the best k
+    are sorted.
+
+    Returns the best candidate, or the k best ones (best first) if k is given,
+    as products of the API or SatelliteImage objects like the input
     '''
 
-    selected_image = strategies.get_selection_strategy(selection_strategy)(images)
-    return selected_image
\ No newline at end of file
+    best = strategies.rank(images, selection_strategy, k=k if k else 1, **parameters)
+    selected_images = list(best["product"])
+
+    if k is None:
+        return selected_images[0] if selected_images else None
+    return selected_images
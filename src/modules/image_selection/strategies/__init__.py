@@ -0,0 +1,328 @@
+
+
+"""
+Image selection strategies.
+
+Every strategy scores a whole set of candidates at once: it receives a
+CatalogueTable and returns one score per row in [0, 1], higher is better. The
+scores of several strategies can be combined with weights (see
+get_selection_strategy) and the best candidates are taken with a partial sort
+(CatalogueTable.top_k), so selecting from a large catalogue never builds or
+sorts Python objects per candidate.
+
+Strategies receive the selection parameters as keyword arguments and ignore the
+ones they do not use, so the same parameters can be given to a combination of
+strategies.
+"""
+
+import numpy as np
+import shapely
+
+from src.CatalogueTable import CatalogueTable, as_table
+from src.GeoPolygon import as_geometry
+from src.modules.polygon_manager.coverage import coverage_fractions
+
+
+
+def normalize(values: np.ndarray) -> np.ndarray:
+    """
+    Scales values to [0, 1] (min-max), with the missing values (NaN) to 0
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Values to scale
+
+    Returns
+    -------
+    np.ndarray
+        Scaled values
+    """
+
+    values = np.asarray(values, dtype=np.float64)
+    scores = np.zeros(len(values))
+
+    valid = ~np.isnan(values)
+    if not valid.any():
+        return scores
+
+    low, high = values[valid].min(), values[valid].max()
+    scores[valid] = (values[valid] - low) / (high - low) if high > low else 1.0
+    return scores
+
+
+
+def date_to_seconds(dates: np.ndarray) -> np.ndarray:
+    """
+    Converts a datetime64 column to float seconds, with NaT as NaN
+    """
+
+    seconds = dates.astype("datetime64[ms]").astype(np.int64) / 1000
+    seconds[np.isnat(dates)] = np.nan
+    return seconds
+
+
+
+def latest(table: CatalogueTable, **parameters) -> np.ndarray:
+    """
+    Scores the most recently sensed images higher
+
+    Parameters
+    ----------
+    table : CatalogueTable
+        Candidates
+
+    Returns
+    -------
+    np.ndarray
+        Score of each candidate
+    """
+
+    return normalize(date_to_seconds(table["sensing_date"]))
+
+
+
+def lowest_cloud_cover(table: CatalogueTable, **parameters) -> np.ndarray:
+    """
+    Scores the images with less cloud coverage higher (1 for 0 %, 0 for 100 %
+    or unknown)
+
+    Parameters
+    ----------
+    table : CatalogueTable
+        Candidates
+
+    Returns
+    -------
+    np.ndarray
+        Score of each candidate
+    """
+
+    return np.nan_to_num(1 - np.clip(table["cloud_cover"], 0, 100) / 100, nan=0.0)
+
+
+
+def closest_to_date(table: CatalogueTable, date, **parameters) -> np.ndarray:
+    """
+    Scores the images sensed closer to a date higher
+
+    Parameters
+    ----------
+    table : CatalogueTable
+        Candidates
+    date : str, datetime or np.datetime64
+        Target date
+
+    Returns
+    -------
+    np.ndarray
+        Score of each candidate (1 for the closest one, 0 for the farthest one
+        or unknown dates)
+    """
+
+    if isinstance(date, str):
+        date = date.rstrip("Z")
+    target = np.datetime64(date, "ms").astype(np.int64) / 1000
+
+    distance = np.abs(date_to_seconds(table["sensing_date"]) - target)
+    scores = 1 - normalize(distance)
+    scores[np.isnan(distance)] = 0.0
+    return scores
+
+
+
+def most_centered(table: CatalogueTable, coordinate: tuple[float, float], **parameters) -> np.ndarray:
+    """
+    Scores the images whose footprint has a coordinate closer to its center
+    higher. The footprint is approximated by its bounds: the score is 1 at the
+    center of the bounds and decreases linearly to 0 at their edges (and
+    outside them).
+
+    Parameters
+    ----------
+    table : CatalogueTable
+        Candidates
+    coordinate : tuple[float, float]
+        Coordinate (longitude, latitude)
+
+    Returns
+    -------
+    np.ndarray
+        Score of each candidate
+    """
+
+    x, y = coordinate
+
+    half_width = (table["max_x"] - table["min_x"]) / 2
+    half_height = (table["max_y"] - table["min_y"]) / 2
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        offset = np.maximum(np.abs(x - (table["min_x"] + half_width)) / half_width,
+                            np.abs(y - (table["min_y"] + half_height)) / half_height)
+
+    return np.nan_to_num(np.clip(1 - offset, 0, 1), nan=0.0)
+
+
+
+def has_attribute(table: CatalogueTable, attribute: str, value=None, **parameters) -> np.ndarray:
+    """
+    Scores 1 the images that have an attribute (with a given value, if any)
+    and 0 the rest (see CatalogueTable.attribute_mask).
+
+    Parameters
+    ----------
+    table : CatalogueTable
+        Candidates
+    attribute : str
+        Name of the attribute (as in the API, e.g. "tileId")
+    value : optional
+        Value the attribute must have, by default None (any value)
+
+    Returns
+    -------
+    np.ndarray
+        Score of each candidate
+    """
+
+    return table.attribute_mask(attribute, value).astype(np.float64)
+
+
+
+def contains_polygon(table: CatalogueTable, polygon, **parameters) -> np.ndarray:
+    """
+    Scores 1 the images whose footprint contains a polygon and 0 the rest. The
+    bounds of the table discard most of the candidates before the exact test,
+    which only runs on the remaining footprints.
+
+    Parameters
+    ----------
+    table : CatalogueTable
+        Candidates
+    polygon : list[tuple[float]], GeoPolygon or shapely geometry
+        Polygon that must be contained
+
+    Returns
+    -------
+    np.ndarray
+        Score of each candidate
+    """
+
+    polygon = as_geometry(polygon)
+    min_x, min_y, max_x, max_y = polygon.bounds
+
+    scores = np.zeros(len(table))
+    candidates = np.flatnonzero((table["min_x"] <= min_x) & (table["min_y"] <= min_y) &
+                                (table["max_x"] >= max_x) & (table["max_y"] >= max_y))
+
+    if len(candidates):
+        footprints = table.geometries(candidates)
+        valid = ~shapely.is_missing(footprints)
+        scores[candidates[valid]] = shapely.contains(footprints[valid], polygon)
+
+    return scores
+
+
+
+def largest_intersection(table: CatalogueTable, polygon, **parameters) -> np.ndarray:
+    """
+    Scores the images by the fraction of a polygon their footprint covers
+
+    Parameters
+    ----------
+    table : CatalogueTable
+        Candidates
+    polygon : list[tuple[float]], GeoPolygon or shapely geometry
+        Polygon to cover
+
+    Returns
+    -------
+    np.ndarray
+        Score of each candidate (1 if it covers the whole polygon)
+    """
+
+    return coverage_fractions(table, polygon)
+
+
+
+selection_strategies = {
+    "latest": latest,
+    "lowest_cloud_cover": lowest_cloud_cover,
+    "closest_to_date": closest_to_date,
+    "most_centered": most_centered,
+    "has_attribute": has_attribute,
+    "contains_polygon": contains_polygon,
+    "largest_intersection": largest_intersection
+}
+
+
+
+def get_selection_strategy(strategy):
+    """
+    Gets a scoring function from the name of a strategy, or from several
+    strategies and their weights
+
+    Parameters
+    ----------
+    strategy : str, callable or dict
+        Name of a strategy in selection_strategies, a scoring function, or a
+        dictionary {strategy: weight} to add the weighted scores of several
+        strategies
+
+    Returns
+    -------
+    callable
+        Function (table, **parameters) -> np.ndarray with the score of each
+        candidate
+
+    Raises
+    ------
+    ValueError
+        If a strategy does not exist
+    """
+
+    if callable(strategy):
+        return strategy
+
+    if isinstance(strategy, str):
+        if strategy not in selection_strategies:
+            raise ValueError(f"Unknown selection strategy: {strategy}, "
+                             f"available: {', '.join(selection_strategies)}")
+        return selection_strategies[strategy]
+
+    weighted = [(get_selection_strategy(name), weight) for name, weight in strategy.items()]
+
+    def combined(table: CatalogueTable, **parameters) -> np.ndarray:
+        scores = np.zeros(len(table))
+        for scorer, weight in weighted:
+            scores += weight * scorer(table, **parameters)
+        return scores
+
+    return combined
+
+
+
+def rank(images, strategy, k: int = 1, **parameters) -> CatalogueTable:
+    """
+    Gets the k best candidates for a strategy, best first
+
+    Parameters
+    ----------
+    images : CatalogueTable, list[dict] or list[SatelliteImage]
+        Candidates
+    strategy : str, callable or dict
+        Strategy, see get_selection_strategy
+    k : int, optional
+        Number of candidates to get, by default 1
+    **parameters
+        Parameters of the strategies (date, coordinate, attribute, value,
+        polygon)
+
+    Returns
+    -------
+    CatalogueTable
+        The k best candidates
+    """
+
+    table = as_table(images)
+    scores = get_selection_strategy(strategy)(table, **parameters)
+    return table.top_k(scores, k, largest=True)
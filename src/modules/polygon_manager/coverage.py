@@ -0,0 +1,217 @@
+
+
+import logging
+from dataclasses import dataclass
+
+import numpy as np
+import shapely
+from shapely.geometry.base import BaseGeometry
+
+from config.settings import settings
+from src.CatalogueTable import CatalogueTable, as_table
+from src.GeoPolygon import as_geometry
+
+
+@dataclass
+class MosaicPlan:
+    """
+    Products chosen to cover an area of interest
+
+    Attributes
+    ----------
+    table : CatalogueTable
+        Chosen products, in the order they were picked
+    gains : np.ndarray
+        Fraction of the AOI newly covered by each chosen product
+    coverage : float
+        Fraction of the AOI covered by all of them
+    uncovered : BaseGeometry
+        Part of the AOI that is not covered
+    """
+
+    table: CatalogueTable
+    gains: np.ndarray
+    coverage: float
+    uncovered: BaseGeometry
+
+    def images(self) -> list:
+        """ SatelliteImage objects of the chosen products """
+        return self.table.images()
+
+
+
+def candidate_rows(table: CatalogueTable, aoi: BaseGeometry) -> np.ndarray:
+    """
+    Gets the rows whose footprint bounds intersect the bounds of an AOI (the
+    only ones that can cover part of it)
+    """
+
+    min_x, min_y, max_x, max_y = aoi.bounds
+    return np.flatnonzero((table["min_x"] <= max_x) & (table["max_x"] >= min_x) &
+                          (table["min_y"] <= max_y) & (table["max_y"] >= min_y))
+
+
+
+def coverage_fractions(images, aoi) -> np.ndarray:
+    """
+    Computes the fraction of an AOI covered by the footprint of every
+    candidate, with vectorized shapely operations over the candidates whose
+    bounds intersect the AOI
+
+    Parameters
+    ----------
+    images : CatalogueTable, list[dict] or list[SatelliteImage]
+        Candidates
+    aoi : list[tuple[float]], GeoPolygon or shapely geometry
+        Area of interest
+
+    Returns
+    -------
+    np.ndarray
+        Covered fraction (0 to 1) of the AOI for each candidate
+    """
+
+    table = as_table(images)
+    aoi = as_geometry(aoi)
+
+    fractions = np.zeros(len(table))
+    if aoi.area == 0:
+        return fractions
+
+    rows = candidate_rows(table, aoi)
+    footprints = table.geometries(rows)
+    valid = ~shapely.is_missing(footprints)
+
+    fractions[rows[valid]] = shapely.area(shapely.intersection(footprints[valid], aoi)) / aoi.area
+    return fractions
+
+
+
+def product_costs(table: CatalogueTable,
+                  cloud_weight: float = None,
+                  date_weight: float = None,
+                  size_weight: float = None) -> np.ndarray:
+    """
+    Computes the cost of using every product in a mosaic: 1 per product plus
+    its weighted cloud cover, age (relative to the newest candidate) and
+    ContentLength (relative to the biggest candidate). Unknown values cost the
+    most.
+
+    Parameters
+    ----------
+    table : CatalogueTable
+        Candidates
+    cloud_weight, date_weight, size_weight : float, optional
+        Weights of each term, by default the mosaic settings
+
+    Returns
+    -------
+    np.ndarray
+        Cost of each candidate
+    """
+
+    cloud_weight = settings.mosaic_cloud_weight if cloud_weight is None else cloud_weight
+    date_weight = settings.mosaic_date_weight if date_weight is None else date_weight
+    size_weight = settings.mosaic_size_weight if size_weight is None else size_weight
+
+    def relative(values: np.ndarray) -> np.ndarray:
+        # 0 for the smallest value, 1 for the biggest one or missing values
+        values = values.astype(np.float64)
+        valid = ~np.isnan(values)
+        scaled = np.ones(len(values))
+        if valid.any():
+            low, high = values[valid].min(), values[valid].max()
+            scaled[valid] = (values[valid] - low) / (high - low) if high > low else 0.0
+        return scaled
+
+    cloud = np.nan_to_num(np.clip(table["cloud_cover"], 0, 100) / 100, nan=1.0)
+
+    dates = table["sensing_date"]
+    age = -(dates.astype("datetime64[ms]").astype(np.int64).astype(np.float64))
+    age[np.isnat(dates)] = np.nan
+
+    size = table["content_length"].astype(np.float64)
+    size[size < 0] = np.nan
+
+    return 1 + cloud_weight * cloud + date_weight * relative(age) + size_weight * relative(size)
+
+
+
+def plan_mosaic(images,
+                aoi,
+                min_coverage: float = None,
+                max_products: int = None,
+                cloud_weight: float = None,
+                date_weight: float = None,
+                size_weight: float = None) -> MosaicPlan:
+    """
+    Chooses a small, cheap set of products that together cover an AOI, before
+    resolving or downloading any of them.
+
+    Greedy weighted set cover: each step picks the product with the most
+    newly covered area per cost (see product_costs), until min_coverage of
+    the AOI is covered, no product adds area or max_products are chosen. The
+    new area of every remaining candidate is computed at once with shapely,
+    and candidates that stop adding area are dropped.
+
+    Parameters
+    ----------
+    images : CatalogueTable, list[dict] or list[SatelliteImage]
+        Candidates
+    aoi : list[tuple[float]], GeoPolygon or shapely geometry
+        Area of interest
+    min_coverage : float, optional
+        Fraction of the AOI to cover, by default settings.mosaic_min_coverage
+    max_products : int, optional
+        Maximum number of products, by default None (no limit)
+    cloud_weight, date_weight, size_weight : float, optional
+        Weights of the product costs, by default the mosaic settings
+
+    Returns
+    -------
+    MosaicPlan
+        Chosen products and the coverage they reach
+    """
+
+    logger = logging.getLogger(__name__)
+
+    table = as_table(images)
+    aoi = as_geometry(aoi)
+    min_coverage = settings.mosaic_min_coverage if min_coverage is None else min_coverage
+
+    rows = candidate_rows(table, aoi)
+    footprints = table.geometries(rows)
+    valid = ~shapely.is_missing(footprints)
+    rows, footprints = rows[valid], footprints[valid]
+    shapely.prepare(footprints)
+
+    costs = product_costs(table, cloud_weight, date_weight, size_weight)[rows]
+
+    uncovered = aoi
+    chosen, gains = [], []
+    target_area = (1 - min_coverage) * aoi.area
+
+    while len(rows) and uncovered.area > target_area and (max_products is None or len(chosen) < max_products):
+        new_areas = shapely.area(shapely.intersection(footprints, uncovered))
+
+        # Candidates that add no area now never will
+        useful = new_areas > 0
+        if not useful.any():
+            break
+        rows, footprints, costs, new_areas = rows[useful], footprints[useful], costs[useful], new_areas[useful]
+
+        best = int(np.argmax(new_areas / costs))
+        chosen.append(rows[best])
+        gains.append(new_areas[best] / aoi.area)
+        uncovered = uncovered.difference(footprints[best])
+
+        keep = np.arange(len(rows)) != best
+        rows, footprints, costs = rows[keep], footprints[keep], costs[keep]
+
+    coverage = 1 - uncovered.area / aoi.area if aoi.area else 0.0
+    logger.info(f"Mosaic of {len(chosen)} products covers {coverage:.1%} of the AOI")
+
+    return MosaicPlan(table=table.take(chosen),
+                      gains=np.array(gains),
+                      coverage=coverage,
+                      uncovered=uncovered)
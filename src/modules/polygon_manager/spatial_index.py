@@ -0,0 +1,269 @@
+
+
+import logging
+
+import numpy as np
+import shapely
+from shapely import STRtree
+
+from src.APIManager import APIManager
+from src.CatalogueCache import CatalogueCache
+from src.CatalogueTable import CatalogueTable
+from src.GeoPolygon import as_geometry
+
+
+class SpatialIndex:
+    """
+    Spatial index (STR packed R-tree) over the footprints of a set of
+    products, to answer which products intersect, cover or are close to an
+    area of interest (AOI) without going over every footprint.
+
+    The index can be built from a catalogue request (CatalogueTable), from raw
+    products, or from everything stored in a CatalogueCache, so coverage
+    questions over already downloaded catalogue results need no new request.
+    The results are CatalogueTable rows, ready to be ranked with the image
+    selection strategies.
+
+    AOIs can be given as a list of coordinates, a GeoPolygon or any shapely
+    geometry; the bulk methods (query_bulk, nearest) take several of them and
+    query the tree once.
+
+    Attributes
+    ----------
+    table : CatalogueTable
+        Indexed products
+    tree : STRtree
+        Tree over the footprints of the products that have one
+
+    Methods
+    -------
+    from_products(products: list[dict]) -> SpatialIndex
+        Builds the index over products of the API
+    from_cache(cache: CatalogueCache = None) -> SpatialIndex
+        Builds the index over every product of a catalogue cache
+    query(aoi, predicate="intersects") -> np.ndarray
+        Gets the rows whose footprint satisfies a predicate with an AOI
+    query_bulk(aois, predicate="intersects") -> list[np.ndarray]
+        Same as query, for several AOIs at once
+    intersects(aoi) -> CatalogueTable
+        Gets the products whose footprint intersects an AOI
+    covering(aoi) -> CatalogueTable
+        Gets the products whose footprint contains an AOI
+    within(aoi) -> CatalogueTable
+        Gets the products whose footprint is inside an AOI
+    nearest(aois, max_distance=None) -> np.ndarray
+        Gets the row with the closest footprint to each AOI
+    """
+
+
+
+    def __init__(self, table: CatalogueTable):
+        """
+        Parameters
+        ----------
+        table : CatalogueTable
+            Products to index (rows without a footprint are skipped)
+        """
+
+        self.logger = logging.getLogger(__name__)
+
+        self.table = table
+
+        geometries = table.geometries()
+        self.__rows = np.flatnonzero(~shapely.is_missing(geometries))
+        self.tree = STRtree(geometries[self.__rows])
+
+        self.logger.debug(f"Spatial index built over {len(self.__rows)} of {len(table)} products")
+
+
+
+    @classmethod
+    def from_products(cls, products: list[dict], api_manager: APIManager = None) -> "SpatialIndex":
+        """
+        Builds the index over products of the API
+
+        Parameters
+        ----------
+        products : list[dict]
+            Products as returned by the API
+        api_manager : APIManager, optional
+            APIManager given to the images built from the results
+
+        Returns
+        -------
+        SpatialIndex
+            Index over the products
+        """
+
+        return cls(CatalogueTable.from_products(products, api_manager=api_manager))
+
+
+
+    @classmethod
+    def from_cache(cls, cache: CatalogueCache = None, api_manager: APIManager = None) -> "SpatialIndex":
+        """
+        Builds the index over every product stored in a catalogue cache that
+        is not stale
+
+        Parameters
+        ----------
+        cache : CatalogueCache, optional
+            Catalogue cache, by default a CatalogueCache with the settings
+        api_manager : APIManager, optional
+            APIManager given to the images built from the results
+
+        Returns
+        -------
+        SpatialIndex
+            Index over the cached products
+        """
+
+        cache = cache if cache else CatalogueCache()
+        return cls.from_products(cache.all_products(), api_manager=api_manager)
+
+
+
+    def __len__(self) -> int:
+        return len(self.__rows)
+
+
+
+    def query(self, aoi, predicate: str = "intersects") -> np.ndarray:
+        """
+        Gets the rows of the table whose footprint satisfies a predicate with
+        an AOI
+
+        Parameters
+        ----------
+        aoi : list[tuple[float]], GeoPolygon or shapely geometry
+            Area of interest
+        predicate : str, optional
+            Shapely predicate evaluated as predicate(aoi, footprint), e.g.
+            "intersects", "within" (the footprint covers the AOI) or
+            "contains" (the footprint is inside the AOI), by default
+            "intersects"
+
+        Returns
+        -------
+        np.ndarray
+            Sorted indexes of the matching rows of the table
+        """
+
+        return np.sort(self.__rows[self.tree.query(as_geometry(aoi), predicate=predicate)])
+
+
+
+    def query_bulk(self, aois: list, predicate: str = "intersects") -> list[np.ndarray]:
+        """
+        Same as query, for several AOIs with a single query to the tree
+
+        Parameters
+        ----------
+        aois : list
+            Areas of interest
+        predicate : str, optional
+            Shapely predicate, see query, by default "intersects"
+
+        Returns
+        -------
+        list[np.ndarray]
+            Sorted indexes of the matching rows of each AOI
+        """
+
+        geometries = np.array([as_geometry(aoi) for aoi in aois], dtype=object)
+        aoi_indexes, tree_indexes = self.tree.query(geometries, predicate=predicate)
+
+        # Group the matches of every AOI
+        order = np.lexsort((self.__rows[tree_indexes], aoi_indexes))
+        rows = self.__rows[tree_indexes][order]
+        splits = np.searchsorted(aoi_indexes[order], np.arange(1, len(geometries)))
+
+        return np.split(rows, splits)
+
+
+
+    def intersects(self, aoi) -> CatalogueTable:
+        """
+        Gets the products whose footprint intersects an AOI
+
+        Parameters
+        ----------
+        aoi : list[tuple[float]], GeoPolygon or shapely geometry
+            Area of interest
+
+        Returns
+        -------
+        CatalogueTable
+            Matching products
+        """
+
+        return self.table.take(self.query(aoi, "intersects"))
+
+
+
+    def covering(self, aoi) -> CatalogueTable:
+        """
+        Gets the products whose footprint fully contains an AOI
+
+        Parameters
+        ----------
+        aoi : list[tuple[float]], GeoPolygon or shapely geometry
+            Area of interest
+
+        Returns
+        -------
+        CatalogueTable
+            Matching products
+        """
+
+        return self.table.take(self.query(aoi, "within"))
+
+
+
+    def within(self, aoi) -> CatalogueTable:
+        """
+        Gets the products whose footprint is fully inside an AOI
+
+        Parameters
+        ----------
+        aoi : list[tuple[float]], GeoPolygon or shapely geometry
+            Area of interest
+
+        Returns
+        -------
+        CatalogueTable
+            Matching products
+        """
+
+        return self.table.take(self.query(aoi, "contains"))
+
+
+
+    def nearest(self, aois: list, max_distance: float = None) -> np.ndarray:
+        """
+        Gets the row with the closest footprint to each AOI
+
+        Parameters
+        ----------
+        aois : list
+            Areas of interest (or points, e.g. shapely Point objects)
+        max_distance : float, optional
+            Maximum distance (in degrees) to look for a footprint, by default
+            None (no limit)
+
+        Returns
+        -------
+        np.ndarray
+            Row of the closest footprint of each AOI, -1 if there is none
+            within max_distance
+        """
+
+        geometries = np.array([as_geometry(aoi) for aoi in aois], dtype=object)
+        nearest = np.full(len(geometries), -1, dtype=np.intp)
+
+        if not len(self.__rows):
+            return nearest
+
+        aoi_indexes, tree_indexes = self.tree.query_nearest(geometries, max_distance=max_distance, all_matches=False)
+        nearest[aoi_indexes] = self.__rows[tree_indexes]
+        return nearest
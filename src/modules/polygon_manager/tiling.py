@@ -0,0 +1,230 @@
+
+
+import math
+
+import numpy as np
+import shapely
+from shapely.geometry import box
+from shapely.geometry.base import BaseGeometry
+
+from config.settings import settings
+from src.GeoPolygon import as_geometry
+
+
+
+def vertex_count(geometry: BaseGeometry) -> int:
+    """ Number of coordinates of a geometry """
+    return int(shapely.get_num_coordinates(geometry))
+
+
+
+def fit_vertex_budget(geometry: BaseGeometry, max_vertices: int) -> BaseGeometry:
+    """
+    Simplifies a geometry until it has at most max_vertices coordinates,
+    without uncovering any part of it: the simplified shape is grown by the
+    simplification tolerance, so the result always contains the original
+    geometry. If that is not enough, its bounding box is used.
+
+    Parameters
+    ----------
+    geometry : BaseGeometry
+        Geometry to simplify
+    max_vertices : int
+        Maximum number of coordinates
+
+    Returns
+    -------
+    BaseGeometry
+        Geometry covering the original one with at most max_vertices
+        coordinates (or its bounding box)
+    """
+
+    if vertex_count(geometry) <= max_vertices:
+        return geometry
+
+    min_x, min_y, max_x, max_y = geometry.bounds
+    extent = max(max_x - min_x, max_y - min_y)
+    tolerance = extent / 1000
+
+    while tolerance < extent:
+        simplified = shapely.buffer(shapely.simplify(geometry, tolerance), tolerance,
+                                    quad_segs=1, join_style="mitre")
+        if vertex_count(simplified) <= max_vertices:
+            return simplified
+        tolerance *= 2
+
+    return geometry.envelope
+
+
+
+def grid_cells(aoi: BaseGeometry, cells: int) -> list[BaseGeometry]:
+    """
+    Splits an AOI with a regular grid of about the given number of cells
+    (square in degrees), clipping every cell to the AOI
+
+    Parameters
+    ----------
+    aoi : BaseGeometry
+        Area of interest
+    cells : int
+        Approximate number of cells of the grid
+
+    Returns
+    -------
+    list[BaseGeometry]
+        Parts of the AOI in each non empty cell
+    """
+
+    min_x, min_y, max_x, max_y = aoi.bounds
+    width, height = max(max_x - min_x, 1e-9), max(max_y - min_y, 1e-9)
+
+    columns = max(1, round(math.sqrt(cells * width / height)))
+    rows = max(1, math.ceil(cells / columns))
+
+    xs = np.linspace(min_x, max_x, columns + 1)
+    ys = np.linspace(min_y, max_y, rows + 1)
+    boxes = shapely.box(*np.meshgrid(xs[:-1], ys[:-1]), *np.meshgrid(xs[1:], ys[1:])).ravel()
+
+    parts = shapely.intersection(boxes, aoi)
+    return [part for part in parts if not part.is_empty and part.area > 0]
+
+
+
+def quadtree_cells(aoi: BaseGeometry, max_vertices: int, max_cell_area: float, max_depth: int) -> list[BaseGeometry]:
+    """
+    Splits an AOI in quad-tree cells: a cell is split in four while the part
+    of the AOI inside it has more than max_vertices coordinates or its box is
+    bigger than max_cell_area, down to max_depth levels. Complex borders get
+    small cells and simple interiors big ones.
+
+    Parameters
+    ----------
+    aoi : BaseGeometry
+        Area of interest
+    max_vertices : int
+        Maximum number of coordinates of a cell
+    max_cell_area : float
+        Maximum area of the box of a cell, in squared degrees
+    max_depth : int
+        Maximum number of splits
+
+    Returns
+    -------
+    list[BaseGeometry]
+        Parts of the AOI in each leaf cell
+    """
+
+    shapely.prepare(aoi)
+    cells = []
+    pending = [(box(*aoi.bounds), 0)]
+
+    while pending:
+        cell, depth = pending.pop()
+
+        if aoi.contains(cell):
+            part = cell
+        else:
+            part = cell.intersection(aoi)
+            if part.is_empty or part.area == 0:
+                continue
+
+        if depth >= max_depth or (vertex_count(part) <= max_vertices and cell.area <= max_cell_area):
+            cells.append(part)
+            continue
+
+        min_x, min_y, max_x, max_y = cell.bounds
+        mid_x, mid_y = (min_x + max_x) / 2, (min_y + max_y) / 2
+        pending += [(box(min_x, min_y, mid_x, mid_y), depth + 1),
+                    (box(mid_x, min_y, max_x, mid_y), depth + 1),
+                    (box(min_x, mid_y, mid_x, max_y), depth + 1),
+                    (box(mid_x, mid_y, max_x, max_y), depth + 1)]
+
+    return cells
+
+
+
+def tile_aoi(aoi,
+             method: str = "quadtree",
+             max_vertices: int = None,
+             max_cell_area: float = None,
+             cells: int = None) -> list[BaseGeometry]:
+    """
+    Splits a large AOI in cells that can be queried independently, each one
+    simplified to at most max_vertices coordinates so the requests stay short.
+    The cells cover the whole AOI (simplified cells can exceed it slightly).
+
+    Parameters
+    ----------
+    aoi : list[tuple[float]], GeoPolygon or shapely geometry
+        Area of interest
+    method : str, optional
+        "quadtree" (adaptive cells, see quadtree_cells) or "grid" (regular
+        grid, see grid_cells), by default "quadtree"
+    max_vertices : int, optional
+        Maximum number of coordinates of a cell, by default
+        settings.tiling_max_vertices
+    max_cell_area : float, optional
+        Maximum area of a cell (quadtree), by default
+        settings.tiling_max_cell_area
+    cells : int, optional
+        Number of cells (grid), by default the number needed to keep them under
+        max_cell_area
+
+    Returns
+    -------
+    list[BaseGeometry]
+        Cells of the AOI
+
+    Raises
+    ------
+    ValueError
+        If the method does not exist
+    """
+
+    aoi = as_geometry(aoi)
+    max_vertices = max_vertices if max_vertices else settings.tiling_max_vertices
+    max_cell_area = max_cell_area if max_cell_area else settings.tiling_max_cell_area
+
+    match method:
+        case "quadtree":
+            parts = quadtree_cells(aoi, max_vertices, max_cell_area, settings.tiling_max_depth)
+        case "grid":
+            cells = cells if cells else math.ceil(aoi.envelope.area / max_cell_area)
+            parts = grid_cells(aoi, min(cells, settings.tiling_max_cells))
+        case _:
+            raise ValueError(f"Unknown tiling method: {method}, available: quadtree, grid")
+
+    return [fit_vertex_budget(part, max_vertices) for part in parts]
+
+
+
+def to_odata_polygon(geometry: BaseGeometry) -> tuple[str, str]:
+    """
+    Converts a geometry to the polygon_type and value of a polygon filter of
+    CopernicusRequest.add_filter (e.g. "POLYGON" and "(x y, x y, ...)")
+
+    Parameters
+    ----------
+    geometry : BaseGeometry
+        Geometry to convert
+
+    Returns
+    -------
+    tuple[str, str]
+        Type of the geometry and its WKT coordinates
+    """
+
+    wkt = shapely.to_wkt(geometry, rounding_precision=6, trim=True)
+    polygon_type, coordinates = wkt.split(" ", 1)
+
+    return polygon_type, coordinates.strip()[1:-1]
+
+
+
+def from_odata_polygon(polygon_type: str, value: str) -> BaseGeometry:
+    """
+    Converts the polygon_type and value of a polygon filter back to a geometry
+    (inverse of to_odata_polygon)
+    """
+
+    return shapely.from_wkt(f"{polygon_type}({value})")
@@ -0,0 +1,63 @@
+import socket
+
+import pytest
+import requests
+
+from src.APIManager import APIManager
+from src.SatelliteImage import SatelliteImage
+
+
+@pytest.fixture
+def no_network(monkeypatch):
+    """
+    Makes every connection attempt fail, recording it
+    """
+
+    calls = []
+
+    def refuse(name):
+        def blocked(*args, **kwargs):
+            calls.append(name)
+            raise AssertionError(f"Unexpected network call: {name}")
+        return blocked
+
+    monkeypatch.setattr(socket.socket, "connect", refuse("socket.connect"))
+    monkeypatch.setattr(requests.Session, "send", refuse("requests.Session.send"))
+
+    return calls
+
+
+
+def make_products(count: int) -> list[dict]:
+    """
+    Builds minimal products with the structure of the catalogue responses
+    """
+
+    return [{
+        "Id": f"00000000-0000-0000-0000-{index:012d}",
+        "Name": f"S2A_MSIL2A_20230101T000000_N0509_R000_T00AAA_{index:08d}.SAFE",
+        "ContentLength": 1024,
+        "PublicationDate": "2023-01-01T00:00:00.000Z",
+        "ContentDate": {"Start": "2023-01-01T00:00:00.000Z", "End": "2023-01-01T00:00:00.000Z"},
+        "GeoFootprint": {"type": "Polygon", "coordinates": [[[0, 0], [1, 0], [1, 1], [0, 0]]]},
+        "Attributes": [{"Name": "cloudCover", "Value": 10.0, "ValueType": "Double"}]
+    } for index in range(count)]
+
+
+
+def test_building_images_makes_no_network_calls(no_network):
+    products = make_products(10_000)
+
+    images = [SatelliteImage(**product) for product in products]
+
+    assert len(images) == 10_000
+    assert all(image.api_manager is APIManager.shared() for image in images)
+    assert no_network == []
+
+
+
+def test_shared_returns_the_same_instance(no_network):
+    assert APIManager.shared() is APIManager.shared()
+    assert APIManager.shared("other") is APIManager.shared("other")
+    assert APIManager.shared("other") is not APIManager.shared()
+    assert no_network == []
@@ -0,0 +1,86 @@
+import io
+import json
+
+import pytest
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
+
+from config.settings import settings
+from src.CopernicusRequest import CopernicusRequest
+
+pytest.importorskip("ijson")
+
+
+class CutStream(io.BytesIO):
+    """
+    Raw response stream that fails after cut bytes, as a dropped connection
+    """
+
+    decode_content = False
+
+    def __init__(self, data: bytes, cut: int, error: Exception):
+        super().__init__(data)
+        self.cut = cut
+        self.error = error
+
+    def read(self, size=-1):
+        if self.tell() >= self.cut:
+            raise self.error
+        size = self.cut - self.tell() if size is None or size < 0 else min(size, self.cut - self.tell())
+        return super().read(size)
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class StreamedResponse:
+    def __init__(self, raw):
+        self.raw = raw
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+    def __bool__(self):
+        return True
+
+
+class CutAPIManager:
+    """
+    APIManager answering every page with a stream cut in the middle of it
+    """
+
+    def __init__(self, error: Exception, products: int = 50):
+        page = {'value': [{'Id': str(index), 'Name': f"product-{index}"} for index in range(products)]}
+        self.data = json.dumps(page).encode()
+        self.error = error
+        self.responses = []
+
+    def make_request(self, url, stream=False, **kwargs):
+        response = StreamedResponse(CutStream(self.data, len(self.data) // 2, self.error))
+        self.responses.append(response)
+        return response
+
+
+
+@pytest.fixture(autouse=True)
+def streaming(monkeypatch):
+    monkeypatch.setattr(settings, "catalogue_streaming", True)
+
+
+
+@pytest.mark.parametrize("error", [
+    ProtocolError("Connection broken", ConnectionResetError()),
+    ReadTimeoutError(None, "https://example.com", "Read timed out"),
+])
+def test_stream_cut_mid_page_marks_the_request_incomplete(error):
+    api_manager = CutAPIManager(error)
+    request = CopernicusRequest(lazy=True, api_manager=api_manager)
+
+    products = list(request.iter_products())
+
+    assert 0 < len(products) < 50
+    assert not request.complete
+    assert len(api_manager.responses) == 1
+    assert api_manager.responses[0].closed